@@ -0,0 +1,263 @@
+"""
+Streaming archive export and import of RequestLog.
+
+Archives are compressed NDJSON: a header line, then one JSON object per
+request. A ``.gz`` file uses gzip from the standard library. A ``.zst``
+file uses zstd and needs the optional ``zstandard`` package.
+
+Export walks the table with keyset pagination on ``(timestamp, id)``.
+Every page is a cheap indexed range query, and memory stays constant no
+matter how many rows match. With ``delete=True`` each page is deleted
+once it has been flushed to disk. A crash mid-export then leaves a
+readable archive containing every row that was deleted.
+
+Rows keep their primary keys. Importing an archive puts them back
+behind the rollup and detection watermarks, so they are not counted a
+second time. Rows whose id already exists are skipped, which makes an
+import safe to repeat.
+
+Paths and user agents are written as strings, not lookup table ids, so
+an archive can be loaded into any database.
+"""
+
+import gzip
+import io
+import json
+import time
+import zlib
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .interning import encode_request_logs, paths, user_agents
+from .models import RequestLog
+
+ARCHIVE_FORMAT = 'ip_tracking.requestlog'
+ARCHIVE_VERSION = 2
+
+# Version 1 archives lack sample_weight; their rows import with weight 1
+READABLE_VERSIONS = (1, 2)
+
+ARCHIVE_FIELDS = (
+    'id', 'timestamp', 'ip_address', 'path', 'method', 'user_agent',
+    'country', 'city', 'geo_pending', 'sample_weight',
+)
+
+# values_list() columns behind ARCHIVE_FIELDS
+QUERY_FIELDS = tuple(
+    {'path': 'path_ref_id', 'user_agent': 'user_agent_ref_id'}.get(field, field)
+    for field in ARCHIVE_FIELDS
+)
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+class ArchiveError(Exception):
+    """Raised for unreadable or unsupported archive files."""
+
+
+def open_archive(path, mode):
+    """
+    Open a compressed archive as a text stream.
+
+    Args:
+        path (str): File path; ``.zst`` selects zstd, anything else gzip
+        mode (str): 'w' to write, 'r' to read
+
+    Returns:
+        tuple: (text stream, flush callable that forces the data
+            written so far out to the file)
+    """
+    if str(path).endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ArchiveError(
+                'zstd archives need the "zstandard" package; '
+                'use a .gz file instead'
+            )
+        raw = open(path, mode + 'b')
+        if mode == 'w':
+            stream = zstandard.ZstdCompressor().stream_writer(raw)
+            text = io.TextIOWrapper(stream, encoding='utf-8')
+
+            def flush():
+                text.flush()
+                stream.flush(zstandard.FLUSH_BLOCK)
+                raw.flush()
+            return text, flush
+        stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        return io.TextIOWrapper(stream, encoding='utf-8'), None
+
+    if mode == 'w':
+        stream = gzip.open(path, 'wb')
+        text = io.TextIOWrapper(stream, encoding='utf-8')
+
+        def flush():
+            text.flush()
+            # Sync flush: everything so far is decodable on its own
+            stream.flush(zlib.Z_SYNC_FLUSH)
+        return text, flush
+    return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8'), None
+
+
+def export_request_logs(path, before=None, after=None,
+                        batch_size=DEFAULT_BATCH_SIZE, delete=False,
+                        progress=None):
+    """
+    Stream matching RequestLog rows into a compressed archive.
+
+    Args:
+        path (str): Archive file to create (``.gz`` or ``.zst``)
+        before (datetime): Only rows older than this
+        after (datetime): Only rows at or after this
+        batch_size (int): Rows per page (and per DELETE)
+        delete (bool): Delete each page once it is written
+        progress (callable): Called as progress(exported so far)
+
+    Returns:
+        dict: exported, deleted, seconds, rows_per_second
+    """
+    rows = RequestLog.objects.order_by('timestamp', 'id')
+    if before is not None:
+        rows = rows.filter(timestamp__lt=before)
+    if after is not None:
+        rows = rows.filter(timestamp__gte=after)
+
+    started = time.perf_counter()
+    exported = deleted = 0
+    last = None
+
+    text, flush = open_archive(path, 'w')
+    with text:
+        _write_line(text, {
+            'format': ARCHIVE_FORMAT,
+            'version': ARCHIVE_VERSION,
+            'fields': ARCHIVE_FIELDS,
+        })
+        while True:
+            page = rows
+            if last is not None:
+                # Keyset pagination: resume after the last (timestamp, id)
+                page = page.filter(
+                    Q(timestamp__gt=last[0])
+                    | Q(timestamp=last[0], id__gt=last[1])
+                )
+            page = list(page.values_list(*QUERY_FIELDS)[:batch_size])
+            if not page:
+                break
+
+            records = [dict(zip(ARCHIVE_FIELDS, values)) for values in page]
+            path_values = paths.values_for(r['path'] for r in records)
+            agent_values = user_agents.values_for(
+                r['user_agent'] for r in records
+            )
+            for record in records:
+                record['timestamp'] = record['timestamp'].isoformat()
+                record['path'] = path_values.get(record['path'])
+                record['user_agent'] = agent_values.get(record['user_agent'])
+                _write_line(text, record)
+            exported += len(page)
+            last = (page[-1][1], page[-1][0])
+
+            if delete:
+                # Only rows that have reached the file are deleted
+                flush()
+                chunk = RequestLog.objects.filter(
+                    id__in=[values[0] for values in page]
+                )
+                deleted += chunk._raw_delete(chunk.db)
+
+            if progress:
+                progress(exported)
+            if len(page) < batch_size:
+                break
+
+    return _report(started, exported=exported, deleted=deleted)
+
+
+def import_request_logs(path, batch_size=DEFAULT_BATCH_SIZE, keep_ids=True,
+                        progress=None):
+    """
+    Bulk-load an archive written by ``export_request_logs()``.
+
+    Args:
+        path (str): Archive file (``.gz`` or ``.zst``)
+        batch_size (int): Rows per INSERT
+        keep_ids (bool): Restore the original primary keys. With False
+            the rows get new ids, and the next rollup counts them again.
+        progress (callable): Called as progress(read so far)
+
+    Returns:
+        dict: read, imported, truncated, seconds, rows_per_second
+    """
+    started = time.perf_counter()
+    read = imported = 0
+    truncated = False
+    batch = []
+
+    def write(batch):
+        if keep_ids:
+            # Skip rows already present (e.g. an archive imported twice)
+            existing = set(RequestLog.objects.filter(
+                id__in=[record['id'] for record in batch]
+            ).values_list('id', flat=True))
+            batch = [record for record in batch
+                     if record['id'] not in existing]
+        RequestLog.objects.bulk_create(
+            [RequestLog(**record) for record in encode_request_logs(batch)],
+            batch_size=batch_size, ignore_conflicts=keep_ids
+        )
+        return len(batch)
+
+    text, _ = open_archive(path, 'r')
+    with text:
+        lines = iter(text)
+        _read_header(lines)
+        try:
+            for line in lines:
+                record = json.loads(line)
+                if not keep_ids:
+                    record.pop('id', None)
+                record['timestamp'] = parse_datetime(record['timestamp'])
+                batch.append(record)
+                read += 1
+                if len(batch) >= batch_size:
+                    imported += write(batch)
+                    batch = []
+                    if progress:
+                        progress(read)
+        except (EOFError, zlib.error, json.JSONDecodeError):
+            # Export interrupted mid-write: keep the complete records
+            truncated = True
+
+    if batch:
+        imported += write(batch)
+    return _report(started, read=read, imported=imported, truncated=truncated)
+
+
+def _read_header(lines):
+    try:
+        header = json.loads(next(lines))
+    except (StopIteration, ValueError, EOFError, OSError):
+        raise ArchiveError('Not a request log archive')
+    if header.get('format') != ARCHIVE_FORMAT:
+        raise ArchiveError('Not a request log archive')
+    if header.get('version') not in READABLE_VERSIONS:
+        raise ArchiveError(
+            f"Unsupported archive version {header.get('version')}"
+        )
+    return header
+
+
+def _write_line(text, record):
+    text.write(json.dumps(record, separators=(',', ':')))
+    text.write('\n')
+
+
+def _report(started, **counts):
+    seconds = time.perf_counter() - started
+    rows = counts.get('exported', counts.get('read', 0))
+    counts['seconds'] = round(seconds, 3)
+    counts['rows_per_second'] = round(rows / seconds) if seconds else 0
+    return counts
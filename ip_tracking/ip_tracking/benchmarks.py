@@ -0,0 +1,423 @@
+"""
+Throughput and latency benchmarks for the request tracking stack.
+
+Each scenario replays a synthetic traffic mix through the configured
+``TrackingMiddleware`` (the former ``IPTrackingMiddleware`` and
+``RequestLoggingMiddleware`` names are aliases of it). The ``login``
+scenario also runs ``login_view`` with its rate limits. Each login comes
+from a different anonymous visitor, so the ``key='user'`` limit counts
+them separately instead of rejecting every login after the tenth; the
+status-code mix of each run is part of its result. Requests are
+built with ``RequestFactory`` ahead of time, so the timings cover only
+the middleware and the view.
+
+The run happens inside ``isolated_environment()``: a throwaway test
+database, a local-memory cache, a fast password hasher (the login view
+hashes the password even for an unknown user, and PBKDF2 would dwarf
+everything measured), and a synthetic in-memory geolocation database
+standing in for the real provider. Nothing touches production
+data or the network.
+
+Every result records p50/p99/mean latency, requests per second, DB
+queries per request issued on the request thread, and the per-stage
+timings from ``TrackingPipeline.stats()``. ``save_results()`` appends
+the results to a JSON-lines file tagged with the git commit, and
+``previous_results()`` finds the last run from another commit, so
+regressions show up between commits.
+"""
+
+import contextlib
+import ipaddress
+import json
+import os
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import PermissionDenied
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.test.utils import (
+    setup_test_environment, teardown_test_environment
+)
+
+from . import middleware as tracking_middleware
+from . import ratelimit
+from .bulk import bulk_block
+from .geolocation import GeoDatabase, geolocator
+from .log_buffer import log_buffer
+from .pipeline import TrackingPipeline
+
+SCENARIOS = {
+    'unique_ips': 'Every request from a new IP',
+    'repeat_ips': 'Requests spread over 50 returning IPs',
+    'blocked_ips': 'Half the requests from blocked IPs and ranges',
+    'sensitive_paths': 'Requests to /admin/ and /login',
+    'login': 'POST /login through the middleware and login_view',
+    'mixed': 'Weighted mix of all of the above',
+}
+
+DEFAULT_REQUESTS = 5000
+DEFAULT_WARMUP = 200
+
+# Synthetic geolocation coverage: first octet -> (country, city)
+GEO_LABELS = [
+    ('US', 'New York'), ('DE', 'Berlin'), ('KE', 'Nairobi'),
+    ('BR', 'Sao Paulo'), ('JP', 'Tokyo'), ('IN', 'Mumbai'),
+]
+
+BLOCKED_NETWORK = '198.51.100.0/24'
+NORMAL_PATHS = ['/', '/products/', '/products/42/', '/about/', '/api/items/']
+SENSITIVE_PATHS = ['/admin/', '/admin/login/', '/login']
+USER_AGENT = 'Mozilla/5.0 (benchmark)'
+
+
+def build_stand_in_geo_database():
+    """
+    Build an in-memory GeoDatabase covering 1.0.0.0-223.255.255.255.
+
+    Each /8 is labelled round-robin from GEO_LABELS, which gives the
+    lookups a realistic number of ranges to search.
+    """
+    ranges = []
+    for octet in range(1, 224):
+        start = octet << 24
+        country, city = GEO_LABELS[octet % len(GEO_LABELS)]
+        for block in range(64):
+            # 64 ranges per /8, 14k in total
+            low = start + (block << 18)
+            ranges.append((4, low, low + (1 << 18) - 1, country, city))
+    return GeoDatabase.build(ranges)
+
+
+@contextlib.contextmanager
+def isolated_environment():
+    """
+    Run benchmarks against a test database, a locmem cache, a fast
+    password hasher, in-process view rate limits and the stand-in
+    geolocation database, restoring everything afterwards.
+    """
+    hashers = ['django.contrib.auth.hashers.MD5PasswordHasher']
+    locmem = {'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ip-tracking-benchmark',
+    }}
+    saved_geo = (geolocator._db, geolocator._next_check,
+                 geolocator.http_fallback)
+    saved_ratelimit = ratelimit._backend
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+    if connection.vendor == 'sqlite' and not old_test_name:
+        # A file rather than shared in-memory SQLite: the log flusher
+        # thread then waits for locks instead of failing on them
+        test_settings['NAME'] = os.path.join(
+            tempfile.gettempdir(), f'ip_tracking_benchmark_{os.getpid()}.db'
+        )
+    connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False
+    )
+    try:
+        with override_settings(CACHES=locmem, ALLOWED_HOSTS=['*'],
+                               PASSWORD_HASHERS=hashers):
+            geolocator._db = build_stand_in_geo_database()
+            geolocator._next_check = float('inf')
+            geolocator.http_fallback = False
+            ratelimit._backend = ratelimit.LocalBackend()
+            yield
+    finally:
+        log_buffer.flush()
+        (geolocator._db, geolocator._next_check,
+         geolocator.http_fallback) = saved_geo
+        ratelimit._backend = saved_ratelimit
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
+        teardown_test_environment()
+
+
+class BenchmarkVisitor(AnonymousUser):
+    """
+    An anonymous user with its own ``pk``.
+
+    ``key='user'`` rate limits key anonymous requests on ``pk``, which is
+    None for every AnonymousUser, so all simulated logins would share one
+    counter.
+    """
+
+    def __init__(self, pk):
+        self.pk = self.id = pk
+
+
+class TrafficGenerator:
+    """
+    Produce (ip, method, path, data) tuples for a scenario.
+
+    Args:
+        seed (int): Random seed, so every run replays the same traffic
+    """
+
+    def __init__(self, seed=42):
+        self.random = random.Random(seed)
+        self.unique_counter = 0
+        self.repeat_pool = [self._random_ip() for _ in range(50)]
+        self.blocked_ips = [self._random_ip() for _ in range(100)]
+        self.blocked_network = list(
+            ipaddress.ip_network(BLOCKED_NETWORK).hosts()
+        )
+
+    def _random_ip(self):
+        return str(ipaddress.IPv4Address(
+            self.random.randint(1 << 24, (224 << 24) - 1)
+        ))
+
+    def unique_ip(self):
+        # Walk 11.0.0.0 upwards: never repeats within a run
+        self.unique_counter += 1
+        return str(ipaddress.IPv4Address((11 << 24) + self.unique_counter))
+
+    def request(self, scenario):
+        """Return the next request of a scenario."""
+        if scenario == 'mixed':
+            scenario = self.random.choices(
+                ['unique_ips', 'repeat_ips', 'blocked_ips',
+                 'sensitive_paths', 'login'],
+                weights=[30, 45, 10, 10, 5],
+            )[0]
+
+        path = self.random.choice(NORMAL_PATHS)
+        if scenario == 'unique_ips':
+            return self.unique_ip(), 'GET', path, None
+        if scenario == 'repeat_ips':
+            return self.random.choice(self.repeat_pool), 'GET', path, None
+        if scenario == 'blocked_ips':
+            roll = self.random.random()
+            if roll < 0.25:
+                ip = self.random.choice(self.blocked_ips)
+            elif roll < 0.5:
+                ip = str(self.random.choice(self.blocked_network))
+            else:
+                ip = self.random.choice(self.repeat_pool)
+            return ip, 'GET', path, None
+        if scenario == 'sensitive_paths':
+            return (self.random.choice(self.repeat_pool), 'GET',
+                    self.random.choice(SENSITIVE_PATHS), None)
+        if scenario == 'login':
+            return (self.unique_ip(), 'POST', '/login',
+                    {'username': 'benchmark', 'password': 'wrong'})
+        raise ValueError(f'Unknown scenario: {scenario}')
+
+
+def _app_view(request):
+    """Stand-in for the rest of the site behind the middleware."""
+    if request.path == '/login':
+        from .views import login_view
+        try:
+            return login_view(request)
+        except PermissionDenied:
+            # @ratelimit's block=True: rejected, like a 403
+            return HttpResponse(status=403)
+    return HttpResponse('ok')
+
+
+def _percentile(sorted_values, percent):
+    index = min(len(sorted_values) - 1,
+                round(percent / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def run_scenario(scenario, requests=DEFAULT_REQUESTS, warmup=DEFAULT_WARMUP,
+                 seed=42, generator=None):
+    """
+    Replay one scenario through a fresh middleware instance.
+
+    Must run inside ``isolated_environment()``.
+
+    Args:
+        scenario (str): Key in SCENARIOS
+        requests (int): Measured requests
+        warmup (int): Unmeasured requests sent first
+        seed (int): Traffic seed
+        generator (TrafficGenerator): Reuse a generator (and its
+            blocked IPs) across scenarios
+
+    Returns:
+        dict: Latency percentiles, throughput, queries and stage timings
+    """
+    generator = generator or TrafficGenerator(seed)
+    factory = RequestFactory()
+
+    # New pipeline per scenario so the stage timings are its own
+    tracking_middleware._pipeline = None
+    middleware = tracking_middleware.TrackingMiddleware(_app_view)
+
+    def build(count):
+        built = []
+        for _ in range(count):
+            ip, method, path, data = generator.request(scenario)
+            request = (factory.post(path, data) if method == 'POST'
+                       else factory.get(path))
+            request.META['REMOTE_ADDR'] = ip
+            request.META['HTTP_USER_AGENT'] = USER_AGENT
+            # What AuthenticationMiddleware would set (ratelimit key='user')
+            request.user = (BenchmarkVisitor(generator.unique_counter)
+                            if path == '/login' else AnonymousUser())
+            built.append(request)
+        return built
+
+    for request in build(warmup):
+        middleware(request)
+    log_buffer.flush()
+    # Measure with clean stage timings
+    middleware.pipeline = TrackingPipeline.from_settings()
+
+    queries = [0]
+
+    def count_queries(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    measured = build(requests)
+    latencies = []
+    statuses = {}
+    started = time.perf_counter()
+    with connection.execute_wrapper(count_queries):
+        for request in measured:
+            t0 = time.perf_counter_ns()
+            response = middleware(request)
+            latencies.append(time.perf_counter_ns() - t0)
+            statuses[response.status_code] = (
+                statuses.get(response.status_code, 0) + 1
+            )
+    elapsed = time.perf_counter() - started
+
+    flush_started = time.perf_counter()
+    log_buffer.flush()
+    flush_seconds = time.perf_counter() - flush_started
+
+    latencies.sort()
+    return {
+        'scenario': scenario,
+        'requests': requests,
+        'p50_us': round(_percentile(latencies, 50) / 1000, 1),
+        'p99_us': round(_percentile(latencies, 99) / 1000, 1),
+        'mean_us': round(statistics.fmean(latencies) / 1000, 1),
+        'requests_per_second': round(requests / elapsed) if elapsed else 0,
+        'queries_per_request': round(queries[0] / requests, 3),
+        'final_flush_seconds': round(flush_seconds, 4),
+        'statuses': {str(code): n for code, n in sorted(statuses.items())},
+        'stages': {
+            name: round(timing['avg_microseconds'], 2)
+            for name, timing in middleware.pipeline.stats().items()
+        },
+    }
+
+
+def run_benchmarks(scenarios=None, requests=DEFAULT_REQUESTS,
+                   warmup=DEFAULT_WARMUP, seed=42, progress=None):
+    """
+    Run scenarios in an isolated environment.
+
+    Args:
+        scenarios (list): Scenario names (default: all)
+        requests (int): Measured requests per scenario
+        warmup (int): Unmeasured requests per scenario
+        seed (int): Traffic seed
+        progress (callable): Called with each scenario result
+
+    Returns:
+        list: One ``run_scenario()`` result per scenario
+    """
+    results = []
+    with isolated_environment():
+        generator = TrafficGenerator(seed)
+        bulk_block(generator.blocked_ips + [BLOCKED_NETWORK],
+                   reason='benchmark', blocked_by='benchmark')
+        for scenario in scenarios or list(SCENARIOS):
+            result = run_scenario(scenario, requests, warmup, seed,
+                                  generator=generator)
+            results.append(result)
+            if progress:
+                progress(result)
+    return results
+
+
+def get_results_path():
+    """Return the JSON-lines file results are stored in."""
+    return getattr(
+        settings,
+        'IP_TRACKING_BENCHMARK_RESULTS',
+        os.path.join(str(settings.BASE_DIR), 'benchmarks', 'results.jsonl')
+    )
+
+
+def current_commit():
+    """
+    Return (commit hash, dirty flag) of the working tree.
+
+    Returns:
+        tuple: ('unknown', False) outside a git checkout
+    """
+    cwd = str(getattr(settings, 'BASE_DIR', os.getcwd()))
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=cwd,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=cwd, capture_output=True, text=True, check=True
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, dirty
+
+
+def save_results(results, path=None):
+    """
+    Append results to the JSON-lines file, tagged with the commit.
+
+    Returns:
+        str: Path written to
+    """
+    path = path or get_results_path()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    commit, dirty = current_commit()
+    run = {
+        'commit': commit,
+        'dirty': dirty,
+        'recorded_at': datetime.now(dt_timezone.utc).isoformat(),
+        'database': connection.vendor,
+    }
+    with open(path, 'a') as f:
+        for result in results:
+            f.write(json.dumps(dict(run, **result)) + '\n')
+    return path
+
+
+def previous_results(path=None):
+    """
+    Return the latest stored result per scenario from another commit.
+
+    Returns:
+        dict: {scenario: result}
+    """
+    path = path or get_results_path()
+    commit, _ = current_commit()
+    previous = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                result = json.loads(line)
+                if result.get('commit') != commit:
+                    previous[result['scenario']] = result
+    except (OSError, ValueError):
+        pass
+    return previous
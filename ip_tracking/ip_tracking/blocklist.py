@@ -0,0 +1,314 @@
+"""
+In-process blocklist snapshot for the IP tracking middleware.
+
+Instead of querying ``BlockedIP`` and ``BlockedNetwork`` on every request,
+each worker keeps an in-memory copy of the active blocklist. The copy is
+rebuilt only when a shared version number stored in the Django cache
+changes. Anything that modifies the blocklist bumps that version, and
+each worker re-reads it at most once every
+``IP_TRACKING_BLOCKLIST_REFRESH_SECONDS`` seconds, which bounds how long a
+change takes to reach every worker.
+"""
+
+import ipaddress
+import threading
+import time
+from bisect import bisect_right
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from .fields import canonical_ip
+from .metrics import registry
+
+# Cache key holding the shared blocklist version
+BLOCKLIST_VERSION_KEY = 'ip_tracking:blocklist_version'
+
+# Default upper bound (seconds) before a worker notices a blocklist change
+DEFAULT_REFRESH_SECONDS = 5
+
+
+def get_refresh_interval():
+    """Return the configured version check interval in seconds."""
+    return getattr(
+        settings,
+        'IP_TRACKING_BLOCKLIST_REFRESH_SECONDS',
+        DEFAULT_REFRESH_SECONDS
+    )
+
+
+def get_blocklist_version():
+    """
+    Read the shared blocklist version from the cache.
+
+    Returns:
+        int: Current version (0 if it has never been bumped)
+    """
+    return cache.get(BLOCKLIST_VERSION_KEY, 0)
+
+
+def bump_blocklist_version():
+    """
+    Signal every worker that the blocklist has changed.
+
+    Returns:
+        int: The new version number
+    """
+    # add() is a no-op if the key already exists, so incr() never misses
+    cache.add(BLOCKLIST_VERSION_KEY, 0, timeout=None)
+    try:
+        return cache.incr(BLOCKLIST_VERSION_KEY)
+    except ValueError:
+        # Key was evicted between add() and incr()
+        cache.set(BLOCKLIST_VERSION_KEY, 1, timeout=None)
+        return 1
+
+
+def parse_block_target(value):
+    """
+    Work out which blocklist table an address or range belongs to.
+
+    Args:
+        value (str): Single IP address or network in CIDR notation
+
+    Returns:
+        tuple: (model class, lookup kwargs, normalized value)
+
+    Raises:
+        ValueError: If the value is not a valid IP address or network
+    """
+    from .models import BlockedIP, BlockedNetwork
+
+    value = value.strip()
+    try:
+        if '/' in value:
+            network = BlockedNetwork.normalize(value)
+            return BlockedNetwork, {'network': network}, network
+        ip_address = canonical_ip(value)
+        return BlockedIP, {'ip_address': ip_address}, ip_address
+    except ValueError:
+        raise ValueError(f'Invalid IP address or network: {value}')
+
+
+class NetworkIndex:
+    """
+    Longest-prefix-match index over blocked CIDR ranges.
+
+    Each network is stored as an inclusive integer interval. Overlapping
+    and adjacent intervals are merged at build time, leaving one sorted,
+    non-overlapping array of starts and ends per IP version. A lookup is
+    a single binary search, O(log n) even with 100k+ ranges.
+    """
+
+    def __init__(self, networks=()):
+        """
+        Build the index.
+
+        Args:
+            networks (iterable): CIDR strings or ipaddress network objects
+        """
+        intervals = {4: [], 6: []}
+        for network in networks:
+            if isinstance(network, str):
+                network = ipaddress.ip_network(network, strict=False)
+            intervals[network.version].append(
+                (int(network.network_address), int(network.broadcast_address))
+            )
+
+        self._starts = {}
+        self._ends = {}
+        for version, ranges in intervals.items():
+            starts, ends = [], []
+            for start, end in sorted(ranges):
+                if ends and start <= ends[-1] + 1:
+                    # Overlaps or touches the previous range, extend it
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self._starts[version] = starts
+            self._ends[version] = ends
+
+    def __len__(self):
+        return len(self._starts[4]) + len(self._starts[6])
+
+    def __contains__(self, ip_address):
+        """
+        Check if an address falls inside any indexed range.
+
+        Args:
+            ip_address (str or ipaddress object): Address to look up
+
+        Returns:
+            bool: True if the address is covered by a range
+        """
+        if isinstance(ip_address, str):
+            try:
+                ip_address = ipaddress.ip_address(ip_address)
+            except ValueError:
+                return False
+        if ip_address.version == 6 and ip_address.ipv4_mapped:
+            # ::ffff:a.b.c.d is matched against the IPv4 ranges
+            ip_address = ip_address.ipv4_mapped
+
+        starts = self._starts[ip_address.version]
+        value = int(ip_address)
+        i = bisect_right(starts, value) - 1
+        return i >= 0 and value <= self._ends[ip_address.version][i]
+
+
+class BlocklistSnapshot:
+    """
+    Immutable-per-version view of the active blocklist.
+
+    Exact addresses are served from a frozenset (plus a dict of temporary
+    blocks and their expiry) and CIDR ranges from a ``NetworkIndex``. The snapshot checks the shared version at most once
+    per refresh interval, so the steady-state block check makes no
+    database queries and at most one cache read per interval.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ips = frozenset()
+        self._temporary = {}  # ip -> expiry as a UNIX timestamp
+        self._networks = NetworkIndex()
+        self._version = None
+        self._next_check = 0.0
+
+    def is_blocked(self, ip_address):
+        """
+        Check if an IP address is in the current snapshot, either as an
+        exact entry or inside a blocked range.
+
+        Args:
+            ip_address (str): IP address to check
+
+        Returns:
+            bool: True if IP is blocked, False otherwise
+        """
+        if self.needs_refresh():
+            self.refresh()
+        if ip_address in self._ips:
+            return True
+        if self._temporary:
+            # Temporary blocks lapse on their own, without a reload
+            expires = self._temporary.get(ip_address)
+            if expires is not None and expires > time.time():
+                return True
+        # Skip address parsing entirely when no ranges are blocked
+        return bool(self._networks) and ip_address in self._networks
+
+    def needs_refresh(self):
+        """
+        Check if the shared version is due to be re-read.
+
+        Returns:
+            bool: True once the refresh interval has elapsed
+        """
+        return time.monotonic() >= self._next_check
+
+    def refresh(self, force=False):
+        """
+        Reload the snapshot if the shared version has changed.
+
+        Args:
+            force (bool): Reload even if the version is unchanged
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now < self._next_check:
+                # Another thread refreshed while we waited for the lock
+                return
+            self._next_check = now + get_refresh_interval()
+
+            version = get_blocklist_version()
+            if not force and version == self._version:
+                return
+
+            ips, networks = self._querysets()
+            self._install(list(ips), list(networks), version)
+
+    async def arefresh(self, force=False):
+        """
+        Async version of ``refresh()`` for use under ASGI.
+
+        Uses the async cache and ORM APIs so the event loop is never
+        blocked by the reload. Concurrent callers in the same loop see the
+        pushed-forward check time and keep using the current snapshot
+        until the reload finishes.
+
+        Args:
+            force (bool): Reload even if the version is unchanged
+        """
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return
+        self._next_check = now + get_refresh_interval()
+
+        version = await cache.aget(BLOCKLIST_VERSION_KEY, 0)
+        if not force and version == self._version:
+            return
+
+        ips, networks = self._querysets()
+        self._install(
+            [row async for row in ips],
+            [network async for network in networks],
+            version
+        )
+
+    def _install(self, ip_rows, networks, version):
+        """
+        Swap in a freshly loaded blocklist.
+
+        Args:
+            ip_rows (list): (ip_address, expires_at) tuples
+            networks (list): CIDR strings
+            version (int): Shared version the data was loaded for
+        """
+        permanent = set()
+        temporary = {}
+        for ip_address, expires_at in ip_rows:
+            if expires_at is None:
+                permanent.add(ip_address)
+            else:
+                temporary[ip_address] = expires_at.timestamp()
+
+        self._ips = frozenset(permanent)
+        self._temporary = temporary
+        self._networks = NetworkIndex(networks)
+        self._version = version
+        registry.inc('ip_tracking_blocklist_reloads_total')
+
+    def invalidate(self):
+        """Force the next lookup to re-check the shared version."""
+        self._version = None
+        self._next_check = 0.0
+
+    def _querysets(self):
+        """
+        Build the queries for all active blocked IPs and networks.
+
+        Returns:
+            tuple: ((ip_address, expires_at) queryset,
+                CIDR network queryset)
+        """
+        from .models import BlockedIP, BlockedNetwork
+
+        ips = (
+            BlockedIP.objects.filter(
+                Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()),
+                is_active=True
+            )
+            .values_list('ip_address', 'expires_at')
+        )
+        networks = (
+            BlockedNetwork.objects.filter(is_active=True)
+            .values_list('network', flat=True)
+        )
+        return ips, networks
+
+
+# Shared per-process snapshot used by the middleware
+blocklist = BlocklistSnapshot()
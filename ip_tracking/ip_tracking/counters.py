@@ -0,0 +1,269 @@
+"""
+Real-time per-IP sliding-window request counters.
+
+Counts are kept in fixed windows in the shared Django cache, one key per
+(IP, window). The sliding-window estimate weights the previous window by
+how much of it still overlaps the sliding window:
+
+    estimate = previous * (1 - elapsed / window) + current
+
+Each request costs one atomic ``cache.incr``. The previous window's
+count no longer changes, so it is read once per IP per window and then
+memoized in process (up to ``MAX_PREVIOUS_MEMO`` IPs). If the cache is
+unreachable, the counter falls back to in-process counts until it
+recovers.
+
+Under ASGI, Django's async cache methods are thread hops around the
+sync ones, and ``aincr`` is a non-atomic get and set. ``ahit()`` goes to
+Redis directly instead: one Lua call through ``redis.asyncio`` that
+increments the key, sets its expiry and reads the previous window, on
+the same keys the sync path uses. Without a django-redis cache it counts
+in process.
+"""
+
+import asyncio
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.core.cache import cache, caches
+
+from .metrics import registry
+
+KEY_PREFIX = 'ip_tracking:rate'
+
+# Most IPs whose previous-window count is memoized; beyond that the
+# oldest entries are forgotten and read from the cache again
+MAX_PREVIOUS_MEMO = 10000
+
+# Seconds an async request waits for a Redis connection before counting
+# in process instead
+ASYNC_POOL_TIMEOUT = 1.0
+
+# KEYS: current window, previous window; ARGV: TTL of the current window
+# Returns: {current count, previous count or false}
+INCR_SCRIPT = """
+local current = redis.call('INCR', KEYS[1])
+if current == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return {current, redis.call('GET', KEYS[2])}
+"""
+
+
+class AsyncRedisWindowStore:
+    """
+    Window counts in the django-redis cache, updated from async code.
+
+    Keeps one ``redis.asyncio`` client per event loop, connected to the
+    cache's (first) LOCATION, and uses the cache's key function, so
+    counts are shared with ``cache.incr()`` in sync workers.
+
+    Args:
+        alias (str): Cache alias
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self._clients = weakref.WeakKeyDictionary()
+
+    @property
+    def available(self):
+        """True if the cache is a django-redis cache."""
+        backend = settings.CACHES.get(self.alias, {}).get('BACKEND', '')
+        return backend.startswith('django_redis.')
+
+    def _script(self):
+        loop = asyncio.get_running_loop()
+        script = self._clients.get(loop)
+        if script is None:
+            import redis.asyncio
+
+            config = settings.CACHES[self.alias]
+            location = config['LOCATION']
+            if not isinstance(location, str):
+                location = location[0]  # the primary
+            pool_kwargs = config.get('OPTIONS', {}).get(
+                'CONNECTION_POOL_KWARGS', {}
+            )
+            # Bursts wait briefly for a free connection instead of
+            # failing over to local counts
+            pool = redis.asyncio.BlockingConnectionPool.from_url(
+                location,
+                max_connections=pool_kwargs.get('max_connections', 100),
+                timeout=ASYNC_POOL_TIMEOUT,
+            )
+            client = redis.asyncio.Redis(connection_pool=pool)
+            script = self._clients[loop] = client.register_script(
+                INCR_SCRIPT
+            )
+        return script
+
+    async def hit(self, key, previous_key, ttl):
+        """
+        Count one request in a window.
+
+        Args:
+            key (str): Cache key of the current window
+            previous_key (str): Cache key of the previous window
+            ttl (int): Expiry of a new current-window key, in seconds
+
+        Returns:
+            tuple: (current count, previous count)
+        """
+        make_key = caches[self.alias].make_key
+        current, previous = await self._script()(
+            keys=[make_key(key), make_key(previous_key)], args=[ttl]
+        )
+        return int(current), int(previous or 0)
+
+
+class LocalWindowStore:
+    """In-process fallback store: {(ip, window): count} for two windows."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._window = None
+
+    def incr(self, ip_address, window):
+        with self._lock:
+            if window != self._window:
+                # Keep only the window that just ended
+                self._counts = {
+                    key: count for key, count in self._counts.items()
+                    if key[1] == window - 1
+                }
+                self._window = window
+            key = (ip_address, window)
+            count = self._counts.get(key, 0) + 1
+            self._counts[key] = count
+            return count
+
+    def get(self, ip_address, window):
+        return self._counts.get((ip_address, window), 0)
+
+
+class SlidingWindowCounter:
+    """
+    Per-IP request counter over a sliding time window.
+
+    Args:
+        window_seconds (int): Length of the sliding window
+        use_cache (bool): Share counts through the Django cache; False
+            keeps them per process
+    """
+
+    def __init__(self, window_seconds, use_cache=True):
+        self.window_seconds = window_seconds
+        self.use_cache = use_cache
+        self.local = LocalWindowStore()
+        self.fallbacks = 0  # requests counted locally because of errors
+
+        self.async_store = AsyncRedisWindowStore() if use_cache else None
+
+        self._lock = threading.Lock()
+        self._previous = {}  # memoized counts of the window that ended
+        self._previous_window = None
+
+    def hit(self, ip_address, now=None):
+        """
+        Count one request and return the sliding-window estimate.
+
+        Args:
+            ip_address (str): Client IP
+            now (float): Current UNIX time (for tests)
+
+        Returns:
+            float: Estimated requests from the IP in the last window
+        """
+        now = time.time() if now is None else now
+        window, elapsed = divmod(now, self.window_seconds)
+        window = int(window)
+
+        if self.use_cache:
+            try:
+                current = self._cache_incr(ip_address, window)
+                previous = self._previous_count(ip_address, window)
+                return self._estimate(previous, current, elapsed)
+            except Exception:
+                self.fallbacks += 1
+                registry.inc('ip_tracking_rate_counter_fallbacks_total')
+
+        return self.hit_local(ip_address, now)
+
+    async def ahit(self, ip_address, now=None):
+        """
+        Async version of ``hit()`` for use under ASGI.
+
+        One native async Redis call per request. Counts in process when
+        the shared cache is disabled or is not django-redis, so no
+        request waits on a thread hop.
+        """
+        if self.async_store is None or not self.async_store.available:
+            return self.hit_local(ip_address, now)
+
+        now = time.time() if now is None else now
+        window, elapsed = divmod(now, self.window_seconds)
+        window = int(window)
+        try:
+            current, previous = await self.async_store.hit(
+                self._key(ip_address, window),
+                self._key(ip_address, window - 1),
+                self.window_seconds * 2,
+            )
+            return self._estimate(previous, current, elapsed)
+        except Exception:
+            self.fallbacks += 1
+            registry.inc('ip_tracking_rate_counter_fallbacks_total')
+            return self.hit_local(ip_address, now)
+
+    def hit_local(self, ip_address, now=None):
+        """Count one request in process only; see ``hit()``."""
+        now = time.time() if now is None else now
+        window, elapsed = divmod(now, self.window_seconds)
+        window = int(window)
+        current = self.local.incr(ip_address, window)
+        previous = self.local.get(ip_address, window - 1)
+        return self._estimate(previous, current, elapsed)
+
+    def _estimate(self, previous, current, elapsed):
+        weight = 1 - elapsed / self.window_seconds
+        return previous * weight + current
+
+    def _key(self, ip_address, window):
+        return f'{KEY_PREFIX}:{self.window_seconds}:{window}:{ip_address}'
+
+    def _cache_incr(self, ip_address, window):
+        """Atomically increment the current window's count."""
+        key = self._key(ip_address, window)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # First request in this window; add() loses if another
+            # worker created the key first, then incr() again
+            if cache.add(key, 1, timeout=self.window_seconds * 2):
+                return 1
+            return cache.incr(key)
+
+    def _previous_count(self, ip_address, window):
+        """Return the finished window's count, reading it at most once."""
+        previous = self._memoized_previous(window)
+        count = previous.get(ip_address)
+        if count is None:
+            count = cache.get(self._key(ip_address, window - 1), 0)
+            with self._lock:
+                if len(previous) >= MAX_PREVIOUS_MEMO:
+                    # A scan of many IPs: forget the oldest entry
+                    del previous[next(iter(previous))]
+                previous[ip_address] = count
+        return count
+
+    def _memoized_previous(self, window):
+        if window != self._previous_window:
+            with self._lock:
+                if window != self._previous_window:
+                    self._previous = {}
+                    self._previous_window = window
+        return self._previous
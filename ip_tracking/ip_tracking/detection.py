@@ -0,0 +1,380 @@
+"""
+Sharded, incremental sliding-window anomaly detection.
+
+Instead of re-aggregating the last hour of RequestLog on every run, the
+detector keeps per-IP request counts in one-minute IPRequestBucket rows.
+A run has three steps:
+
+1. Plan: fix the range of RequestLog ids added since the last run
+   (tracked by a ProcessingWatermark on the primary key), up to the
+   last id that has settled (see watermarks.py).
+2. Shards: IPs are split by ``shard_key % shards`` (a stable hash, see
+   fields.py), so every IP belongs to exactly one shard. Each shard
+   recounts the buckets of its IPs for the minutes the new rows fall
+   into, then sums its active buckets and returns the IPs over the
+   threshold.
+3. Merge: advance the watermark, evict buckets that have slid out of the
+   window, bring the hourly rollups up to date (see rollups.py), apply
+   the detection rules (see rules.py) to the rollups in one pass and flag
+   every offender with a single bulk insert into SuspiciousIP.
+
+Shards write absolute counts, not increments, so a shard that is retried
+or runs twice gives the same result. Shards never share an IP, so they
+can run in parallel (see the ``detect_anomalies`` task, which fans them
+out as a Celery chord) and the outcome does not depend on the number of
+shards.
+
+A run costs time proportional to the new rows, the rows in the minutes
+they touch, and the number of active buckets and rollup rows. It does
+not grow with the number of rows in the window.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import Mod, TruncMinute
+from django.utils import timezone
+
+from .fields import SHARD_KEY_SPACE
+from .models import (
+    IPRequestBucket, ProcessingWatermark, RequestLog, RequestLogHourly,
+    SuspiciousIP
+)
+from .rollups import rollup_request_logs
+from .rules import detection_rules
+from .watermarks import settled_max_id
+
+WATERMARK_NAME = 'anomaly_detection'
+
+BUCKET_SECONDS = 60
+DEFAULT_WINDOW_SECONDS = 60 * 60
+DEFAULT_THRESHOLD = 100
+DEFAULT_SHARDS = 1
+
+
+def get_window():
+    """Return the detection window as a timedelta."""
+    return timedelta(seconds=getattr(
+        settings, 'IP_TRACKING_ANOMALY_WINDOW_SECONDS', DEFAULT_WINDOW_SECONDS
+    ))
+
+
+def get_threshold():
+    """Return the max number of requests allowed per window."""
+    return getattr(settings, 'IP_TRACKING_ANOMALY_THRESHOLD', DEFAULT_THRESHOLD)
+
+
+def get_shard_count():
+    """Return how many shards a detection run is split into."""
+    shards = getattr(settings, 'IP_TRACKING_DETECTION_SHARDS', DEFAULT_SHARDS)
+    return min(max(1, shards), SHARD_KEY_SPACE)
+
+
+def bucket_start(timestamp):
+    """Round a timestamp down to the start of its bucket."""
+    return timestamp - timedelta(
+        seconds=timestamp.second % BUCKET_SECONDS,
+        microseconds=timestamp.microsecond,
+    )
+
+
+def plan_detection():
+    """
+    Fix the RequestLog id range a detection run covers.
+
+    Returns:
+        dict: start (exclusive) and end (inclusive) RequestLog ids
+    """
+    watermark, _ = ProcessingWatermark.objects.get_or_create(
+        name=WATERMARK_NAME
+    )
+    upper = settled_max_id(WATERMARK_NAME)
+    return {'start': watermark.last_id, 'end': max(upper, watermark.last_id)}
+
+
+def _in_shard(queryset, shard, shards):
+    """Restrict a queryset with a shard_key column to one shard."""
+    if shards == 1:
+        return queryset
+    return queryset.annotate(
+        shard=Mod('shard_key', shards)
+    ).filter(shard=shard)
+
+
+def update_buckets(start, end, shard=0, shards=1):
+    """
+    Recount the buckets touched by new RequestLog rows of one shard.
+
+    Finds the minutes the shard's rows in (start, end] fall into, then
+    recounts every bucket of the shard in those minutes from RequestLog,
+    grouped per (IP, minute) in the database.
+
+    Args:
+        start (int): Exclusive lower RequestLog id
+        end (int): Inclusive upper RequestLog id
+        shard (int): Shard number, 0 to shards - 1
+        shards (int): Total number of shards
+
+    Returns:
+        int: Number of new RequestLog rows in the shard
+    """
+    cutoff = bucket_start(timezone.now() - get_window())
+    new_rows = _in_shard(
+        RequestLog.objects.filter(
+            id__gt=start,
+            id__lte=end,
+            # Rows already outside the window count for nothing
+            timestamp__gte=cutoff,
+        ),
+        shard, shards
+    ).aggregate(
+        rows=Count('id'), first=Min('timestamp'), last=Max('timestamp')
+    )
+    if not new_rows['rows']:
+        return 0
+
+    groups = (
+        _in_shard(
+            RequestLog.objects.filter(
+                timestamp__gte=bucket_start(new_rows['first']),
+                timestamp__lt=bucket_start(new_rows['last'])
+                + timedelta(seconds=BUCKET_SECONDS),
+            ),
+            shard, shards
+        )
+        .annotate(minute=TruncMinute('timestamp'))
+        .order_by()
+        .values('ip_address', 'minute')
+        # Sampled rows stand for sample_weight requests each
+        .annotate(requests=Sum('sample_weight'))
+    )
+    _set_buckets({
+        (row['ip_address'], row['minute']): row['requests'] for row in groups
+    })
+    return new_rows['rows']
+
+
+def _set_buckets(counts):
+    """Write {(ip, bucket_start): n} to the bucket table in bulk."""
+    if not counts:
+        return
+
+    existing = {
+        (bucket.ip_address, bucket.bucket_start): bucket
+        for bucket in IPRequestBucket.objects.filter(
+            ip_address__in={ip for ip, _ in counts},
+            bucket_start__gte=min(start for _, start in counts),
+            bucket_start__lte=max(start for _, start in counts),
+        )
+    }
+
+    to_update, to_create = [], []
+    for (ip, start), count in counts.items():
+        bucket = existing.get((ip, start))
+        if bucket is not None:
+            if bucket.request_count != count:
+                bucket.request_count = count
+                to_update.append(bucket)
+        else:
+            to_create.append(IPRequestBucket(
+                ip_address=ip, bucket_start=start, request_count=count
+            ))
+
+    IPRequestBucket.objects.bulk_update(
+        to_update, ['request_count'], batch_size=1000
+    )
+    # ignore_conflicts: an overlapping run may have created it already
+    IPRequestBucket.objects.bulk_create(
+        to_create, batch_size=1000, ignore_conflicts=True
+    )
+
+
+def evict_expired_buckets():
+    """
+    Delete buckets that have slid out of the detection window.
+
+    Returns:
+        int: Number of buckets deleted
+    """
+    cutoff = bucket_start(timezone.now() - get_window())
+    deleted, _ = IPRequestBucket.objects.filter(
+        bucket_start__lt=cutoff
+    ).delete()
+    return deleted
+
+
+def find_rate_offenders(shard=0, shards=1):
+    """
+    Sum the active buckets per IP and return those over the threshold.
+
+    Args:
+        shard (int): Shard number, 0 to shards - 1
+        shards (int): Total number of shards
+
+    Returns:
+        dict: {ip: reason}
+    """
+    threshold = get_threshold()
+    window_minutes = int(get_window().total_seconds() // 60)
+    offenders = (
+        _in_shard(
+            IPRequestBucket.objects.filter(
+                bucket_start__gte=bucket_start(timezone.now() - get_window())
+            ),
+            shard, shards
+        )
+        .values('ip_address')
+        .annotate(total=Sum('request_count'))
+        .filter(total__gt=threshold)
+    )
+    return {
+        row['ip_address']: (
+            f"Exceeded {threshold} requests/{window_minutes} min: "
+            f"{row['total']} requests"
+        )
+        for row in offenders
+    }
+
+
+def find_rule_hits():
+    """
+    Find IPs that reached the threshold of an active DetectionRule.
+
+    Reads the hourly rollups once, for the longest rule window (whole
+    hours overlapping it). Each distinct (method, path) goes through the
+    compiled matcher once, and every row adds its count to the rules it
+    matches.
+
+    Returns:
+        dict: {ip: reason}
+    """
+    matcher = detection_rules.matcher
+    if not matcher:
+        return {}
+
+    now = timezone.now()
+    rule_since = {
+        rule.pk: (now - timedelta(seconds=rule.window_seconds)).replace(
+            minute=0, second=0, microsecond=0
+        )
+        for rule in matcher.rules
+    }
+    rows = (
+        RequestLogHourly.objects.filter(hour__gte=min(rule_since.values()))
+        .order_by()
+        .values_list('ip_address', 'method', 'path', 'hour', 'request_count')
+    )
+
+    matches = {}
+    counts = {}
+    for ip, method, path, hour, requests in rows.iterator(chunk_size=5000):
+        key = (method, path)
+        if key not in matches:
+            matches[key] = matcher.match(method, path)
+        for rule in matches[key]:
+            if hour >= rule_since[rule.pk]:
+                counts[rule.pk, ip] = counts.get((rule.pk, ip), 0) + requests
+
+    rules = {rule.pk: (index, rule)
+             for index, rule in enumerate(matcher.rules)}
+    reasons = {}
+    # The first matching rule, in rule set order, gives the reason
+    for (rule_pk, ip), total in sorted(
+        counts.items(), key=lambda item: (rules[item[0][0]][0], item[0][1])
+    ):
+        rule = rules[rule_pk][1]
+        if total >= rule.threshold:
+            noun = 'request' if total == 1 else 'requests'
+            reasons.setdefault(
+                ip, f"Matched rule {rule.name}: {total} {noun}"
+            )
+    return reasons
+
+
+def flag_ips(reasons):
+    """
+    Bulk insert SuspiciousIP rows, leaving already flagged IPs untouched.
+
+    Args:
+        reasons (dict): {ip: reason}
+
+    Returns:
+        int: Number of IPs passed in
+    """
+    SuspiciousIP.objects.bulk_create(
+        [SuspiciousIP(ip_address=ip, reason=reason)
+         for ip, reason in reasons.items()],
+        ignore_conflicts=True,
+        batch_size=1000,
+    )
+    return len(reasons)
+
+
+def detect_shard(plan, shard=0, shards=1):
+    """
+    Run the per-shard step of a detection run.
+
+    Args:
+        plan (dict): Output of ``plan_detection()``
+        shard (int): Shard number, 0 to shards - 1
+        shards (int): Total number of shards
+
+    Returns:
+        dict: rows_processed and offenders ({ip: reason})
+    """
+    processed = update_buckets(plan['start'], plan['end'], shard, shards)
+    return {
+        'rows_processed': processed,
+        'offenders': find_rate_offenders(shard, shards),
+    }
+
+
+def merge_detection(plan, shard_results):
+    """
+    Finish a detection run once every shard is done.
+
+    Args:
+        plan (dict): Output of ``plan_detection()``
+        shard_results (list): Return values of ``detect_shard()``
+
+    Returns:
+        dict: rows_processed, buckets_evicted, ips_flagged, shards
+    """
+    # Only ever moves forward, even if an overlapping run finished first
+    ProcessingWatermark.objects.filter(
+        name=WATERMARK_NAME, last_id__lt=plan['end']
+    ).update(last_id=plan['end'], updated_at=timezone.now())
+
+    evicted = evict_expired_buckets()
+    rollup_request_logs()
+
+    # Rate offenders win over rule hits
+    reasons = find_rule_hits()
+    for result in shard_results:
+        reasons.update(result['offenders'])
+    flagged = flag_ips(reasons)
+
+    return {
+        'rows_processed': sum(r['rows_processed'] for r in shard_results),
+        'buckets_evicted': evicted,
+        'ips_flagged': flagged,
+        'shards': len(shard_results),
+    }
+
+
+def run_detection(shards=1):
+    """
+    Run one incremental detection pass in this process.
+
+    Args:
+        shards (int): Split the work into this many shards, run one after
+            another (the Celery task runs them in parallel)
+
+    Returns:
+        dict: rows_processed, buckets_evicted, ips_flagged, shards
+    """
+    plan = plan_detection()
+    return merge_detection(
+        plan, [detect_shard(plan, shard, shards) for shard in range(shards)]
+    )
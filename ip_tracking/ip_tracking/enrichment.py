@@ -0,0 +1,136 @@
+"""
+Background geolocation enrichment for RequestLog.
+
+When the middleware cannot resolve an IP from the local database or the
+shared cache, it writes the log row with country/city unset and
+``geo_pending=True``. Those rows are the queue: the
+``enrich_request_logs`` Celery task picks the distinct pending IPs in
+batches, resolves each IP once (HTTP provider included) and fills in
+every pending row for the batch with a single UPDATE. While the
+provider's circuit breaker is open the run stops early; the rows stay
+pending for the next run.
+
+Pending rows do not hold back the hourly rollups: they are rolled up
+with an empty country, and the UPDATE that resolves them moves those
+counts to the resolved country in the same transaction.
+"""
+
+import logging
+
+from django.db import transaction
+from django.db.models import Case, CharField, Count, Min, Value, When
+from django.utils import timezone
+
+from .geolocation import GeoProviderUnavailable, geolocator
+from .models import RequestLog
+from .rollups import RollupBusy, reassign_countries, rollup_lock
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 200
+
+# Seconds to wait for a rollup run before leaving a batch pending
+ROLLUP_LOCK_WAIT = 30
+
+
+def enrichment_status():
+    """
+    Report the size and age of the enrichment backlog.
+
+    Returns:
+        dict: pending_rows, oldest_pending (datetime or None) and
+            lag_seconds (age of the oldest pending row, 0 if none)
+    """
+    stats = RequestLog.objects.filter(geo_pending=True).aggregate(
+        pending_rows=Count('id'),
+        oldest_pending=Min('timestamp'),
+    )
+    oldest = stats['oldest_pending']
+    stats['lag_seconds'] = (
+        (timezone.now() - oldest).total_seconds() if oldest else 0.0
+    )
+    return stats
+
+
+def enrich_pending_logs(batch_size=DEFAULT_BATCH_SIZE, max_batches=50):
+    """
+    Resolve pending IPs and backfill their RequestLog rows.
+
+    Each batch takes up to ``batch_size`` distinct pending IPs, resolves
+    every IP once and updates all of their pending rows in one query.
+    IPs whose lookup fails stay pending and are retried on the next run.
+
+    Args:
+        batch_size (int): Distinct IPs resolved per batch
+        max_batches (int): Upper bound on batches per run
+
+    Returns:
+        dict: ips_resolved, ips_failed, rows_updated
+    """
+    failed = set()
+    result = {'ips_resolved': 0, 'ips_failed': 0, 'rows_updated': 0}
+
+    for _ in range(max_batches):
+        ips = list(
+            RequestLog.objects.filter(geo_pending=True)
+            .exclude(ip_address__in=failed)
+            .order_by()
+            .values_list('ip_address', flat=True)
+            .distinct()[:batch_size]
+        )
+        if not ips:
+            break
+
+        resolved = {}
+        provider_down = False
+        for ip in ips:
+            try:
+                resolved[ip] = geolocator.locate(ip)
+            except GeoProviderUnavailable as e:
+                failed.add(ip)
+                if geolocator.breaker.state == 'open':
+                    logger.warning('Geolocation provider unavailable: %s', e)
+                    provider_down = True
+                    break
+            except Exception as e:
+                failed.add(ip)
+                logger.warning('Geolocation failed for %s: %s', ip, e)
+
+        if resolved:
+            pending = RequestLog.objects.filter(
+                geo_pending=True,
+                ip_address__in=list(resolved),
+            )
+            try:
+                with rollup_lock(wait=ROLLUP_LOCK_WAIT), transaction.atomic():
+                    reassign_countries(pending, {
+                        ip: geo_data.get('country') or ''
+                        for ip, geo_data in resolved.items()
+                    })
+                    result['rows_updated'] += pending.update(
+                        country=_case(resolved, 'country'),
+                        city=_case(resolved, 'city'),
+                        geo_pending=False,
+                    )
+            except RollupBusy as e:
+                # Resolved IPs are cached; the rows stay pending until then
+                logger.warning('Enrichment deferred: %s', e)
+                break
+            result['ips_resolved'] += len(resolved)
+        if provider_down:
+            break
+
+    result['ips_failed'] = len(failed)
+    return result
+
+
+def _case(resolved, field):
+    """Build a CASE expression mapping each IP to its resolved value."""
+    return Case(
+        *[
+            When(ip_address=ip, then=Value(geo_data.get(field) or None))
+            for ip, geo_data in resolved.items()
+        ],
+        default=None,
+        output_field=CharField(),
+    )
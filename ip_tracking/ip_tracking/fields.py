@@ -0,0 +1,231 @@
+"""
+Compact, numerically ordered storage for IP addresses.
+
+``PackedIPAddressField`` stores every address as 16 bytes: IPv6 as-is,
+IPv4 mapped into ``::ffff:0:0/96``. The keys are fixed width and compare
+bytewise in numeric order. A network is therefore one contiguous key
+range, and ``ip_address__in_network='203.0.113.0/24'`` runs as an
+indexed ``BETWEEN``.
+
+In Python the field behaves like ``GenericIPAddressField``: values are
+canonical strings (IPv4 dotted quad, compressed IPv6), and filters, ``__in``
+and ``values_list()`` all take and return strings.
+"""
+
+import ipaddress
+import socket
+import zlib
+
+from django.core import validators
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.db.models import Lookup
+from django.forms import GenericIPAddressField as GenericIPAddressFormField
+
+_IPV4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff\xff'
+
+# Number of distinct shard keys; work is split into N shards by
+# shard_key % N, so any shard count up to this is supported
+SHARD_KEY_SPACE = 1024
+
+
+def pack_ip(value):
+    """
+    Pack an IPv4 or IPv6 address into 16 bytes.
+
+    Args:
+        value (str): IP address
+
+    Returns:
+        bytes: Big-endian 16-byte form, IPv4 mapped into IPv6
+
+    Raises:
+        ValueError: If the value is not a valid IP address
+    """
+    value = value.strip()
+    try:
+        return _IPV4_MAPPED_PREFIX + socket.inet_pton(socket.AF_INET, value)
+    except OSError:
+        pass
+    try:
+        return socket.inet_pton(socket.AF_INET6, value)
+    except OSError:
+        raise ValueError(f'Invalid IP address: {value}')
+
+
+def unpack_ip(packed):
+    """
+    Turn 16 packed bytes back into a canonical address string.
+
+    Args:
+        packed (bytes): Value produced by ``pack_ip()``
+
+    Returns:
+        str: Dotted quad for IPv4 (and IPv4-mapped), compressed IPv6
+    """
+    packed = bytes(packed)
+    if packed[:12] == _IPV4_MAPPED_PREFIX:
+        return socket.inet_ntop(socket.AF_INET, packed[12:])
+    return str(ipaddress.IPv6Address(packed))
+
+
+def canonical_ip(value):
+    """Return the form a PackedIPAddressField gives back for ``value``."""
+    return unpack_ip(pack_ip(value))
+
+
+def network_bounds(network):
+    """
+    Return the first and last packed address of a network.
+
+    Args:
+        network (str): Network in CIDR notation (host bits allowed)
+
+    Returns:
+        tuple: (start bytes, end bytes)
+
+    Raises:
+        ValueError: If the value is not a valid network
+    """
+    network = ipaddress.ip_network(str(network).strip(), strict=False)
+    if network.version == 4:
+        return (
+            _IPV4_MAPPED_PREFIX + network.network_address.packed,
+            _IPV4_MAPPED_PREFIX + network.broadcast_address.packed,
+        )
+    return network.network_address.packed, network.broadcast_address.packed
+
+
+def ip_shard_key(value):
+    """
+    Return the stable hash bucket of an address, 0 to SHARD_KEY_SPACE - 1.
+
+    CRC-32 of the packed form, so every spelling of an address lands in
+    the same bucket on every process and platform.
+    """
+    try:
+        return zlib.crc32(pack_ip(str(value))) % SHARD_KEY_SPACE
+    except ValueError:
+        return 0
+
+
+class PackedIPAddressField(models.Field):
+    """
+    IPv4/IPv6 address stored as 16 packed bytes.
+
+    Column types: ``bytea`` (PostgreSQL), ``binary(16)`` (MySQL),
+    ``RAW(16)`` (Oracle) and ``blob`` (SQLite).
+    """
+
+    description = "IP address (16 packed bytes, IPv4 mapped into IPv6)"
+    default_error_messages = {
+        'invalid': 'Enter a valid IPv4 or IPv6 address.',
+    }
+
+    DB_TYPES = {
+        'postgresql': 'bytea',
+        'mysql': 'binary(16)',
+        'oracle': 'RAW(16)',
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.validators.append(validators.validate_ipv46_address)
+
+    def db_type(self, connection):
+        return self.DB_TYPES.get(connection.vendor, 'blob')
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return unpack_ip(value)
+
+    def to_python(self, value):
+        if value is None or value == '':
+            return None
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return unpack_ip(value)
+        try:
+            return canonical_ip(str(value))
+        except ValueError:
+            raise ValidationError(
+                self.error_messages['invalid'], code='invalid'
+            )
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None or value == '':
+            return None
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return bytes(value)
+        return pack_ip(str(value))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None:
+            return None
+        return connection.Database.Binary(value)
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj) or ''
+
+    def formfield(self, **kwargs):
+        return super().formfield(**{
+            'form_class': GenericIPAddressFormField,
+            **kwargs,
+        })
+
+
+@PackedIPAddressField.register_lookup
+class InNetwork(Lookup):
+    """
+    ``field__in_network='10.0.0.0/8'``: address inside a CIDR network.
+
+    Compiles to a BETWEEN over the packed range, so it uses the
+    column's index.
+    """
+
+    lookup_name = 'in_network'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        start, end = network_bounds(self.rhs)
+        binary = connection.Database.Binary
+        return (
+            f'{lhs} BETWEEN %s AND %s',
+            list(lhs_params) + [binary(start), binary(end)],
+        )
+
+
+class IPShardKeyField(models.PositiveSmallIntegerField):
+    """
+    ``ip_shard_key()`` of another field on the model, kept up to date on
+    every save and ``bulk_create`` (like ``auto_now``).
+
+    Lets background jobs split work by IP in SQL: shard i of N is
+    ``shard_key % N == i``.
+
+    Args:
+        ip_field (str): Name of the IP address field to hash
+    """
+
+    def __init__(self, *args, ip_field='ip_address', **kwargs):
+        self.ip_field = ip_field
+        kwargs.setdefault('default', 0)
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.ip_field != 'ip_address':
+            kwargs['ip_field'] = self.ip_field
+        kwargs.pop('default', None)
+        kwargs.pop('editable', None)
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = ip_shard_key(getattr(model_instance, self.ip_field))
+        setattr(model_instance, self.attname, value)
+        return value
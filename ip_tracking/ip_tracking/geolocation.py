@@ -0,0 +1,692 @@
+"""
+Offline IP geolocation backed by a local range database.
+
+A source CSV of IP ranges (start, end, country, city) is compiled by the
+``build_geo_database`` management command into a compact binary file:
+sorted integer arrays of range starts and ends plus an index into a
+de-duplicated label table. Workers load the file once and answer lookups
+with a binary search, so no network call happens on the request path.
+
+The ipinfo HTTP provider (``IPGEOLOCATION_SETTINGS``) is only used as a
+fallback for addresses the local database does not cover, and only when
+``IP_TRACKING_GEO_HTTP_FALLBACK`` is enabled.
+
+Provider answers are cached at two levels. The first is a bounded LRU
+in each process (``IP_TRACKING_GEO_LOCAL_CACHE_SIZE`` entries, kept for
+``IP_TRACKING_GEO_LOCAL_CACHE_SECONDS``). The second is the shared
+Django cache under ``geolocation_{ip}``. Failed lookups are cached too,
+as short-lived negative entries
+(``IP_TRACKING_GEO_NEGATIVE_CACHE_SECONDS``).
+
+A circuit breaker stops calling the provider after
+``IP_TRACKING_GEO_BREAKER_FAILURES`` consecutive failures. After
+``IP_TRACKING_GEO_BREAKER_RESET_SECONDS`` it lets one trial call through.
+Concurrent lookups of the same IP in a process share a single provider
+call.
+
+File layout (all integers little-endian):
+    magic           6 bytes, b'IPGEO1'
+    labels          uint32 byte length + JSON list of [country, city]
+    IPv4 section    uint32 count, then count uint32 starts,
+                    count uint32 ends, count uint32 label indexes
+    IPv6 section    uint32 count, then count 16-byte big-endian starts,
+                    count 16-byte ends, count uint32 label indexes
+"""
+
+import ipaddress
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import registry
+
+MAGIC = b'IPGEO1'
+
+# IPv4-mapped IPv6 block (::ffff:0:0/96)
+_IPV4_MAPPED_START = 0xFFFF << 32
+_IPV4_MAPPED_END = _IPV4_MAPPED_START + 0xFFFFFFFF
+
+# Seconds between checks for a rebuilt database file
+RELOAD_CHECK_SECONDS = 60
+
+# Shared cache lifetime for HTTP fallback results (24 hours)
+HTTP_CACHE_TIMEOUT = 24 * 60 * 60
+
+DEFAULT_LOCAL_CACHE_SIZE = 10000
+DEFAULT_LOCAL_CACHE_SECONDS = 5 * 60
+DEFAULT_NEGATIVE_CACHE_SECONDS = 60
+DEFAULT_BREAKER_FAILURES = 5
+DEFAULT_BREAKER_RESET_SECONDS = 30
+
+# Cached in place of a location when the provider lookup failed
+NEGATIVE_ENTRY = 'lookup-failed'
+
+# Process LRU only: the shared cache had nothing for the IP yet
+MISS_ENTRY = 'not-cached'
+
+
+class GeoProviderUnavailable(Exception):
+    """Raised instead of calling a provider known to be failing."""
+
+
+def _uint32_array(values=()):
+    """Return an array of unsigned 32-bit integers."""
+    # 'I' is 4 bytes on every platform Django supports
+    return array('I', values)
+
+
+def parse_range(start, end):
+    """
+    Parse the bounds of an IP range from a source dataset.
+
+    Bounds may be address strings or integers (as in IP2Location-style
+    files). Integer bounds up to 2**32 - 1 are treated as IPv4, and
+    ranges inside ::ffff:0:0/96 are stored as plain IPv4.
+
+    Args:
+        start (str): First address of the range
+        end (str): Last address of the range
+
+    Returns:
+        tuple: (version, start int, end int)
+
+    Raises:
+        ValueError: If a bound is not a valid address
+    """
+    bounds = []
+    version = 4
+    for value in (start.strip(), end.strip()):
+        if value.isdigit():
+            number = int(value)
+            if number > 0xFFFFFFFF:
+                version = 6
+        else:
+            ip = ipaddress.ip_address(value)
+            number = int(ip)
+            if ip.version == 6:
+                version = 6
+        bounds.append(number)
+
+    start, end = bounds
+    if start > end:
+        raise ValueError(f'Range start {start} is after its end {end}')
+    if (version == 6 and start >= _IPV4_MAPPED_START
+            and end <= _IPV4_MAPPED_END):
+        return 4, start - _IPV4_MAPPED_START, end - _IPV4_MAPPED_START
+    return version, start, end
+
+
+def _parse_ip(ip_address):
+    """Parse an address string, unwrapping IPv4-mapped IPv6 addresses."""
+    ip = ipaddress.ip_address(ip_address)
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip
+
+
+class GeoDatabase:
+    """
+    In-memory IP range → (country, city) table.
+
+    Lookups cost one ``bisect`` over the sorted range starts for the
+    address family, i.e. O(log n).
+    """
+
+    def __init__(self):
+        self.labels = []
+        self._starts = {4: _uint32_array(), 6: []}
+        self._ends = {4: _uint32_array(), 6: []}
+        self._label_ids = {4: _uint32_array(), 6: _uint32_array()}
+
+    def __len__(self):
+        return len(self._starts[4]) + len(self._starts[6])
+
+    @classmethod
+    def build(cls, ranges):
+        """
+        Build a database from (version, start, end, country, city) tuples.
+
+        Overlapping ranges are resolved in favour of the one that starts
+        later, which truncates the earlier range.
+
+        Args:
+            ranges (iterable): Tuples as returned by ``parse_range()``
+                plus country and city
+
+        Returns:
+            GeoDatabase: The compiled database
+        """
+        db = cls()
+        label_index = {}
+        rows = {4: [], 6: []}
+        for version, start, end, country, city in ranges:
+            label = (country or None, city or None)
+            if label not in label_index:
+                label_index[label] = len(db.labels)
+                db.labels.append(label)
+            rows[version].append((start, end, label_index[label]))
+
+        for version, items in rows.items():
+            items.sort()
+            starts, ends, ids = [], [], []
+            for start, end, label_id in items:
+                if ends and start <= ends[-1]:
+                    # Trim the previous range so ranges never overlap
+                    ends[-1] = start - 1
+                    if ends[-1] < starts[-1]:
+                        starts.pop()
+                        ends.pop()
+                        ids.pop()
+                starts.append(start)
+                ends.append(end)
+                ids.append(label_id)
+            if version == 4:
+                starts, ends = _uint32_array(starts), _uint32_array(ends)
+            db._starts[version] = starts
+            db._ends[version] = ends
+            db._label_ids[version] = _uint32_array(ids)
+        return db
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a compiled database file.
+
+        Args:
+            path (str or Path): File written by ``save()``
+
+        Returns:
+            GeoDatabase: The loaded database
+
+        Raises:
+            ValueError: If the file is not a geolocation database
+        """
+        db = cls()
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a geolocation database')
+
+            (size,) = struct.unpack('<I', f.read(4))
+            db.labels = [tuple(label) for label in json.loads(f.read(size))]
+
+            (count,) = struct.unpack('<I', f.read(4))
+            for target in (db._starts[4], db._ends[4], db._label_ids[4]):
+                target.frombytes(f.read(count * 4))
+
+            (count,) = struct.unpack('<I', f.read(4))
+            for target in (db._starts[6], db._ends[6]):
+                data = f.read(count * 16)
+                target.extend(
+                    int.from_bytes(data[i:i + 16], 'big')
+                    for i in range(0, len(data), 16)
+                )
+            db._label_ids[6].frombytes(f.read(count * 4))
+
+        if sys.byteorder == 'big':
+            for ids in (db._starts[4], db._ends[4], *db._label_ids.values()):
+                ids.byteswap()
+        return db
+
+    def save(self, path):
+        """
+        Write the database to ``path`` atomically.
+
+        The file is written next to its destination and then renamed, so
+        workers reloading it never see a partially written file.
+
+        Args:
+            path (str or Path): Destination file
+        """
+        def little_endian(values):
+            values = _uint32_array(values)
+            if sys.byteorder == 'big':
+                values.byteswap()
+            return values.tobytes()
+
+        labels = json.dumps(self.labels).encode('utf-8')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(labels)))
+            f.write(labels)
+
+            f.write(struct.pack('<I', len(self._starts[4])))
+            f.write(little_endian(self._starts[4]))
+            f.write(little_endian(self._ends[4]))
+            f.write(little_endian(self._label_ids[4]))
+
+            f.write(struct.pack('<I', len(self._starts[6])))
+            for values in (self._starts[6], self._ends[6]):
+                f.write(b''.join(v.to_bytes(16, 'big') for v in values))
+            f.write(little_endian(self._label_ids[6]))
+        os.replace(tmp_path, path)
+
+    def lookup(self, ip_address):
+        """
+        Find the location of an IP address.
+
+        Args:
+            ip_address (str): IPv4 or IPv6 address
+
+        Returns:
+            dict: {'country': ..., 'city': ...} or None if not covered
+        """
+        try:
+            ip = _parse_ip(ip_address)
+        except ValueError:
+            return None
+
+        value = int(ip)
+        starts = self._starts[ip.version]
+        i = bisect_right(starts, value) - 1
+        if i < 0 or value > self._ends[ip.version][i]:
+            return None
+        country, city = self.labels[self._label_ids[ip.version][i]]
+        return {'country': country, 'city': city}
+
+
+class LocalGeoCache:
+    """
+    Bounded per-process LRU of geolocation answers with per-entry expiry.
+
+    Args:
+        max_size (int): Entries kept; the least recently used go first
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # ip -> (value, expires, monotonic)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, ip_address):
+        """Return the live entry for an IP, or None."""
+        with self._lock:
+            entry = self._entries.get(ip_address)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[ip_address]
+                return None
+            self._entries.move_to_end(ip_address)
+            return entry[0]
+
+    def set(self, ip_address, value, timeout):
+        """Store a value for ``timeout`` seconds."""
+        with self._lock:
+            self._entries[ip_address] = (value, time.monotonic() + timeout)
+            self._entries.move_to_end(ip_address)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing dependency for a while.
+
+    Closed: calls go through. After ``failures`` consecutive errors the
+    breaker opens and ``allow()`` refuses calls. Once ``reset_seconds``
+    have passed one trial call is allowed (half-open); its success closes
+    the breaker, its failure opens it again.
+
+    Args:
+        failures (int): Consecutive errors that open the breaker
+        reset_seconds (float): How long it stays open
+    """
+
+    def __init__(self, failures, reset_seconds):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._errors = 0
+        self._open_until = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """'closed', 'open' or 'half-open'."""
+        if self._open_until is None:
+            return 'closed'
+        if time.monotonic() < self._open_until:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        """
+        Check if a call may go through now.
+
+        Returns:
+            bool: False while open, and for all but one caller half-open
+        """
+        with self._lock:
+            if self._open_until is None:
+                return True
+            if time.monotonic() < self._open_until or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._errors = 0
+            self._open_until = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._errors += 1
+            self._trial = False
+            if self._open_until is not None or self._errors >= self.failures:
+                self._open_until = time.monotonic() + self.reset_seconds
+
+
+class _InFlight:
+    """One provider call other threads can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GeoLocator:
+    """
+    Resolve IP addresses to a country and city.
+
+    The local database answers first. Addresses it does not cover go to
+    the HTTP provider if ``IP_TRACKING_GEO_HTTP_FALLBACK`` is on; those
+    answers are cached in the process LRU and in the shared Django cache
+    under ``geolocation_{ip}``. The database file is reloaded
+    automatically when it is rebuilt.
+    """
+
+    def __init__(self, path=None, http_fallback=None):
+        self.path = path or getattr(settings, 'IP_TRACKING_GEO_DATABASE', None)
+        if http_fallback is None:
+            http_fallback = getattr(
+                settings, 'IP_TRACKING_GEO_HTTP_FALLBACK', True
+            )
+        self.http_fallback = http_fallback
+
+        self._db = None
+        self._mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._http = None
+
+        self.local_cache = LocalGeoCache(getattr(
+            settings, 'IP_TRACKING_GEO_LOCAL_CACHE_SIZE',
+            DEFAULT_LOCAL_CACHE_SIZE
+        ))
+        self.local_cache_seconds = getattr(
+            settings, 'IP_TRACKING_GEO_LOCAL_CACHE_SECONDS',
+            DEFAULT_LOCAL_CACHE_SECONDS
+        )
+        self.negative_cache_seconds = getattr(
+            settings, 'IP_TRACKING_GEO_NEGATIVE_CACHE_SECONDS',
+            DEFAULT_NEGATIVE_CACHE_SECONDS
+        )
+        self.breaker = CircuitBreaker(
+            getattr(settings, 'IP_TRACKING_GEO_BREAKER_FAILURES',
+                    DEFAULT_BREAKER_FAILURES),
+            getattr(settings, 'IP_TRACKING_GEO_BREAKER_RESET_SECONDS',
+                    DEFAULT_BREAKER_RESET_SECONDS),
+        )
+        self._inflight = {}  # ip -> _InFlight
+        self._inflight_lock = threading.Lock()
+
+    @property
+    def database(self):
+        """The loaded GeoDatabase, or None if no file is available."""
+        if time.monotonic() >= self._next_check:
+            self._maybe_reload()
+        return self._db
+
+    def locate(self, ip_address):
+        """
+        Look up the location of an IP address.
+
+        Args:
+            ip_address (str): Client IP address
+
+        Returns:
+            dict: {'country': ..., 'city': ...} (values may be None)
+
+        Raises:
+            Exception: Errors from the HTTP provider are passed through
+        """
+        geo_data = self.locate_local(ip_address)
+        if geo_data is None:
+            geo_data = self.query_http(ip_address)
+        return geo_data
+
+    def locate_local(self, ip_address):
+        """
+        Look up an IP address in the local database only.
+
+        Checks the file for a rebuild at most every RELOAD_CHECK_SECONDS,
+        so async code uses ``locate_memory()`` instead.
+
+        Args:
+            ip_address (str): Client IP address
+
+        Returns:
+            dict: {'country': ..., 'city': ...}, or None if only the HTTP
+                provider could answer
+        """
+        return self._locate_in(self.database, ip_address)
+
+    def _locate_in(self, db, ip_address):
+        """Look up an IP address in a loaded GeoDatabase (or None)."""
+        if db is not None:
+            geo_data = db.lookup(ip_address)
+            if geo_data is not None:
+                registry.inc('ip_tracking_geo_lookups_total', source='local')
+                return geo_data
+        if not self.http_fallback:
+            # Nothing left to ask, the address is simply not covered
+            registry.inc('ip_tracking_geo_lookups_total', source='uncovered')
+            return {'country': None, 'city': None}
+        return None
+
+    def locate_memory(self, ip_address):
+        """
+        Look up an IP address in process memory only.
+
+        Uses the local database as loaded and the process LRU and does no
+        I/O, so it is safe to call from async code. The database file is
+        checked for a rebuild by ``areload()``, off the event loop.
+
+        Args:
+            ip_address (str): Client IP address
+
+        Returns:
+            dict: {'country': ..., 'city': ...} or None if unknown here
+        """
+        geo_data = self._locate_in(self._db, ip_address)
+        if geo_data is None:
+            entry = self.local_cache.get(ip_address)
+            if entry is not None:
+                registry.inc('ip_tracking_geo_lookups_total', source='process')
+                if entry not in (NEGATIVE_ENTRY, MISS_ENTRY):
+                    geo_data = entry
+        return geo_data
+
+    def locate_cached(self, ip_address):
+        """
+        Look up an IP address without calling the HTTP provider.
+
+        Only the local database, the process LRU and the shared cache are
+        consulted, so this is safe to call on the request path. Shared
+        cache misses are remembered in the LRU for the negative TTL, so a
+        busy unknown IP costs one cache round-trip per TTL, not one per
+        request.
+
+        Args:
+            ip_address (str): Client IP address
+
+        Returns:
+            dict: {'country': ..., 'city': ...} or None if unknown
+        """
+        geo_data = self.locate_local(ip_address)
+        if geo_data is not None:
+            return geo_data
+
+        entry = self.local_cache.get(ip_address)
+        if entry is not None:
+            registry.inc('ip_tracking_geo_lookups_total', source='process')
+            return None if entry in (NEGATIVE_ENTRY, MISS_ENTRY) else entry
+
+        entry = cache.get(f"geolocation_{ip_address}")
+        if entry is None or entry == NEGATIVE_ENTRY:
+            registry.inc(
+                'ip_tracking_geo_lookups_total',
+                source='miss' if entry is None else 'negative'
+            )
+            self.local_cache.set(
+                ip_address, entry or MISS_ENTRY, self.negative_cache_seconds
+            )
+            return None
+        registry.inc('ip_tracking_geo_lookups_total', source='cache')
+        self.local_cache.set(ip_address, entry, self.local_cache_seconds)
+        return entry
+
+    def query_http(self, ip_address):
+        """
+        Query the HTTP provider, using the process and shared caches.
+
+        Concurrent calls for the same IP in this process share a single
+        provider request. Failures are cached as negative entries for
+        ``negative_cache_seconds``, and the circuit breaker stops
+        calling a provider that keeps failing.
+
+        Args:
+            ip_address (str): Client IP address
+
+        Returns:
+            dict: {'country': ..., 'city': ...}
+
+        Raises:
+            GeoProviderUnavailable: If a recent lookup of this IP failed
+                or the circuit breaker is open
+            Exception: Errors from the HTTP provider are passed through
+        """
+        cache_key = f"geolocation_{ip_address}"
+        entry = self.local_cache.get(ip_address)
+        if entry is None or entry == MISS_ENTRY:
+            entry = cache.get(cache_key)
+        if entry == NEGATIVE_ENTRY:
+            registry.inc('ip_tracking_geo_lookups_total', source='negative')
+            raise GeoProviderUnavailable(
+                f'Lookup of {ip_address} failed recently'
+            )
+        if entry:
+            self.local_cache.set(ip_address, entry, self.local_cache_seconds)
+            return entry
+
+        with self._inflight_lock:
+            call = self._inflight.get(ip_address)
+            leader = call is None
+            if leader:
+                call = self._inflight[ip_address] = _InFlight()
+
+        if not leader:
+            # Another thread is already asking the provider for this IP
+            registry.inc('ip_tracking_geo_lookups_total', source='coalesced')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._query_provider(ip_address, cache_key)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[ip_address]
+            call.done.set()
+
+    def _query_provider(self, ip_address, cache_key):
+        """Make one provider call behind the circuit breaker."""
+        if not self.breaker.allow():
+            registry.inc('ip_tracking_geo_lookups_total', source='breaker_open')
+            raise GeoProviderUnavailable('Geolocation provider circuit is open')
+
+        try:
+            if self._http is None:
+                # Optional dependency, only needed for the fallback
+                from django_ipgeolocation import IpGeolocation
+                self._http = IpGeolocation()
+            response = self._http.query(ip=ip_address)
+        except Exception:
+            self.breaker.record_failure()
+            registry.inc('ip_tracking_geo_lookups_total', source='http_error')
+            self.local_cache.set(
+                ip_address, NEGATIVE_ENTRY, self.negative_cache_seconds
+            )
+            cache.set(cache_key, NEGATIVE_ENTRY,
+                      timeout=self.negative_cache_seconds)
+            raise
+
+        self.breaker.record_success()
+        registry.inc('ip_tracking_geo_lookups_total', source='http')
+        geo_data = {
+            'country': response.get('country', ''),
+            'city': response.get('city', '')
+        }
+        cache.set(cache_key, geo_data, timeout=HTTP_CACHE_TIMEOUT)
+        self.local_cache.set(ip_address, geo_data, self.local_cache_seconds)
+        return geo_data
+
+    def needs_reload(self):
+        """
+        Check if the database file is due to be checked for a rebuild.
+
+        Returns:
+            bool: True once RELOAD_CHECK_SECONDS have elapsed
+        """
+        return time.monotonic() >= self._next_check
+
+    async def areload(self):
+        """Check (and reload) the database file from a worker thread."""
+        # No database access: no need to wait for the ORM's thread
+        await sync_to_async(self._maybe_reload, thread_sensitive=False)()
+
+    def _maybe_reload(self):
+        """Load the database file if it is new or has been rebuilt."""
+        with self._lock:
+            if time.monotonic() < self._next_check:
+                return
+            self._next_check = time.monotonic() + RELOAD_CHECK_SECONDS
+            if not self.path:
+                return
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                return
+            if mtime != self._mtime:
+                self._db = GeoDatabase.load(self.path)
+                self._mtime = mtime
+
+
+# Shared per-process locator used by the middleware
+geolocator = GeoLocator()
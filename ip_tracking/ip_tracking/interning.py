@@ -0,0 +1,214 @@
+"""
+Dictionary encoding for repetitive RequestLog strings.
+
+Paths and user agents repeat across millions of log rows but take only
+a small set of distinct values. Each distinct string is stored once in
+a lookup table (RequestPath, UserAgent), keyed by its SHA-1 digest, and
+RequestLog keeps only the integer id.
+
+A ``StringInterner`` maps strings to ids and back through a bounded
+in-process LRU (``IP_TRACKING_INTERN_CACHE_SIZE`` entries per table).
+Lookups are resolved in bulk when the log buffer flushes, never per
+request: a batch of records costs at most one SELECT per table for
+strings the worker has not seen recently, plus one INSERT for strings
+nobody has seen before.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+
+from .metrics import registry
+
+DEFAULT_CACHE_SIZE = 10000
+
+# Max values per IN (...) query
+QUERY_CHUNK_SIZE = 500
+
+
+def digest(value):
+    """Return the hex SHA-1 digest a lookup table row is keyed by."""
+    return hashlib.sha1(value.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+class StringInterner:
+    """
+    Bounded LRU between strings and their lookup table ids.
+
+    Args:
+        model_label (str): 'app_label.ModelName' of the lookup table
+        max_size (int): Entries kept per direction
+    """
+
+    def __init__(self, model_label, max_size=None):
+        self.model_label = model_label
+        self.max_size = max_size or getattr(
+            settings, 'IP_TRACKING_INTERN_CACHE_SIZE', DEFAULT_CACHE_SIZE
+        )
+        self._ids = OrderedDict()     # value -> id
+        self._values = OrderedDict()  # id -> value
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    def ids_for(self, values):
+        """
+        Map strings to ids, creating lookup rows for new strings.
+
+        Args:
+            values (iterable): Strings (None is skipped)
+
+        Returns:
+            dict: {value: id}
+        """
+        result, missing = {}, []
+        with self._lock:
+            for value in set(values):
+                if value is None:
+                    continue
+                value_id = self._ids.get(value)
+                if value_id is None:
+                    missing.append(value)
+                else:
+                    self._ids.move_to_end(value)
+                    result[value] = value_id
+        self._count(len(result), len(missing))
+
+        if missing:
+            by_digest = {digest(value): value for value in missing}
+            found = self._ids_by_digest(by_digest)
+            new = [d for d in by_digest if d not in found]
+            if new:
+                # ignore_conflicts: another worker may insert the same
+                # string at the same time; the re-read picks up its id
+                self.model.objects.bulk_create(
+                    [self.model(value=by_digest[d], digest=d) for d in new],
+                    ignore_conflicts=True,
+                )
+                found.update(self._ids_by_digest(new))
+            resolved = {by_digest[d]: value_id for d, value_id in found.items()}
+            self._remember(resolved)
+            result.update(resolved)
+        return result
+
+    def values_for(self, ids):
+        """
+        Map ids back to their strings.
+
+        Args:
+            ids (iterable): Lookup table ids (None is skipped)
+
+        Returns:
+            dict: {id: value}
+        """
+        result, missing = {}, []
+        with self._lock:
+            for value_id in set(ids):
+                if value_id is None:
+                    continue
+                value = self._values.get(value_id)
+                if value is None:
+                    missing.append(value_id)
+                else:
+                    self._values.move_to_end(value_id)
+                    result[value_id] = value
+        self._count(len(result), len(missing))
+
+        if missing:
+            resolved = {}
+            for start in range(0, len(missing), QUERY_CHUNK_SIZE):
+                resolved.update(
+                    self.model.objects.filter(
+                        id__in=missing[start:start + QUERY_CHUNK_SIZE]
+                    ).values_list('id', 'value')
+                )
+            self._remember({value: value_id
+                            for value_id, value in resolved.items()})
+            result.update(resolved)
+        return result
+
+    def id_for(self, value):
+        """Return the id of one string (None for None)."""
+        return self.ids_for([value]).get(value)
+
+    def value_for(self, value_id):
+        """Return the string of one id (None for None)."""
+        return self.values_for([value_id]).get(value_id)
+
+    def clear(self):
+        """Forget every cached mapping."""
+        with self._lock:
+            self._ids.clear()
+            self._values.clear()
+
+    def _count(self, hits, misses):
+        table = self.model_label.rsplit('.', 1)[-1]
+        if hits:
+            registry.inc('ip_tracking_intern_lookups_total', hits,
+                         table=table, result='hit')
+        if misses:
+            registry.inc('ip_tracking_intern_lookups_total', misses,
+                         table=table, result='miss')
+
+    def _ids_by_digest(self, digests):
+        digests = list(digests)
+        found = {}
+        for start in range(0, len(digests), QUERY_CHUNK_SIZE):
+            found.update(
+                self.model.objects.filter(
+                    digest__in=digests[start:start + QUERY_CHUNK_SIZE]
+                ).values_list('digest', 'id')
+            )
+        return found
+
+    def _remember(self, mapping):
+        """Add {value: id} pairs, evicting the least recently used."""
+        with self._lock:
+            for value, value_id in mapping.items():
+                self._ids[value] = value_id
+                self._values[value_id] = value
+                self._ids.move_to_end(value)
+                self._values.move_to_end(value_id)
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+
+
+# Shared per-process interners
+paths = StringInterner('ip_tracking.RequestPath')
+user_agents = StringInterner('ip_tracking.UserAgent')
+
+
+def encode_request_logs(records):
+    """
+    Swap 'path'/'user_agent' strings for lookup table ids.
+
+    Args:
+        records (list): RequestLog field dicts (as queued by the log
+            buffer or read from an archive)
+
+    Returns:
+        list: New dicts with path_ref_id/user_agent_ref_id instead; the
+            input dicts are left as they were
+    """
+    path_ids = paths.ids_for(record.get('path') for record in records)
+    agent_ids = user_agents.ids_for(
+        record.get('user_agent') for record in records
+    )
+    encoded = []
+    for record in records:
+        record = dict(record)
+        if 'path' in record:
+            record['path_ref_id'] = path_ids.get(record.pop('path'))
+        if 'user_agent' in record:
+            record['user_agent_ref_id'] = agent_ids.get(
+                record.pop('user_agent')
+            )
+        encoded.append(record)
+    return encoded
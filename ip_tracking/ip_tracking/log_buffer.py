@@ -0,0 +1,292 @@
+"""
+Per-process buffer for RequestLog writes.
+
+The middleware hands each log record to the buffer instead of running an
+INSERT on the request path. A background thread writes them with
+``bulk_create`` once ``IP_TRACKING_LOG_BATCH_SIZE`` records are queued,
+once the oldest record is ``IP_TRACKING_LOG_FLUSH_SECONDS`` old, and
+when the process exits.
+
+The buffer never holds more than ``IP_TRACKING_LOG_BUFFER_SIZE`` records.
+When it is full (for example while the database is unavailable) new
+records are dropped and counted in ``stats()['dropped']``.
+
+A batch that fails to insert is put back and retried with the next
+flush. If the retry fails too, and not because the database is
+unreachable, the batch is written half by half, so a single record the
+database rejects (bad encoding, a value too long, ...) is isolated,
+dropped and counted in ``stats()['rejected']`` instead of stalling every
+record queued behind it.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import (
+    InterfaceError, OperationalError, close_old_connections, transaction
+)
+from django.utils import timezone
+
+from .interning import encode_request_logs
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BUFFER_SIZE = 10000
+DEFAULT_FLUSH_SECONDS = 2.0
+
+
+class RequestLogBuffer:
+    """
+    Bounded in-memory queue of pending RequestLog rows.
+
+    Records are kept as plain dicts and only turned into model instances
+    when a batch is flushed. Requests never write themselves: crossing a
+    threshold wakes the flusher thread. Only one flush runs at a time.
+    """
+
+    def __init__(self, batch_size=None, max_size=None, flush_seconds=None):
+        self.batch_size = batch_size or getattr(
+            settings, 'IP_TRACKING_LOG_BATCH_SIZE', DEFAULT_BATCH_SIZE
+        )
+        self.max_size = max_size or getattr(
+            settings, 'IP_TRACKING_LOG_BUFFER_SIZE', DEFAULT_BUFFER_SIZE
+        )
+        self.flush_seconds = flush_seconds or getattr(
+            settings, 'IP_TRACKING_LOG_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS
+        )
+
+        self._records = deque()
+        self._oldest = None  # monotonic time of the oldest queued record
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher = None
+        self._retrying = False  # the queue starts with a failed batch
+
+        self._stats = {
+            'queued': 0,
+            'written': 0,
+            'dropped': 0,
+            'rejected': 0,
+            'flushes': 0,
+            'errors': 0,
+            'last_flush_size': 0,
+            'last_flush_seconds': 0.0,
+        }
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, **fields):
+        """
+        Queue one RequestLog record.
+
+        Args:
+            **fields: RequestLog field values (ip_address, path, ...)
+
+        Returns:
+            bool: True if queued, False if the buffer was full
+        """
+        fields.setdefault('timestamp', timezone.now())
+
+        with self._lock:
+            if len(self._records) >= self.max_size:
+                self._stats['dropped'] += 1
+                registry.inc('ip_tracking_log_records_dropped_total')
+                return False
+            if not self._records:
+                self._oldest = time.monotonic()
+            self._records.append(fields)
+            self._stats['queued'] += 1
+            due = self._is_due()
+
+        self._ensure_flusher()
+        if due:
+            self._wake.set()
+        return True
+
+    def flush(self, block=True):
+        """
+        Write all queued records to the database.
+
+        Args:
+            block (bool): Wait for a flush already in progress to finish
+
+        Returns:
+            int: Number of rows written
+        """
+        if not self._flush_lock.acquire(blocking=block):
+            return 0
+        try:
+            with self._lock:
+                batch = list(self._records)
+                self._records.clear()
+                self._oldest = None
+            if not batch:
+                return 0
+            return self._write(batch)
+        finally:
+            self._flush_lock.release()
+
+    def stats(self):
+        """
+        Return a copy of the buffer counters.
+
+        Returns:
+            dict: queued, written, dropped, rejected, flushes, errors,
+                pending and
+                the size and duration of the last flush
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._records)
+        return stats
+
+    def _is_due(self):
+        """Check the size and age thresholds. Caller holds ``_lock``."""
+        if len(self._records) >= self.batch_size:
+            return True
+        return (
+            self._oldest is not None
+            and time.monotonic() - self._oldest >= self.flush_seconds
+        )
+
+    def _write(self, batch):
+        """Bulk insert a batch, putting it back in the queue on failure."""
+        started = time.perf_counter()
+        try:
+            self._insert(batch)
+        except Exception as exc:
+            registry.inc('ip_tracking_log_flush_errors_total')
+            with self._lock:
+                self._stats['errors'] += 1
+            if not self._retrying or isinstance(
+                exc, (InterfaceError, OperationalError)
+            ):
+                self._requeue(batch)
+                return 0
+            written = self._write_isolating(batch)
+        else:
+            written = len(batch)
+            self._retrying = False
+
+        elapsed = time.perf_counter() - started
+        registry.inc('ip_tracking_log_records_written_total', written)
+        registry.observe('ip_tracking_log_flush_duration_seconds', elapsed)
+        with self._lock:
+            self._stats['written'] += written
+            self._stats['flushes'] += 1
+            self._stats['last_flush_size'] = written
+            self._stats['last_flush_seconds'] = elapsed
+        return written
+
+    def _insert(self, records):
+        from .models import RequestLog
+
+        # Paths and user agents are resolved to lookup ids for the
+        # whole batch at once, mostly from the in-process LRU
+        logs = [
+            RequestLog(**fields) for fields in encode_request_logs(records)
+        ]
+        # A savepoint, so a rejected batch doesn't break a transaction
+        # the caller has open (ATOMIC_REQUESTS views, tests). The lookup
+        # rows interned above stay either way and are reused on retry.
+        with transaction.atomic():
+            RequestLog.objects.bulk_create(logs, batch_size=self.batch_size)
+
+    def _write_isolating(self, batch):
+        """
+        Write a batch that failed twice, one half at a time.
+
+        Halves that fail are split again until the records the database
+        rejects are found; those are dropped. If the database becomes
+        unreachable meanwhile, what is left goes back to the queue.
+
+        Returns:
+            int: Number of rows written
+        """
+        written = rejected = 0
+        parts = [batch]  # stack: the next part to write is on top
+        while parts:
+            part = parts.pop()
+            try:
+                self._insert(part)
+                written += len(part)
+            except (InterfaceError, OperationalError):
+                self._requeue(part + [
+                    fields for rest in reversed(parts) for fields in rest
+                ])
+                break
+            except Exception as exc:
+                if len(part) > 1:
+                    middle = len(part) // 2
+                    parts.append(part[middle:])
+                    parts.append(part[:middle])
+                    continue
+                rejected += 1
+                logger.warning('Dropped a RequestLog record the database '
+                               'rejected: %s', exc)
+        else:
+            self._retrying = False
+
+        if rejected:
+            registry.inc('ip_tracking_log_records_rejected_total', rejected)
+            with self._lock:
+                self._stats['rejected'] += rejected
+        return written
+
+    def _requeue(self, batch):
+        """Put records back ahead of newer ones, dropping what won't fit."""
+        with self._lock:
+            room = self.max_size - len(self._records)
+            kept = batch[-room:] if room > 0 else []
+            self._stats['dropped'] += len(batch) - len(kept)
+            registry.inc(
+                'ip_tracking_log_records_dropped_total',
+                len(batch) - len(kept)
+            )
+            self._records.extendleft(reversed(kept))
+            if kept:
+                self._retrying = True
+                if self._oldest is None:
+                    self._oldest = time.monotonic()
+
+    def _ensure_flusher(self):
+        """Start the background thread that writes queued batches."""
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(
+                target=self._run_flusher,
+                name='ip-tracking-log-flush',
+                daemon=True
+            )
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            # Woken early by add() when a batch fills up
+            self._wake.wait(timeout=self.flush_seconds)
+            self._wake.clear()
+            with self._lock:
+                due = self._is_due()
+            if due:
+                self.flush()
+                # This thread is outside the request cycle, so close its
+                # connection here the way Django does after a request
+                close_old_connections()
+
+
+# Shared per-process buffer used by the middleware
+log_buffer = RequestLogBuffer()
+
+# Don't lose queued records on a clean worker shutdown
+atexit.register(log_buffer.flush)
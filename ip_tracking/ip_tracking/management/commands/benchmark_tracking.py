@@ -0,0 +1,127 @@
+"""
+Management command to benchmark the request tracking middleware.
+
+Usage:
+    python manage.py benchmark_tracking
+    python manage.py benchmark_tracking --scenario unique_ips --scenario login
+    python manage.py benchmark_tracking --requests 20000 --compare
+    python manage.py benchmark_tracking --no-save
+
+Runs against a throwaway test database, a local-memory cache and a
+synthetic geolocation database. Results are appended to
+IP_TRACKING_BENCHMARK_RESULTS (default: benchmarks/results.jsonl) with the
+current git commit.
+"""
+
+from django.core.management.base import BaseCommand
+from ip_tracking.benchmarks import (
+    DEFAULT_REQUESTS, DEFAULT_WARMUP, SCENARIOS, previous_results,
+    run_benchmarks, save_results
+)
+
+
+class Command(BaseCommand):
+    """
+    Django management command to measure per-request latency,
+    throughput and DB queries of the tracking stack.
+    """
+
+    help = 'Benchmark the tracking middleware with synthetic traffic'
+
+    def add_arguments(self, parser):
+        """Define command-line arguments."""
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            choices=list(SCENARIOS),
+            help='Scenario to run (repeatable, default: all)'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=DEFAULT_REQUESTS,
+            help=f'Measured requests per scenario (default: {DEFAULT_REQUESTS})'
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=DEFAULT_WARMUP,
+            help=f'Unmeasured requests first (default: {DEFAULT_WARMUP})'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Traffic seed (default: 42)'
+        )
+        parser.add_argument(
+            '--compare',
+            action='store_true',
+            help='Show changes against the last run from another commit'
+        )
+        parser.add_argument(
+            '--no-save',
+            action='store_true',
+            help='Do not append the results to the results file'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=None,
+            help='Results file (default: IP_TRACKING_BENCHMARK_RESULTS)'
+        )
+
+    def handle(self, *args, **options):
+        """Execute the benchmark command."""
+        previous = previous_results(options['output']) \
+            if options['compare'] else {}
+
+        self.stdout.write(self.style.SUCCESS('\n📊 Tracking benchmark'))
+        self.stdout.write('=' * 70)
+        self.stdout.write(
+            f"{'scenario':<16}{'p50 µs':>9}{'p99 µs':>10}"
+            f"{'req/s':>10}{'queries/req':>13}"
+        )
+
+        results = run_benchmarks(
+            scenarios=options['scenario'],
+            requests=options['requests'],
+            warmup=options['warmup'],
+            seed=options['seed'],
+            progress=lambda result: self.show_result(
+                result, previous.get(result['scenario'])
+            ),
+        )
+
+        self.stdout.write('=' * 70)
+        if not options['no_save']:
+            path = save_results(results, options['output'])
+            self.stdout.write(f'   Results saved to {path}')
+
+    def show_result(self, result, previous=None):
+        """Print one scenario line, plus deltas and stage timings."""
+        self.stdout.write(
+            f"{result['scenario']:<16}{result['p50_us']:>9}"
+            f"{result['p99_us']:>10}{result['requests_per_second']:>10}"
+            f"{result['queries_per_request']:>13}"
+        )
+        if previous:
+            deltas = []
+            for key, label in (('p50_us', 'p50'), ('p99_us', 'p99'),
+                               ('requests_per_second', 'req/s')):
+                if previous.get(key):
+                    change = (result[key] - previous[key]) / previous[key]
+                    deltas.append(f'{label} {change:+.1%}')
+            line = f"   vs {previous['commit']}: {', '.join(deltas)}"
+            slower = result['p50_us'] > previous['p50_us'] * 1.1
+            self.stdout.write(
+                self.style.WARNING(f'⚠️ {line[2:]}') if slower else line
+            )
+        statuses = ', '.join(
+            f'{code}: {n}' for code, n in result['statuses'].items()
+        )
+        self.stdout.write(f'   responses: {statuses}')
+        stages = ', '.join(
+            f'{name} {avg}µs' for name, avg in result['stages'].items()
+        )
+        self.stdout.write(f'   stages: {stages}')
@@ -5,10 +5,20 @@ Usage:
     python manage.py block_ip 192.168.1.100
     python manage.py block_ip 192.168.1.100 --reason "Spam bot"
     python manage.py block_ip 192.168.1.100 --reason "Malicious activity" --blocked-by "admin"
+    python manage.py block_ip 203.0.113.0/24 --reason "Botnet range"
+    python manage.py block_ip --file threat_list.txt --reason "Threat feed"
+    cat threat_list.txt | python manage.py block_ip - --reason "Threat feed"
+
+List files hold one IP or CIDR range per line; blank lines and '#'
+comments are ignored.
 """
 
+import sys
+
 from django.core.management.base import BaseCommand, CommandError
-from ip_tracking.ip_tracking.models import BlockedIP
+from ip_tracking.blocklist import get_refresh_interval, parse_block_target
+from ip_tracking.bulk import DEFAULT_BATCH_SIZE, bulk_block, read_targets
+from ip_tracking.models import BlockedIP
 
 
 class Command(BaseCommand):
@@ -18,24 +28,37 @@ class Command(BaseCommand):
     This command allows you to block IPs from the command line.
     """
 
-    help = 'Block an IP address from accessing the site'
+    help = 'Block an IP address or CIDR range from accessing the site'
 
     def add_arguments(self, parser):
         """
         Define command-line arguments.
 
-        Required:
-            ip_address: The IP address to block
+        Positional:
+            ip_address: The IP address or CIDR range to block,
+                or "-" to read a list from stdin
 
         Optional:
+            --file: Block every IP/range listed in a file
             --reason: Why this IP is being blocked
             --blocked-by: Who is blocking this IP
+            --batch-size: Entries written per batch in list mode
         """
-        # Required positional argument: IP address
+        # Positional argument: IP address or range (or "-" for stdin)
         parser.add_argument(
             'ip_address',
             type=str,
-            help='IP address to block (e.g., 192.168.1.100 or 2001:db8::1)'
+            nargs='?',
+            help='IP address or CIDR range to block '
+                 '(e.g., 192.168.1.100, 2001:db8::1 or 203.0.113.0/24), '
+                 'or - to read a list from stdin'
+        )
+
+        # Optional: List of IPs/ranges, one per line
+        parser.add_argument(
+            '--file',
+            type=str,
+            help='File with one IP address or CIDR range per line'
         )
 
         # Optional: Reason for blocking
@@ -54,25 +77,43 @@ class Command(BaseCommand):
             help='Username or system that blocked this IP'
         )
 
+        # Optional: Batch size for list mode
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help=f'Entries written per batch in list mode '
+                 f'(default: {DEFAULT_BATCH_SIZE})'
+        )
+
     def handle(self, *args, **options):
         """
         Execute the command.
 
         This function runs when you execute: python manage.py block_ip <ip>
         """
+        if options['file'] or options['ip_address'] == '-':
+            return self.handle_list(options)
+        if not options['ip_address']:
+            raise CommandError('❌ Give an IP address, --file or -')
+
         # Get the arguments
-        ip_address = options['ip_address']
+        try:
+            model, lookup, ip_address = parse_block_target(
+                options['ip_address']
+            )
+        except ValueError as e:
+            raise CommandError(f'❌ {e}')
         reason = options['reason']
         blocked_by = options['blocked_by']
 
         try:
-            # Check if this IP is already blocked
-            existing_block = BlockedIP.objects.filter(
-                ip_address=ip_address,
-                is_active=True
-            ).first()
+            existing_block = model.objects.filter(**lookup).first()
+            # Temporary blocks (BlockedIP.expires_at) lapse on their own;
+            # an expired one is as good as inactive
+            permanent = getattr(existing_block, 'expires_at', None) is None
 
-            if existing_block:
+            if existing_block and existing_block.is_active and permanent:
                 # IP is already blocked
                 self.stdout.write(
                     self.style.WARNING(
@@ -86,18 +127,15 @@ class Command(BaseCommand):
                     self.stdout.write(f'   Reason: {existing_block.reason}')
                 return
 
-            # Check if IP was previously blocked but is now inactive
-            inactive_block = BlockedIP.objects.filter(
-                ip_address=ip_address,
-                is_active=False
-            ).first()
-
-            if inactive_block:
-                # Reactivate the block
-                inactive_block.is_active = True
-                inactive_block.reason = reason or inactive_block.reason
-                inactive_block.blocked_by = blocked_by
-                inactive_block.save()
+            if existing_block:
+                # Reactivate an inactive, expired or temporary block as a
+                # permanent one
+                existing_block.is_active = True
+                existing_block.reason = reason or existing_block.reason
+                existing_block.blocked_by = blocked_by
+                if model is BlockedIP:
+                    existing_block.expires_at = None
+                existing_block.save()
 
                 self.stdout.write(
                     self.style.SUCCESS(
@@ -106,10 +144,10 @@ class Command(BaseCommand):
                 )
             else:
                 # Create a new block
-                blocked_ip = BlockedIP.objects.create(
-                    ip_address=ip_address,
+                blocked_ip = model.objects.create(
                     reason=reason,
-                    blocked_by=blocked_by
+                    blocked_by=blocked_by,
+                    **lookup
                 )
 
                 self.stdout.write(
@@ -122,6 +160,65 @@ class Command(BaseCommand):
             if reason:
                 self.stdout.write(f'   Reason: {reason}')
             self.stdout.write(f'   Blocked by: {blocked_by}')
+            self.stdout.write(
+                f'   Active on all workers within '
+                f'{get_refresh_interval()}s'
+            )
 
         except Exception as e:
-            raise CommandError(f'❌ Error blocking IP: {str(e)}')
\ No newline at end of file
+            raise CommandError(f'❌ Error blocking IP: {str(e)}')
+
+    def handle_list(self, options):
+        """Block every IP/range from --file or stdin in batches."""
+        try:
+            source = (
+                open(options['file']) if options['file'] else sys.stdin
+            )
+        except OSError as e:
+            raise CommandError(f'❌ {e}')
+
+        with source:
+            try:
+                report = bulk_block(
+                    read_targets(source),
+                    reason=options['reason'],
+                    blocked_by=options['blocked_by'],
+                    batch_size=options['batch_size'],
+                    progress=self.show_progress,
+                )
+            except Exception as e:
+                raise CommandError(f'❌ Error blocking IPs: {str(e)}')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✅ Processed {report['processed']} entries in "
+                f"{report['seconds']}s ({report['rows_per_second']}/s)"
+            )
+        )
+        self.stdout.write(f"   Blocked: {report['created']}")
+        self.stdout.write(f"   Re-blocked: {report['reactivated']}")
+        self.stdout.write(f"   Already blocked: {report['unchanged']}")
+        show_invalid(self, report['invalid'])
+        self.stdout.write(
+            f'   Active on all workers within {get_refresh_interval()}s'
+        )
+
+    def show_progress(self, report):
+        """Print the running total after each batch."""
+        self.stdout.write(
+            f"   {report['processed']} processed "
+            f"({report['rows_per_second']}/s)..."
+        )
+
+
+def show_invalid(command, invalid, limit=10):
+    """Warn about entries that are not valid IPs or ranges."""
+    if not invalid:
+        return
+    command.stdout.write(
+        command.style.WARNING(f'⚠️  Skipped {len(invalid)} invalid entries:')
+    )
+    for value in invalid[:limit]:
+        command.stdout.write(f'   {value}')
+    if len(invalid) > limit:
+        command.stdout.write(f'   ... and {len(invalid) - limit} more')
@@ -0,0 +1,130 @@
+"""
+Management command to compile a threat-intel feed into the mapped filter.
+
+Usage:
+    python manage.py build_threat_feed feeds/scanners.txt
+    python manage.py build_threat_feed feed-a.txt feed-b.csv.gz --fp-rate 0.0001
+    python manage.py build_threat_feed feed.txt --output /srv/feeds/threat_feed.bin
+
+Each source is a local text or CSV file (.gz is decompressed) with one
+address per line in the first column. Anything after a '#' is a comment.
+CIDR ranges are skipped; block those with ``block_ip --file``.
+"""
+
+import gzip
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ip_tracking.bulk import read_targets
+from ip_tracking.threatfeed import (
+    DEFAULT_FALSE_POSITIVE_RATE, RELOAD_CHECK_SECONDS, build_threat_feed
+)
+
+# First field of a line: up to a comma, semicolon or whitespace
+FIRST_FIELD_RE = re.compile(r'[,;\s]')
+
+
+class Command(BaseCommand):
+    """
+    Django management command to build the memory-mapped threat feed
+    filter (Bloom filter plus sorted exact entries) from feed files.
+    """
+
+    help = 'Build the threat feed filter file from local feed files'
+
+    def add_arguments(self, parser):
+        """Define command-line arguments."""
+        parser.add_argument(
+            'sources',
+            nargs='+',
+            type=str,
+            help='Feed files (one IP per line, .gz is decompressed)'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=None,
+            help='Where to write the filter '
+                 '(default: settings.IP_TRACKING_THREAT_FEED)'
+        )
+        parser.add_argument(
+            '--fp-rate',
+            type=float,
+            default=DEFAULT_FALSE_POSITIVE_RATE,
+            help='Bloom filter false positive rate; hits are confirmed '
+                 f'exactly either way (default: {DEFAULT_FALSE_POSITIVE_RATE})'
+        )
+
+    def handle(self, *args, **options):
+        """Execute the build command."""
+        output = options['output'] or getattr(
+            settings, 'IP_TRACKING_THREAT_FEED', None
+        )
+        if not output:
+            raise CommandError(
+                '❌ No --output given and IP_TRACKING_THREAT_FEED is not set'
+            )
+        if not 0 < options['fp_rate'] < 1:
+            raise CommandError('❌ --fp-rate must be between 0 and 1')
+        for source in options['sources']:
+            if not Path(source).is_file():
+                raise CommandError(f'❌ Feed file not found: {source}')
+
+        self.ranges = 0
+        Path(output).parent.mkdir(parents=True, exist_ok=True)
+        report = build_threat_feed(
+            self.read_addresses(options['sources']),
+            output,
+            false_positive_rate=options['fp_rate'],
+        )
+
+        if not report['entries']:
+            self.stdout.write(
+                self.style.WARNING('⚠️  No valid addresses found; the filter is empty')
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✅ Wrote {report['entries']} addresses to {output} "
+                f"({report['bytes'] / 1024 / 1024:.1f} MiB)"
+            )
+        )
+        self.stdout.write(
+            f"   Bloom filter: {report['bits'] / max(report['entries'], 1):.1f} "
+            f"bits/address, {report['hashes']} hashes, "
+            f"~{options['fp_rate']:.4%} false positives (confirmed exactly)"
+        )
+        if report['duplicates']:
+            self.stdout.write(f"   {report['duplicates']} duplicates merged")
+        if report['invalid']:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"⚠️  Skipped {report['invalid']} invalid entries"
+                )
+            )
+        if self.ranges:
+            self.stdout.write(
+                self.style.WARNING(
+                    f'⚠️  Skipped {self.ranges} CIDR ranges '
+                    f'(use block_ip --file for ranges)'
+                )
+            )
+        self.stdout.write(f"   Took {report['seconds']:.1f}s")
+        self.stdout.write(
+            f'   Workers map the new file within {RELOAD_CHECK_SECONDS}s, '
+            f'no restart needed'
+        )
+
+    def read_addresses(self, sources):
+        """Yield the first field of every entry in the feed files."""
+        for source in sources:
+            opener = gzip.open if source.endswith('.gz') else open
+            with opener(source, 'rt', encoding='utf-8',
+                        errors='replace') as lines:
+                for entry in read_targets(lines):
+                    value = FIRST_FIELD_RE.split(entry, 1)[0]
+                    if '/' in value:
+                        self.ranges += 1
+                        continue
+                    yield value
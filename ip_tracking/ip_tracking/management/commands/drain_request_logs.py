@@ -0,0 +1,121 @@
+"""
+Management command to move spooled log records into RequestLog.
+
+Usage:
+    python manage.py drain_request_logs
+    python manage.py drain_request_logs --once
+    python manage.py drain_request_logs --spool /dev/shm/ip_tracking.spool --batch-size 2000
+
+Runs until interrupted, one process per spool file (per host). Workers
+only append to the spool when IP_TRACKING_LOG_SPOOL is set.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from ip_tracking.spool import (
+    DEFAULT_DRAIN_BATCH_SIZE, LogSpool, SpoolError, drain_spool
+)
+
+
+class Command(BaseCommand):
+    """
+    Django management command to drain the shared log spool into the
+    database in batches.
+    """
+
+    help = 'Insert the records of the shared log spool into RequestLog'
+
+    def add_arguments(self, parser):
+        """Define command-line arguments."""
+        parser.add_argument(
+            '--spool',
+            type=str,
+            default=None,
+            help='Spool file (default: settings.IP_TRACKING_LOG_SPOOL)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_DRAIN_BATCH_SIZE,
+            help=f'Records per insert (default: {DEFAULT_DRAIN_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when the spool is empty (default: 1.0)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the spool is empty'
+        )
+
+    def handle(self, *args, **options):
+        """Execute the drain command."""
+        path = options['spool'] or getattr(
+            settings, 'IP_TRACKING_LOG_SPOOL', None
+        )
+        if not path:
+            raise CommandError(
+                '❌ No --spool given and IP_TRACKING_LOG_SPOOL is not set'
+            )
+        if options['batch_size'] < 1:
+            raise CommandError('❌ --batch-size must be at least 1')
+
+        spool = LogSpool(path)
+        try:
+            spool.acquire_drain_lock()
+            stats = spool.stats()
+        except (OSError, SpoolError) as exc:
+            raise CommandError(f'❌ {exc}')
+        self.stdout.write(
+            f"📊 Draining {path}: {stats['pending']} pending, "
+            f"{stats['slots']} slots"
+        )
+
+        drained = rejected = 0
+        started = time.perf_counter()
+        try:
+            while True:
+                result = drain_spool(spool, options['batch_size'])
+                drained += result['inserted']
+                rejected += result['rejected']
+                if result['read'] and options['verbosity'] >= 2:
+                    self.stdout.write(f"   Inserted {result['inserted']} rows")
+                if result['read'] < options['batch_size']:
+                    if options['once']:
+                        break
+                    # Outside a request: close the connection like Django
+                    # does after one, so a restarted database is picked up
+                    close_old_connections()
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        elapsed = time.perf_counter() - started
+        stats = spool.stats()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✅ Inserted {drained} rows in {elapsed:.1f}s '
+                f"({stats['pending']} still pending)"
+            )
+        )
+        if rejected:
+            self.stdout.write(
+                self.style.WARNING(
+                    f'⚠️  {rejected} records were dropped because the '
+                    f'database rejected them (see the log for the errors)'
+                )
+            )
+        if stats['overflow']:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"⚠️  {stats['overflow']} records were dropped because "
+                    f'the spool was full (raise IP_TRACKING_LOG_SPOOL_SLOTS '
+                    f'or drain faster)'
+                )
+            )
@@ -0,0 +1,77 @@
+"""
+Management command to load a RequestLog archive back into the database.
+
+Usage:
+    python manage.py import_request_logs archive.ndjson.gz
+    python manage.py import_request_logs archive.ndjson.zst --batch-size 2000
+    python manage.py import_request_logs archive.ndjson.gz --new-ids
+
+Rows keep their original ids by default, so rollups and detection do not
+count them again and importing the same archive twice is harmless.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from ip_tracking.archive import (
+    DEFAULT_BATCH_SIZE, ArchiveError, import_request_logs
+)
+
+
+class Command(BaseCommand):
+    """
+    Django management command to bulk-load an archive written by
+    export_request_logs.
+    """
+
+    help = 'Bulk-load request logs from a compressed NDJSON archive'
+
+    def add_arguments(self, parser):
+        """Define command-line arguments."""
+        parser.add_argument(
+            'path',
+            type=str,
+            help='Archive file to read (.gz or .zst)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help=f'Rows per INSERT (default: {DEFAULT_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--new-ids',
+            action='store_true',
+            help='Assign fresh ids (the rows are then rolled up again)'
+        )
+
+    def handle(self, *args, **options):
+        """Execute the import command."""
+        try:
+            report = import_request_logs(
+                options['path'],
+                batch_size=options['batch_size'],
+                keep_ids=not options['new_ids'],
+                progress=self.show_progress,
+            )
+        except (ArchiveError, OSError) as e:
+            raise CommandError(f'❌ {e}')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✅ Imported {report['imported']} of {report['read']} rows "
+                f"in {report['seconds']}s "
+                f"({report['rows_per_second']} rows/s)"
+            )
+        )
+        skipped = report['read'] - report['imported']
+        if skipped:
+            self.stdout.write(f'   Skipped {skipped} rows already present')
+        if report['truncated']:
+            self.stdout.write(
+                self.style.WARNING(
+                    '⚠️  Archive is truncated; all complete rows were loaded'
+                )
+            )
+
+    def show_progress(self, read):
+        """Print a running total after each batch."""
+        self.stdout.write(f'   {read} rows read so far...')
@@ -4,10 +4,24 @@ Management command to list all blocked IP addresses.
 Usage:
     python manage.py list_blocked_ips
     python manage.py list_blocked_ips --all  # Include inactive blocks
+    python manage.py list_blocked_ips --networks  # CIDR ranges instead
+    python manage.py list_blocked_ips --format csv > blocked.csv
+    python manage.py list_blocked_ips --limit 100 --after 5000
+
+Rows are read in keyset pages ordered by id, so listing a million
+blocks uses constant memory. With --limit, the id to pass as --after
+for the next page is printed at the end.
 """
 
+import csv
+import json
+
 from django.core.management.base import BaseCommand
-from ip_tracking.ip_tracking.models import BlockedIP
+from django.db.models import Count, Q
+from django.utils import timezone
+from ip_tracking.models import BlockedIP, BlockedNetwork
+
+PAGE_SIZE = 2000
 
 
 class Command(BaseCommand):
@@ -24,45 +38,177 @@ class Command(BaseCommand):
             action='store_true',
             help='Show all blocked IPs including inactive ones'
         )
+        parser.add_argument(
+            '--networks',
+            action='store_true',
+            help='List blocked CIDR ranges instead of single IPs'
+        )
+        parser.add_argument(
+            '--format',
+            choices=['table', 'json', 'csv'],
+            default='table',
+            help='Output format (default: table)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Stop after this many rows'
+        )
+        parser.add_argument(
+            '--after',
+            type=int,
+            default=0,
+            help='Only rows with an id above this (resume a listing)'
+        )
 
     def handle(self, *args, **options):
         """Execute the list command."""
         show_all = options['all']
+        self.now = timezone.now()
 
-        # Get blocked IPs
-        if show_all:
-            blocked_ips = BlockedIP.objects.all()
-            title = 'All Blocked IPs (Active and Inactive)'
+        if options['networks']:
+            model, key = BlockedNetwork, 'network'
+            fields = ['id', 'network', 'is_active', 'blocked_at',
+                      'blocked_by', 'reason']
+            noun = 'Networks'
         else:
-            blocked_ips = BlockedIP.objects.filter(is_active=True)
-            title = 'Currently Blocked IPs'
-
-        # Display results
-        self.stdout.write(self.style.SUCCESS(f'\n{title}'))
-        self.stdout.write('=' * 70)
-
-        if not blocked_ips.exists():
-            self.stdout.write(self.style.WARNING('No blocked IPs found.'))
-            return
-
-        for blocked_ip in blocked_ips:
-            status = '🔴 Active' if blocked_ip.is_active else '⚪ Inactive'
-
-            self.stdout.write(f'\n{status} - {blocked_ip.ip_address}')
-            self.stdout.write(f'  Blocked at: {blocked_ip.blocked_at}')
-
-            if blocked_ip.blocked_by:
-                self.stdout.write(f'  Blocked by: {blocked_ip.blocked_by}')
+            model, key = BlockedIP, 'ip_address'
+            fields = ['id', 'ip_address', 'is_active', 'expires_at',
+                      'blocked_at', 'blocked_by', 'reason']
+            noun = 'IPs'
 
-            if blocked_ip.reason:
-                self.stdout.write(f'  Reason: {blocked_ip.reason}')
+        blocks = model.objects.all()
+        if show_all:
+            title = f'All Blocked {noun} (Active and Inactive)'
+        else:
+            blocks = blocks.filter(is_active=True)
+            title = f'Currently Blocked {noun}'
+
+        rows = self.iter_rows(blocks, fields, options['after'],
+                              options['limit'])
+        output_format = options['format']
+        if output_format == 'json':
+            last_id = self.write_json(rows)
+        elif output_format == 'csv':
+            last_id = self.write_csv(rows, fields)
+        else:
+            self.stdout.write(self.style.SUCCESS(f'\n{title}'))
+            self.stdout.write('=' * 70)
+            last_id = self.write_table(rows, key, noun)
+
+        # Summary from one aggregate query; machine-readable formats
+        # keep stdout clean and report on stderr
+        summary = self.summary(model)
+        if output_format == 'table':
+            self.stdout.write(self.style.SUCCESS(f'\n{summary}'))
+            out = self.stdout
+        else:
+            out = self.stderr
+            out.write(summary)
+
+        if options['limit'] is not None and last_id is not None:
+            out.write(f'Next page: --after {last_id}')
+
+    def iter_rows(self, blocks, fields, after, limit):
+        """
+        Yield row dicts in id order, one keyset page at a time.
+
+        Args:
+            blocks (QuerySet): Blocks to list
+            fields (list): Columns to read
+            after (int): Start after this id
+            limit (int): Max rows to yield (None = all)
+        """
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = PAGE_SIZE if remaining is None else min(PAGE_SIZE,
+                                                           remaining)
+            page = list(
+                blocks.filter(id__gt=after)
+                .order_by('id')
+                .values(*fields)[:size]
+            )
+            yield from page
+            if len(page) < size:
+                return
+            after = page[-1]['id']
+            if remaining is not None:
+                remaining -= len(page)
+
+    def status(self, row):
+        """Return Active, Expired or Inactive for a row."""
+        if not row['is_active']:
+            return 'Inactive'
+        expires_at = row.get('expires_at')
+        if expires_at is not None and expires_at <= self.now:
+            return 'Expired'
+        return 'Active'
+
+    def write_table(self, rows, key, noun):
+        """Write human-readable output; return the last id written."""
+        last_id = None
+        for row in rows:
+            last_id = row['id']
+            status = self.status(row)
+            icon = '🔴' if status == 'Active' else '⚪'
+
+            self.stdout.write(f'\n{icon} {status} - {row[key]}')
+            self.stdout.write(f"  Blocked at: {row['blocked_at']}")
+
+            if row.get('expires_at'):
+                self.stdout.write(f"  Expires at: {row['expires_at']}")
+
+            if row['blocked_by']:
+                self.stdout.write(f"  Blocked by: {row['blocked_by']}")
+
+            if row['reason']:
+                self.stdout.write(f"  Reason: {row['reason']}")
 
             self.stdout.write('-' * 70)
 
-        # Summary
-        total = blocked_ips.count()
-        active = blocked_ips.filter(is_active=True).count()
-
-        self.stdout.write(
-            self.style.SUCCESS(f'\nTotal: {total} | Active: {active}')
-        )
\ No newline at end of file
+        if last_id is None:
+            self.stdout.write(self.style.WARNING(f'No blocked {noun} found.'))
+        return last_id
+
+    def write_json(self, rows):
+        """Stream a JSON array; return the last id written."""
+        last_id = None
+        out = self.stdout
+        out.write('[', ending='')
+        for row in rows:
+            if last_id is not None:
+                out.write(',', ending='')
+            last_id = row['id']
+            row['status'] = self.status(row)
+            out.write(json.dumps(row, default=str), ending='\n')
+        out.write(']')
+        return last_id
+
+    def write_csv(self, rows, fields):
+        """Stream CSV with a header row; return the last id written."""
+        last_id = None
+        writer = csv.writer(self.stdout, lineterminator='\n')
+        writer.writerow(fields + ['status'])
+        for row in rows:
+            last_id = row['id']
+            writer.writerow(
+                [row[field] for field in fields] + [self.status(row)]
+            )
+        return last_id
+
+    def summary(self, model):
+        """Count total/active/temporary blocks in a single query."""
+        aggregates = {
+            'total': Count('id'),
+            'active': Count('id', filter=Q(is_active=True)),
+        }
+        if model is BlockedIP:
+            aggregates['temporary'] = Count('id', filter=Q(
+                is_active=True, expires_at__isnull=False
+            ))
+        counts = model.objects.aggregate(**aggregates)
+        summary = f"Total: {counts['total']} | Active: {counts['active']}"
+        if 'temporary' in counts:
+            summary += f" | Temporary: {counts['temporary']}"
+        return summary
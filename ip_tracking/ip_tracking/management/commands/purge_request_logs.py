@@ -0,0 +1,105 @@
+"""
+Management command to purge request logs past their retention window.
+
+Usage:
+    python manage.py purge_request_logs
+    python manage.py purge_request_logs --days 30
+    python manage.py purge_request_logs --table RequestLog --chunk-size 2000 --sleep 0.5
+    python manage.py purge_request_logs --dry-run
+
+Retention windows per table come from IP_TRACKING_RETENTION_DAYS.
+Interrupted runs resume from their last completed chunk.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from ip_tracking.retention import (
+    DEFAULT_CHUNK_SIZE, PURGEABLE_TABLES, purge_all, purge_table
+)
+
+
+class Command(BaseCommand):
+    """
+    Django management command to delete old rows in bounded chunks.
+    """
+
+    help = 'Delete request logs (and rollups) older than their retention'
+
+    def add_arguments(self, parser):
+        """Define command-line arguments."""
+        parser.add_argument(
+            '--table',
+            action='append',
+            choices=sorted(PURGEABLE_TABLES),
+            help='Only purge this table (repeatable)'
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help='Override the retention window (requires one --table)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help=f'Rows per DELETE (default: {DEFAULT_CHUNK_SIZE})'
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0.1,
+            help='Seconds to pause between chunks (default: 0.1)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the rows that would be deleted'
+        )
+        parser.add_argument(
+            '--vacuum',
+            action='store_true',
+            help='Run VACUUM afterwards to shrink a SQLite database file'
+        )
+
+    def handle(self, *args, **options):
+        """Execute the purge command."""
+        tables = options['table']
+        kwargs = {
+            'chunk_size': options['chunk_size'],
+            'sleep': options['sleep'],
+            'dry_run': options['dry_run'],
+            'progress': self.show_progress,
+        }
+
+        if options['days'] is not None:
+            if not tables or len(tables) != 1:
+                raise CommandError('❌ --days needs exactly one --table')
+            reports = [purge_table(tables[0], options['days'], **kwargs)]
+        else:
+            reports = purge_all(tables=tables, **kwargs)
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        for report in reports:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"✅ {report['table']}: {verb} {report['deleted']} rows "
+                    f"in {report['seconds']}s "
+                    f"({report['rows_per_second']} rows/s, "
+                    f"{report['chunks']} chunks)"
+                )
+            )
+
+        if options['vacuum'] and not options['dry_run']:
+            if connection.vendor != 'sqlite':
+                self.stdout.write(
+                    self.style.WARNING('⚠️  --vacuum only applies to SQLite')
+                )
+            else:
+                with connection.cursor() as cursor:
+                    cursor.execute('VACUUM')
+                self.stdout.write('   Database file compacted')
+
+    def show_progress(self, table, deleted):
+        """Print a running total after each chunk."""
+        self.stdout.write(f'   {table}: {deleted} rows deleted so far...')
@@ -0,0 +1,92 @@
+"""
+Management command to report request volume from the hourly rollups.
+
+Usage:
+    python manage.py request_report
+    python manage.py request_report --hours 24 --by country
+    python manage.py request_report --by path --limit 20
+    python manage.py request_report --network 203.0.113.0/24 --by path
+"""
+
+import ipaddress
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+from django.utils import timezone
+from ip_tracking.models import RequestLogHourly
+from ip_tracking.rollups import rollup_request_logs
+
+
+class Command(BaseCommand):
+    """
+    Django management command to show top IPs, paths, methods or
+    countries. Reads RequestLogHourly, never the raw RequestLog table.
+    """
+
+    help = 'Show request counts from the hourly rollups'
+
+    def add_arguments(self, parser):
+        """Define command-line arguments."""
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=24,
+            help='How many hours back to report on (default: 24)'
+        )
+        parser.add_argument(
+            '--by',
+            choices=['ip_address', 'path', 'method', 'country'],
+            default='ip_address',
+            help='Dimension to group by (default: ip_address)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=10,
+            help='Number of rows to show (default: 10)'
+        )
+        parser.add_argument(
+            '--network',
+            type=str,
+            default=None,
+            help='Only count requests from this CIDR range'
+        )
+        parser.add_argument(
+            '--no-refresh',
+            action='store_true',
+            help='Skip bringing the rollups up to date first'
+        )
+
+    def handle(self, *args, **options):
+        """Execute the report command."""
+        if not options['no_refresh']:
+            rollup_request_logs()
+
+        field = options['by']
+        since = timezone.now() - timedelta(hours=options['hours'])
+        since = since.replace(minute=0, second=0, microsecond=0)
+
+        rollups = RequestLogHourly.objects.filter(hour__gte=since)
+        if options['network']:
+            try:
+                ipaddress.ip_network(options['network'], strict=False)
+            except ValueError as e:
+                raise CommandError(f'❌ {e}')
+            # Index range scan over the packed addresses
+            rollups = rollups.filter(ip_address__in_network=options['network'])
+
+        rows = (
+            rollups
+            .values(field)
+            .annotate(total=Sum('request_count'))
+            .order_by('-total')[:options['limit']]
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\nTop {field} since {since:%Y-%m-%d %H:00} UTC'
+        ))
+        self.stdout.write('=' * 70)
+        for row in rows:
+            label = row[field] or '(unknown)'
+            self.stdout.write(f'{row["total"]:>12}  {label}')
@@ -3,10 +3,18 @@ Management command to unblock IP addresses.
 
 Usage:
     python manage.py unblock_ip 192.168.1.100
+    python manage.py unblock_ip 203.0.113.0/24
+    python manage.py unblock_ip --file allow_list.txt
+    cat allow_list.txt | python manage.py unblock_ip -
 """
 
+import sys
+
 from django.core.management.base import BaseCommand, CommandError
-from ip_tracking.ip_tracking.models import BlockedIP
+from ip_tracking.blocklist import get_refresh_interval, parse_block_target
+from ip_tracking.bulk import DEFAULT_BATCH_SIZE, bulk_unblock, read_targets
+
+from .block_ip import show_invalid
 
 
 class Command(BaseCommand):
@@ -14,25 +22,49 @@ class Command(BaseCommand):
     Django management command to remove IP addresses from the blacklist.
     """
 
-    help = 'Unblock an IP address to allow it to access the site'
+    help = 'Unblock an IP address or CIDR range to allow it to access the site'
 
     def add_arguments(self, parser):
         """Define command-line arguments."""
         parser.add_argument(
             'ip_address',
             type=str,
-            help='IP address to unblock'
+            nargs='?',
+            help='IP address or CIDR range to unblock, '
+                 'or - to read a list from stdin'
+        )
+        parser.add_argument(
+            '--file',
+            type=str,
+            help='File with one IP address or CIDR range per line'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help=f'Entries written per batch in list mode '
+                 f'(default: {DEFAULT_BATCH_SIZE})'
         )
 
     def handle(self, *args, **options):
         """Execute the unblock command."""
-        ip_address = options['ip_address']
+        if options['file'] or options['ip_address'] == '-':
+            return self.handle_list(options)
+        if not options['ip_address']:
+            raise CommandError('❌ Give an IP address, --file or -')
+
+        try:
+            model, lookup, ip_address = parse_block_target(
+                options['ip_address']
+            )
+        except ValueError as e:
+            raise CommandError(f'❌ {e}')
 
         try:
             # Find the blocked IP
-            blocked_ip = BlockedIP.objects.filter(
-                ip_address=ip_address,
-                is_active=True
+            blocked_ip = model.objects.filter(
+                is_active=True,
+                **lookup
             ).first()
 
             if not blocked_ip:
@@ -51,6 +83,49 @@ class Command(BaseCommand):
                     f'✅ IP {ip_address} has been unblocked successfully!'
                 )
             )
+            self.stdout.write(
+                f'   Lifted on all workers within '
+                f'{get_refresh_interval()}s'
+            )
 
         except Exception as e:
-            raise CommandError(f'❌ Error unblocking IP: {str(e)}')
\ No newline at end of file
+            raise CommandError(f'❌ Error unblocking IP: {str(e)}')
+
+    def handle_list(self, options):
+        """Unblock every IP/range from --file or stdin in batches."""
+        try:
+            source = (
+                open(options['file']) if options['file'] else sys.stdin
+            )
+        except OSError as e:
+            raise CommandError(f'❌ {e}')
+
+        with source:
+            try:
+                report = bulk_unblock(
+                    read_targets(source),
+                    batch_size=options['batch_size'],
+                    progress=self.show_progress,
+                )
+            except Exception as e:
+                raise CommandError(f'❌ Error unblocking IPs: {str(e)}')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✅ Processed {report['processed']} entries in "
+                f"{report['seconds']}s ({report['rows_per_second']}/s)"
+            )
+        )
+        self.stdout.write(f"   Unblocked: {report['unblocked']}")
+        self.stdout.write(f"   Not blocked: {report['not_blocked']}")
+        show_invalid(self, report['invalid'])
+        self.stdout.write(
+            f'   Lifted on all workers within {get_refresh_interval()}s'
+        )
+
+    def show_progress(self, report):
+        """Print the running total after each batch."""
+        self.stdout.write(
+            f"   {report['processed']} processed "
+            f"({report['rows_per_second']}/s)..."
+        )
@@ -0,0 +1,314 @@
+"""
+In-process metrics for the request tracking stack.
+
+Counters and histograms are plain dicts behind one lock, so recording is
+a dict update and, for histograms, a bisect over fixed buckets. No
+client library and no I/O on the request path.
+
+Each worker process has its own ``registry``. For a view across
+workers, every worker publishes a snapshot to the shared Django cache
+once per ``IP_TRACKING_METRICS_PUBLISH_SECONDS``, from a daemon thread
+the registry starts on its first recorded metric, so no cache write
+lands on the request path and nothing depends on which stages or log
+sink the process uses. A forked child starts with an empty registry
+and its own thread. The metrics view exports every live snapshot with a
+``worker`` label rather than summing them: a sum would go down whenever
+a worker exits or restarts, which Prometheus reads as a counter reset.
+Per-worker series let ``rate()`` handle each restart on its own; sum
+them in the query. A snapshot that is not refreshed within ten publish
+intervals expires, so dead workers drop out.
+
+Metrics are rendered in the Prometheus text exposition format.
+"""
+
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+DEFAULT_PUBLISH_SECONDS = 15
+
+WORKERS_KEY = 'ip_tracking:metrics:workers'
+SNAPSHOT_KEY_PREFIX = 'ip_tracking:metrics:worker:'
+
+# Histogram upper bounds in seconds (5µs to 1s), plus +Inf
+BUCKETS = (
+    0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0,
+)
+
+# name: (type, help)
+METRICS = {
+    'ip_tracking_requests_total': (
+        'counter', 'Requests seen by the tracking pipeline'),
+    'ip_tracking_stage_duration_seconds': (
+        'histogram', 'Time spent in each pipeline stage'),
+    'ip_tracking_stage_errors_total': (
+        'counter', 'Exceptions raised by pipeline stages (request continued)'),
+    'ip_tracking_blocked_requests_total': (
+        'counter', 'Requests answered with 403 by the blocklist or threat feed'),
+    'ip_tracking_blocklist_reloads_total': (
+        'counter', 'Blocklist snapshot reloads'),
+    'ip_tracking_threat_feed_checks_total': (
+        'counter', 'Threat feed Bloom hits, confirmed or false positive'),
+    'ip_tracking_threat_feed_reloads_total': (
+        'counter', 'Threat feed file (re)mappings'),
+    'ip_tracking_geo_lookups_total': (
+        'counter', 'Geolocation lookups by where they were answered '
+                   '(local, process, cache, http, negative, breaker_open...)'),
+    'ip_tracking_rate_counter_fallbacks_total': (
+        'counter', 'Rate counts kept in process because the cache failed'),
+    'ip_tracking_rate_actions_total': (
+        'counter', 'IPs flagged or blocked by the real-time rate check'),
+    'ip_tracking_intern_lookups_total': (
+        'counter', 'Path/user agent id lookups by LRU hit or miss'),
+    'ip_tracking_ratelimited_requests_total': (
+        'counter', 'View requests over a @ratelimit limit, by group'),
+    'ip_tracking_ratelimit_fallbacks_total': (
+        'counter', 'View rate limit checks counted in process (Redis failed)'),
+    'ip_tracking_log_records_written_total': (
+        'counter', 'RequestLog rows written by the log buffer'),
+    'ip_tracking_log_records_sampled_out_total': (
+        'counter', 'Requests not logged because of a sampling rule'),
+    'ip_tracking_log_records_dropped_total': (
+        'counter', 'RequestLog rows dropped because the buffer was full'),
+    'ip_tracking_log_records_rejected_total': (
+        'counter', 'RequestLog rows dropped because the database rejected '
+                   'them'),
+    'ip_tracking_log_flush_errors_total': (
+        'counter', 'Failed log buffer flushes (batch requeued or split)'),
+    'ip_tracking_log_flush_duration_seconds': (
+        'histogram', 'Time spent writing one log batch'),
+    'ip_tracking_log_spool_overflow_total': (
+        'counter', 'Records dropped because the shared log spool was full'),
+    'ip_tracking_log_spool_drained_total': (
+        'counter', 'RequestLog rows inserted from the log spool'),
+}
+
+
+def get_publish_interval():
+    """Return the seconds between snapshot publications."""
+    return getattr(
+        settings, 'IP_TRACKING_METRICS_PUBLISH_SECONDS', DEFAULT_PUBLISH_SECONDS
+    )
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters and histograms for one process.
+
+    Series are keyed by (name, sorted label pairs).
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}  # key -> [bucket counts, sum]
+        self._next_publish = 0.0
+        self._publisher = None
+
+    def inc(self, name, amount=1, **labels):
+        """Add ``amount`` to a counter."""
+        if self._publisher is None:
+            self._start_publisher()
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        """Record one duration in a histogram."""
+        if self._publisher is None:
+            self._start_publisher()
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [
+                    [0] * (len(BUCKETS) + 1), 0.0
+                ]
+            histogram[0][index] += 1
+            histogram[1] += seconds
+
+    def snapshot(self):
+        """
+        Return a JSON-serialisable copy of every series.
+
+        Returns:
+            dict: {'counters': [[name, labels, value]],
+                'histograms': [[name, labels, bucket counts, sum]]}
+        """
+        with self._lock:
+            return {
+                'counters': [
+                    [name, list(labels), value]
+                    for (name, labels), value in self._counters.items()
+                ],
+                'histograms': [
+                    [name, list(labels), list(counts), total]
+                    for (name, labels), (counts, total)
+                    in self._histograms.items()
+                ],
+            }
+
+    def _start_publisher(self):
+        """Start the background thread that publishes snapshots."""
+        with self._lock:
+            if self._publisher is not None:
+                return
+            self._publisher = threading.Thread(
+                target=self._run_publisher,
+                name='ip-tracking-metrics-publish',
+                daemon=True
+            )
+        self._publisher.start()
+
+    def _run_publisher(self):
+        while True:
+            wait = self._next_publish - time.monotonic()
+            if wait > 0:
+                # collect() publishes too and pushes the next run back
+                time.sleep(wait)
+                continue
+            self.publish()
+
+    def publish(self):
+        """Store this worker's snapshot in the shared cache."""
+        interval = get_publish_interval()
+        self._next_publish = time.monotonic() + interval
+        ttl = interval * 10
+        try:
+            cache.set(SNAPSHOT_KEY_PREFIX + self.worker_id, self.snapshot(),
+                      timeout=ttl)
+            # The worker index is read-modify-write; a worker lost to a
+            # race re-adds itself on its next publish
+            workers = cache.get(WORKERS_KEY) or {}
+            now = time.time()
+            workers = {
+                worker: seen for worker, seen in workers.items()
+                if now - seen < ttl
+            }
+            workers[self.worker_id] = now
+            cache.set(WORKERS_KEY, workers, timeout=None)
+        except Exception:
+            # Metrics must never break a request
+            pass
+
+
+def collect(scope='all'):
+    """
+    Gather metrics for rendering.
+
+    Args:
+        scope (str): 'local' for this process only, 'all' for every
+            worker's published snapshot
+
+    Returns:
+        dict: Snapshot (per-worker series for 'all')
+    """
+    if scope == 'local':
+        return registry.snapshot()
+
+    registry.publish()
+    try:
+        workers = cache.get(WORKERS_KEY) or {}
+        keys = {SNAPSHOT_KEY_PREFIX + worker: worker for worker in workers}
+        snapshots = {
+            keys[key]: snapshot
+            for key, snapshot in cache.get_many(list(keys)).items()
+        }
+    except Exception:
+        snapshots = {registry.worker_id: registry.snapshot()}
+    return merge(snapshots)
+
+
+def merge(snapshots):
+    """
+    Combine per-worker snapshots, labelling each series with its worker.
+
+    Args:
+        snapshots (dict): {worker id: snapshot}
+
+    Returns:
+        dict: One snapshot holding every worker's series
+    """
+    merged = {'counters': [], 'histograms': []}
+    for worker, snapshot in sorted(snapshots.items()):
+        for name, labels, value in snapshot['counters']:
+            merged['counters'].append(
+                [name, list(labels) + [['worker', worker]], value]
+            )
+        for name, labels, counts, total in snapshot['histograms']:
+            merged['histograms'].append(
+                [name, list(labels) + [['worker', worker]], counts, total]
+            )
+    return merged
+
+
+def render(snapshot):
+    """
+    Format a snapshot in the Prometheus text exposition format.
+
+    Returns:
+        str: Exposition text
+    """
+    series = {}
+    for name, labels, value in sorted(snapshot['counters']):
+        series.setdefault(name, []).append(
+            f'{name}{_labels(labels)} {_number(value)}'
+        )
+    for name, labels, counts, total in sorted(snapshot['histograms']):
+        lines = series.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), counts):
+            cumulative += count
+            le = bound if bound == '+Inf' else repr(bound)
+            lines.append(
+                f'{name}_bucket{_labels(labels, le=le)} {cumulative}'
+            )
+        lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+        lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+
+    output = []
+    for name in sorted(series):
+        metric_type, help_text = METRICS.get(name, ('untyped', ''))
+        output.append(f'# HELP {name} {help_text}')
+        output.append(f'# TYPE {name} {metric_type}')
+        output.extend(series[name])
+    return '\n'.join(output) + '\n'
+
+
+def _labels(labels, **extra):
+    pairs = [tuple(pair) for pair in labels] + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        f'{key}="{_escape(value)}"' for key, value in pairs
+    ) + '}'
+
+
+def _escape(value):
+    return (
+        str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Shared per-process registry
+registry = MetricsRegistry()
+
+# A forked worker must not republish its parent's counters under its own
+# id, and the parent's publisher thread does not survive the fork
+os.register_at_fork(after_in_child=registry._reset)
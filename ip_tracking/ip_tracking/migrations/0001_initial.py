@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:50
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SuspiciousIP',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.GenericIPAddressField(unique=True)),
+                ('reason', models.TextField()),
+                ('flagged_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BlockedIP',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.GenericIPAddressField(help_text='IP address to block from accessing the site', unique=True)),
+                ('reason', models.TextField(blank=True, help_text='Reason why this IP was blocked', null=True)),
+                ('blocked_at', models.DateTimeField(auto_now_add=True, help_text='When this IP was added to the blacklist')),
+                ('blocked_by', models.CharField(blank=True, help_text='Who blocked this IP (admin username or system)', max_length=100, null=True)),
+                ('is_active', models.BooleanField(default=True, help_text='Whether this block is currently active')),
+            ],
+            options={
+                'verbose_name': 'Blocked IP',
+                'verbose_name_plural': 'Blocked IPs',
+                'ordering': ['-blocked_at'],
+                'indexes': [models.Index(fields=['ip_address', 'is_active'], name='ip_tracking_ip_addr_baa190_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BlockedNetwork',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('network', models.CharField(help_text='Network in CIDR notation (e.g., 203.0.113.0/24)', max_length=49, unique=True)),
+                ('reason', models.TextField(blank=True, help_text='Reason why this range was blocked', null=True)),
+                ('blocked_at', models.DateTimeField(auto_now_add=True, help_text='When this range was added to the blacklist')),
+                ('blocked_by', models.CharField(blank=True, help_text='Who blocked this range (admin username or system)', max_length=100, null=True)),
+                ('is_active', models.BooleanField(default=True, help_text='Whether this block is currently active')),
+            ],
+            options={
+                'verbose_name': 'Blocked Network',
+                'verbose_name_plural': 'Blocked Networks',
+                'ordering': ['-blocked_at'],
+                'indexes': [models.Index(fields=['network', 'is_active'], name='ip_tracking_network_3eb966_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RequestLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.GenericIPAddressField(help_text='IP address of the client making the request')),
+                ('timestamp', models.DateTimeField(db_index=True, default=django.utils.timezone.now, help_text='When the request was made')),
+                ('path', models.CharField(help_text='URL path that was requested', max_length=500)),
+                ('method', models.CharField(default='GET', help_text='HTTP method used (GET, POST, etc.)', max_length=10)),
+                ('user_agent', models.TextField(blank=True, help_text='User agent string from the request', null=True)),
+                ('country', models.CharField(blank=True, max_length=100, null=True)),
+                ('city', models.CharField(blank=True, max_length=100, null=True)),
+            ],
+            options={
+                'verbose_name': 'Request Log',
+                'verbose_name_plural': 'Request Logs',
+                'ordering': ['-timestamp'],
+                'indexes': [models.Index(fields=['ip_address', '-timestamp'], name='ip_tracking_ip_addr_f0dbdd_idx'), models.Index(fields=['path', '-timestamp'], name='ip_tracking_path_febde3_idx')],
+            },
+        ),
+    ]
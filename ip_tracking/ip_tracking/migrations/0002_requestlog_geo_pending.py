@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestlog',
+            name='geo_pending',
+            field=models.BooleanField(default=False, help_text='Country/city not resolved yet, queued for enrichment'),
+        ),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(condition=models.Q(('geo_pending', True)), fields=['ip_address', 'timestamp'], name='requestlog_geo_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0002_requestlog_geo_pending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessingWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Name of the job that owns this watermark', max_length=100, unique=True)),
+                ('last_id', models.BigIntegerField(default=0, help_text='Last RequestLog id processed')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='IPRequestBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.GenericIPAddressField(help_text='IP address the requests came from')),
+                ('bucket_start', models.DateTimeField(help_text='Start of the time bucket')),
+                ('request_count', models.PositiveIntegerField(default=0, help_text='Requests from this IP within the bucket')),
+            ],
+            options={
+                'verbose_name': 'IP Request Bucket',
+                'verbose_name_plural': 'IP Request Buckets',
+                'indexes': [models.Index(fields=['bucket_start'], name='ip_tracking_bucket__0669b5_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ip_address', 'bucket_start'), name='unique_ip_request_bucket')],
+            },
+        ),
+    ]
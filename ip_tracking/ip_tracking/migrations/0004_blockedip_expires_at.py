@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0003_anomaly_buckets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blockedip',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, help_text='When a temporary block lapses (empty = permanent)', null=True),
+        ),
+    ]
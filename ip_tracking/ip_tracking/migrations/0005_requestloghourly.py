@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0004_blockedip_expires_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestLogHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(help_text='Start of the hour (UTC)')),
+                ('ip_address', models.GenericIPAddressField(help_text='IP address of the client')),
+                ('path', models.CharField(help_text='URL path that was requested', max_length=500)),
+                ('method', models.CharField(help_text='HTTP method used', max_length=10)),
+                ('country', models.CharField(blank=True, default='', help_text="Client country ('' if unknown)", max_length=100)),
+                ('request_count', models.PositiveIntegerField(default=0, help_text='Requests in this hour for this combination')),
+            ],
+            options={
+                'verbose_name': 'Hourly Request Rollup',
+                'verbose_name_plural': 'Hourly Request Rollups',
+                'ordering': ['-hour'],
+                'indexes': [models.Index(fields=['path', 'hour'], name='ip_tracking_path_c1d840_idx'), models.Index(fields=['ip_address', 'hour'], name='ip_tracking_ip_addr_7e8880_idx')],
+                'constraints': [models.UniqueConstraint(fields=('hour', 'ip_address', 'path', 'method', 'country'), name='unique_request_log_hourly')],
+            },
+        ),
+    ]
@@ -0,0 +1,266 @@
+"""
+Store IP addresses as 16 packed bytes (PackedIPAddressField).
+
+For each table the string column is copied into a new packed column in
+primary-key batches, then dropped, and the new column takes its name.
+Indexes and unique constraints on ip_address are rebuilt on the packed
+column.
+
+Rows whose address is stored in a non-canonical form (e.g.
+"::ffff:1.2.3.4" next to "1.2.3.4") would collide on the unique keys
+once packed. They are merged into the canonical row: request counts
+are added together and the duplicate is deleted. Values that are not IP
+addresses at all are stored as "::".
+
+Reversible: going back copies the packed values into a string column.
+"""
+
+from django.db import migrations, models
+
+import ip_tracking.fields
+from ip_tracking.fields import canonical_ip
+
+BATCH_SIZE = 5000
+
+# model name: other fields of its unique key on ip_address (None = none)
+UNIQUE_KEYS = {
+    'requestlog': None,
+    'requestloghourly': ('hour', 'path', 'method', 'country'),
+    'iprequestbucket': ('bucket_start',),
+    'suspiciousip': (),
+    'blockedip': (),
+}
+
+
+def _canonical(value):
+    try:
+        return canonical_ip(value)
+    except (ValueError, TypeError):
+        return '::'
+
+
+def pack_addresses(apps, schema_editor):
+    for model_name, key_fields in UNIQUE_KEYS.items():
+        model = apps.get_model('ip_tracking', model_name)
+        last_pk = 0
+        while True:
+            rows = list(
+                model.objects.filter(pk__gt=last_pk).order_by('pk')[:BATCH_SIZE]
+            )
+            if not rows:
+                break
+            last_pk = rows[-1].pk
+
+            to_update = []
+            for row in rows:
+                packed = _canonical(row.ip_address)
+                row.ip_packed = packed
+                if key_fields is not None and packed != row.ip_address:
+                    # Rare: resolve collisions one row at a time
+                    if not _merge_duplicate(model, row, packed, key_fields):
+                        row.save(update_fields=['ip_packed'])
+                    continue
+                to_update.append(row)
+            model.objects.bulk_update(to_update, ['ip_packed'])
+
+
+def _merge_duplicate(model, row, packed, key_fields):
+    """Fold ``row`` into the row already holding ``packed``, if any."""
+    canonical = model.objects.filter(
+        models.Q(ip_address=packed) | models.Q(ip_packed=packed),
+        **{field: getattr(row, field) for field in key_fields}
+    ).exclude(pk=row.pk).first()
+    if canonical is None:
+        return False
+    if hasattr(canonical, 'request_count'):
+        canonical.request_count += row.request_count
+        canonical.save(update_fields=['request_count'])
+    row.delete()
+    return True
+
+
+def unpack_addresses(apps, schema_editor):
+    for model_name in UNIQUE_KEYS:
+        model = apps.get_model('ip_tracking', model_name)
+        last_pk = 0
+        while True:
+            rows = list(
+                model.objects.filter(pk__gt=last_pk).order_by('pk')[:BATCH_SIZE]
+            )
+            if not rows:
+                break
+            last_pk = rows[-1].pk
+            for row in rows:
+                row.ip_address = row.ip_packed
+            model.objects.bulk_update(rows, ['ip_address'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0005_requestloghourly'),
+    ]
+
+    operations = [
+        # 1. Drop indexes and unique keys on the string column
+        migrations.RemoveIndex(
+            model_name='requestlog',
+            name='ip_tracking_ip_addr_f0dbdd_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='requestlog',
+            name='requestlog_geo_pending_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='requestloghourly',
+            name='ip_tracking_ip_addr_7e8880_idx',
+        ),
+        migrations.RemoveConstraint(
+            model_name='requestloghourly',
+            name='unique_request_log_hourly',
+        ),
+        migrations.RemoveConstraint(
+            model_name='iprequestbucket',
+            name='unique_ip_request_bucket',
+        ),
+        migrations.RemoveIndex(
+            model_name='blockedip',
+            name='ip_tracking_ip_addr_baa190_idx',
+        ),
+        migrations.AlterField(
+            model_name='suspiciousip',
+            name='ip_address',
+            field=models.GenericIPAddressField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='blockedip',
+            name='ip_address',
+            field=models.GenericIPAddressField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='requestlog',
+            name='ip_address',
+            field=models.GenericIPAddressField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='requestloghourly',
+            name='ip_address',
+            field=models.GenericIPAddressField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='iprequestbucket',
+            name='ip_address',
+            field=models.GenericIPAddressField(null=True),
+        ),
+
+        # 2. Add the packed columns and fill them
+        migrations.AddField(
+            model_name='requestlog',
+            name='ip_packed',
+            field=ip_tracking.fields.PackedIPAddressField(null=True),
+        ),
+        migrations.AddField(
+            model_name='requestloghourly',
+            name='ip_packed',
+            field=ip_tracking.fields.PackedIPAddressField(null=True),
+        ),
+        migrations.AddField(
+            model_name='iprequestbucket',
+            name='ip_packed',
+            field=ip_tracking.fields.PackedIPAddressField(null=True),
+        ),
+        migrations.AddField(
+            model_name='suspiciousip',
+            name='ip_packed',
+            field=ip_tracking.fields.PackedIPAddressField(null=True),
+        ),
+        migrations.AddField(
+            model_name='blockedip',
+            name='ip_packed',
+            field=ip_tracking.fields.PackedIPAddressField(null=True),
+        ),
+        migrations.RunPython(pack_addresses, unpack_addresses),
+
+        # 3. Swap the packed columns in under the old name
+        migrations.RemoveField(model_name='requestlog', name='ip_address'),
+        migrations.RemoveField(model_name='requestloghourly', name='ip_address'),
+        migrations.RemoveField(model_name='iprequestbucket', name='ip_address'),
+        migrations.RemoveField(model_name='suspiciousip', name='ip_address'),
+        migrations.RemoveField(model_name='blockedip', name='ip_address'),
+        migrations.RenameField(
+            model_name='requestlog',
+            old_name='ip_packed',
+            new_name='ip_address',
+        ),
+        migrations.RenameField(
+            model_name='requestloghourly',
+            old_name='ip_packed',
+            new_name='ip_address',
+        ),
+        migrations.RenameField(
+            model_name='iprequestbucket',
+            old_name='ip_packed',
+            new_name='ip_address',
+        ),
+        migrations.RenameField(
+            model_name='suspiciousip',
+            old_name='ip_packed',
+            new_name='ip_address',
+        ),
+        migrations.RenameField(
+            model_name='blockedip',
+            old_name='ip_packed',
+            new_name='ip_address',
+        ),
+        migrations.AlterField(
+            model_name='requestlog',
+            name='ip_address',
+            field=ip_tracking.fields.PackedIPAddressField(help_text='IP address of the client making the request'),
+        ),
+        migrations.AlterField(
+            model_name='requestloghourly',
+            name='ip_address',
+            field=ip_tracking.fields.PackedIPAddressField(help_text='IP address of the client'),
+        ),
+        migrations.AlterField(
+            model_name='iprequestbucket',
+            name='ip_address',
+            field=ip_tracking.fields.PackedIPAddressField(help_text='IP address the requests came from'),
+        ),
+        migrations.AlterField(
+            model_name='suspiciousip',
+            name='ip_address',
+            field=ip_tracking.fields.PackedIPAddressField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name='blockedip',
+            name='ip_address',
+            field=ip_tracking.fields.PackedIPAddressField(help_text='IP address to block from accessing the site', unique=True),
+        ),
+
+        # 4. Rebuild the indexes and unique keys on the packed column
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(fields=['ip_address', '-timestamp'], name='ip_tracking_ip_addr_f0dbdd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(condition=models.Q(('geo_pending', True)), fields=['ip_address', 'timestamp'], name='requestlog_geo_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requestloghourly',
+            index=models.Index(fields=['ip_address', 'hour'], name='ip_tracking_ip_addr_7e8880_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='requestloghourly',
+            constraint=models.UniqueConstraint(fields=('hour', 'ip_address', 'path', 'method', 'country'), name='unique_request_log_hourly'),
+        ),
+        migrations.AddConstraint(
+            model_name='iprequestbucket',
+            constraint=models.UniqueConstraint(fields=('ip_address', 'bucket_start'), name='unique_ip_request_bucket'),
+        ),
+        migrations.AddIndex(
+            model_name='blockedip',
+            index=models.Index(fields=['ip_address', 'is_active'], name='ip_tracking_ip_addr_baa190_idx'),
+        ),
+    ]
@@ -0,0 +1,155 @@
+"""
+Dictionary-encode RequestLog.path and RequestLog.user_agent.
+
+Each distinct string moves into a lookup table (RequestPath, UserAgent)
+and RequestLog keeps a foreign key to it. Rows are converted in
+primary-key batches; every distinct string is inserted once, and the
+string -> id map is kept in memory for the rest of the migration.
+
+Reversible: going back copies the strings into the old columns.
+"""
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from ip_tracking.interning import digest
+
+BATCH_SIZE = 5000
+
+
+def _intern(model, values, known):
+    """Insert the values not in ``known`` and add their ids to it."""
+    new = {digest(value): value for value in values if value not in known}
+    if not new:
+        return
+    model.objects.bulk_create(
+        [model(value=value, digest=key) for key, value in new.items()],
+        ignore_conflicts=True,
+    )
+    for key, value_id in model.objects.filter(
+        digest__in=list(new)
+    ).values_list('digest', 'id'):
+        known[new[key]] = value_id
+
+
+def encode_strings(apps, schema_editor):
+    RequestLog = apps.get_model('ip_tracking', 'RequestLog')
+    RequestPath = apps.get_model('ip_tracking', 'RequestPath')
+    UserAgent = apps.get_model('ip_tracking', 'UserAgent')
+    path_ids, agent_ids = {}, {}
+
+    last_pk = 0
+    while True:
+        rows = list(
+            RequestLog.objects.filter(pk__gt=last_pk).order_by('pk')
+            .only('pk', 'path', 'user_agent')[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1].pk
+
+        _intern(RequestPath, {row.path for row in rows}, path_ids)
+        _intern(UserAgent, {row.user_agent for row in rows
+                            if row.user_agent is not None}, agent_ids)
+        for row in rows:
+            row.path_ref_id = path_ids[row.path]
+            row.user_agent_ref_id = agent_ids.get(row.user_agent)
+        RequestLog.objects.bulk_update(rows, ['path_ref', 'user_agent_ref'])
+
+
+def decode_strings(apps, schema_editor):
+    RequestLog = apps.get_model('ip_tracking', 'RequestLog')
+    RequestPath = apps.get_model('ip_tracking', 'RequestPath')
+    UserAgent = apps.get_model('ip_tracking', 'UserAgent')
+    paths = dict(RequestPath.objects.values_list('id', 'value'))
+    agents = dict(UserAgent.objects.values_list('id', 'value'))
+
+    last_pk = 0
+    while True:
+        rows = list(
+            RequestLog.objects.filter(pk__gt=last_pk).order_by('pk')
+            .only('pk', 'path_ref', 'user_agent_ref')[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1].pk
+        for row in rows:
+            row.path = paths.get(row.path_ref_id, '')
+            row.user_agent = agents.get(row.user_agent_ref_id)
+        RequestLog.objects.bulk_update(rows, ['path', 'user_agent'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0006_packed_ip_addresses'),
+    ]
+
+    operations = [
+        # 1. Lookup tables and nullable references
+        migrations.CreateModel(
+            name='RequestPath',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.TextField()),
+                ('digest', models.CharField(help_text='SHA-1 hex digest of the value', max_length=40, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Request Path',
+                'verbose_name_plural': 'Request Paths',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.TextField()),
+                ('digest', models.CharField(help_text='SHA-1 hex digest of the value', max_length=40, unique=True)),
+            ],
+            options={
+                'verbose_name': 'User Agent',
+                'verbose_name_plural': 'User Agents',
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='requestlog',
+            name='ip_tracking_path_febde3_idx',
+        ),
+        migrations.AlterField(
+            model_name='requestlog',
+            name='path',
+            field=models.CharField(max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='path_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='ip_tracking.requestpath'),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='user_agent_ref',
+            field=models.ForeignKey(blank=True, help_text='User agent string from the request', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='ip_tracking.useragent'),
+        ),
+
+        # 2. Fill the references
+        migrations.RunPython(encode_strings, decode_strings),
+
+        # 3. Drop the string columns
+        migrations.RemoveField(
+            model_name='requestlog',
+            name='path',
+        ),
+        migrations.RemoveField(
+            model_name='requestlog',
+            name='user_agent',
+        ),
+        migrations.AlterField(
+            model_name='requestlog',
+            name='path_ref',
+            field=models.ForeignKey(help_text='URL path that was requested', on_delete=django.db.models.deletion.PROTECT, related_name='+', to='ip_tracking.requestpath'),
+        ),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(fields=['path_ref', '-timestamp'], name='ip_tracking_path_re_f4974e_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0007_interned_strings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestlog',
+            name='sample_weight',
+            field=models.PositiveIntegerField(default=1, help_text='Requests this row stands for (>1 when the path is sampled)'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+"""
+Add IP-hash shard keys to RequestLog and IPRequestBucket.
+
+New rows get their key on save. Existing buckets, and RequestLog rows
+recent enough for the detection window to still read them, are filled
+in primary-key batches. Older RequestLog rows keep 0: detection never
+reads them again, and rollups do not use the key.
+
+Reversible: going back drops the columns.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+import ip_tracking.fields
+from ip_tracking.fields import ip_shard_key
+
+BATCH_SIZE = 5000
+
+
+def _fill(queryset):
+    last_pk = 0
+    while True:
+        rows = list(
+            queryset.filter(pk__gt=last_pk).order_by('pk')
+            .only('pk', 'ip_address')[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1].pk
+        for row in rows:
+            row.shard_key = ip_shard_key(row.ip_address)
+        queryset.model.objects.bulk_update(rows, ['shard_key'])
+
+
+def fill_shard_keys(apps, schema_editor):
+    RequestLog = apps.get_model('ip_tracking', 'RequestLog')
+    IPRequestBucket = apps.get_model('ip_tracking', 'IPRequestBucket')
+    window = getattr(settings, 'IP_TRACKING_ANOMALY_WINDOW_SECONDS', 60 * 60)
+    # One extra bucket, as runs recount whole minutes
+    cutoff = timezone.now() - timedelta(seconds=window + 60)
+
+    _fill(IPRequestBucket.objects.all())
+    _fill(RequestLog.objects.filter(timestamp__gte=cutoff))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0008_requestlog_sample_weight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='iprequestbucket',
+            name='shard_key',
+            field=ip_tracking.fields.IPShardKeyField(help_text='Hash bucket of ip_address, for sharded detection'),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='shard_key',
+            field=ip_tracking.fields.IPShardKeyField(help_text='Hash bucket of ip_address, for sharded detection'),
+        ),
+        migrations.RunPython(fill_shard_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+"""
+Add DetectionRule and seed it from the old hard-coded sensitive paths.
+
+Each path in IP_TRACKING_SENSITIVE_PATHS (default /admin and /login)
+becomes a prefix rule that flags an IP on its first matching request in
+the detection window, so /admin/login/ and everything under /admin/ now
+count too.
+
+Reversible: going back drops the table.
+"""
+
+from django.conf import settings
+from django.db import migrations, models
+
+DEFAULT_SENSITIVE_PATHS = ['/admin', '/login']
+
+
+def seed_rules(apps, schema_editor):
+    DetectionRule = apps.get_model('ip_tracking', 'DetectionRule')
+    window = getattr(settings, 'IP_TRACKING_ANOMALY_WINDOW_SECONDS', 60 * 60)
+    paths = getattr(settings, 'IP_TRACKING_SENSITIVE_PATHS',
+                    DEFAULT_SENSITIVE_PATHS)
+    DetectionRule.objects.bulk_create(
+        [
+            DetectionRule(name=f'Sensitive path {path}', match_type='prefix',
+                          pattern=path, threshold=1, window_seconds=window)
+            for path in paths
+        ],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0009_shard_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DetectionRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Short name, shown in the flag reason', max_length=100, unique=True)),
+                ('match_type', models.CharField(choices=[('exact', 'Exact path'), ('prefix', 'Path prefix'), ('glob', 'Glob (shell wildcards)'), ('regex', 'Regular expression')], default='prefix', help_text='How the pattern is matched against the path', max_length=10)),
+                ('pattern', models.CharField(help_text='Path, prefix, glob or regular expression', max_length=500)),
+                ('method', models.CharField(blank=True, default='', help_text='HTTP method the rule applies to (empty = any)', max_length=10)),
+                ('threshold', models.PositiveIntegerField(default=1, help_text='Matching requests within the window that flag the IP')),
+                ('window_seconds', models.PositiveIntegerField(default=3600, help_text='Length of the window (rounded up to whole hours)')),
+                ('is_active', models.BooleanField(default=True, help_text='Whether the detector applies this rule')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Detection Rule',
+                'verbose_name_plural': 'Detection Rules',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.RunPython(seed_rules, migrations.RunPython.noop),
+    ]
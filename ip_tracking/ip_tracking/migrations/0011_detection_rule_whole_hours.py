@@ -0,0 +1,39 @@
+"""
+Limit DetectionRule windows to whole hours.
+
+Rules are counted over the hourly rollups, so a shorter window was
+silently stretched to the hours it overlapped. Existing windows are
+rounded up to whole hours, which is how they were already evaluated,
+and ``DetectionRule.clean()`` now rejects anything else.
+
+Reversible: going back keeps the rounded windows.
+"""
+
+from django.db import migrations, models
+
+HOUR = 60 * 60
+
+
+def round_up_windows(apps, schema_editor):
+    DetectionRule = apps.get_model('ip_tracking', 'DetectionRule')
+    for rule in DetectionRule.objects.all():
+        hours = max(1, -(-rule.window_seconds // HOUR))
+        if rule.window_seconds != hours * HOUR:
+            rule.window_seconds = hours * HOUR
+            rule.save(update_fields=['window_seconds'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0010_detection_rules'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='detectionrule',
+            name='window_seconds',
+            field=models.PositiveIntegerField(default=3600, help_text='Length of the window in seconds, in whole hours'),
+        ),
+        migrations.RunPython(round_up_windows, migrations.RunPython.noop),
+    ]
@@ -1,25 +1,141 @@
-from django.db import models
-
-# Create your models here.
-
 """
 Models for IP tracking and request logging.
 """
 
-from django.db import models
+import ipaddress
+import re
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 from django.utils import timezone
-from django.db import models
 
+from .blocklist import bump_blocklist_version
+from .fields import IPShardKeyField, PackedIPAddressField
+from .interning import digest, paths, user_agents
+from .rules import (
+    EXACT, GLOB, PREFIX, REGEX, bump_rules_version, pattern_regex
+)
+
+
+class InternedString(models.Model):
+    """
+    One distinct string, stored once and referenced by id.
+
+    Rows are looked up by the SHA-1 ``digest`` of the value, so the
+    unique index stays small however long the value is.
+    """
+    value = models.TextField()
+    digest = models.CharField(
+        max_length=40,
+        unique=True,
+        help_text="SHA-1 hex digest of the value"
+    )
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return self.value
+
+    def save(self, *args, **kwargs):
+        self.digest = digest(self.value)
+        super().save(*args, **kwargs)
+
+
+class RequestPath(InternedString):
+    """Distinct URL path referenced by RequestLog.path_ref."""
+
+    class Meta:
+        verbose_name = "Request Path"
+        verbose_name_plural = "Request Paths"
 
 
+class UserAgent(InternedString):
+    """Distinct User-Agent string referenced by RequestLog.user_agent_ref."""
+
+    class Meta:
+        verbose_name = "User Agent"
+        verbose_name_plural = "User Agents"
+
+
+# RequestLog attribute: (foreign key, interner)
+INTERNED_FIELDS = {
+    'path': ('path_ref', paths),
+    'user_agent': ('user_agent_ref', user_agents),
+}
+
+
+class RequestLogQuerySet(models.QuerySet):
+    """
+    Lets callers keep filtering RequestLog on ``path``/``user_agent``.
+
+    Keyword lookups on the interned attributes are rewritten onto the
+    lookup tables: exact matches and ``__in`` go through the digest
+    index, anything else (``__startswith``, ``__icontains``...) filters
+    on the joined value. Q objects are passed through untouched; use
+    ``path_ref__value`` in those.
+    """
+
+    def filter(self, *args, **kwargs):
+        return super().filter(*args, **self._translate(kwargs))
+
+    def exclude(self, *args, **kwargs):
+        return super().exclude(*args, **self._translate(kwargs))
+
+    def with_text(self):
+        """Annotate ``path_text``/``user_agent_text`` for values() queries."""
+        return self.annotate(
+            path_text=models.F('path_ref__value'),
+            user_agent_text=models.F('user_agent_ref__value'),
+        )
+
+    @staticmethod
+    def _translate(kwargs):
+        translated = {}
+        for key, value in kwargs.items():
+            name, _, lookup = key.partition('__')
+            if name not in INTERNED_FIELDS:
+                translated[key] = value
+                continue
+            ref = INTERNED_FIELDS[name][0]
+            if lookup in ('', 'exact'):
+                if value is None:
+                    translated[f'{ref}__isnull'] = True
+                else:
+                    translated[f'{ref}__digest'] = digest(value)
+            elif lookup == 'in':
+                translated[f'{ref}__digest__in'] = [
+                    digest(item) for item in value
+                ]
+            elif lookup == 'isnull':
+                translated[f'{ref}__isnull'] = value
+            else:
+                translated[f'{ref}__value__{lookup}'] = value
+        return translated
+
+
+def _interned_property(name):
+    """Expose an interned foreign key as a plain string attribute."""
+    ref, interner = INTERNED_FIELDS[name]
+
+    def getter(self):
+        return interner.value_for(getattr(self, f'{ref}_id'))
+
+    def setter(self, value):
+        setattr(self, f'{ref}_id', interner.id_for(value))
+
+    return property(getter, setter)
+
 
 class RequestLog(models.Model):
     """
     Model to store information about incoming HTTP requests.
     Tracks IP addresses, timestamps, and request paths for security and analytics.
     """
-    ip_address = models.GenericIPAddressField(
-        protocol='both',  # Supports both IPv4 and IPv6
+    ip_address = PackedIPAddressField(
+        # 16 packed bytes, IPv4 mapped into IPv6: fixed-width index keys
+        # in numeric order, so ip_address__in_network is a range scan
         help_text="IP address of the client making the request"
     )
     timestamp = models.DateTimeField(
@@ -27,8 +143,10 @@ class RequestLog(models.Model):
         db_index=True,  # Index for faster queries by time
         help_text="When the request was made"
     )
-    path = models.CharField(
-        max_length=500,
+    path_ref = models.ForeignKey(
+        RequestPath,
+        on_delete=models.PROTECT,
+        related_name='+',
         help_text="URL path that was requested"
     )
     method = models.CharField(
@@ -36,7 +154,10 @@ class RequestLog(models.Model):
         default='GET',
         help_text="HTTP method used (GET, POST, etc.)"
     )
-    user_agent = models.TextField(
+    user_agent_ref = models.ForeignKey(
+        UserAgent,
+        on_delete=models.PROTECT,
+        related_name='+',
         blank=True,
         null=True,
         help_text="User agent string from the request"
@@ -51,6 +172,24 @@ class RequestLog(models.Model):
         blank=True,
         null=True
     )
+    geo_pending = models.BooleanField(
+        default=False,
+        help_text="Country/city not resolved yet, queued for enrichment"
+    )
+    sample_weight = models.PositiveIntegerField(
+        default=1,
+        help_text="Requests this row stands for (>1 when the path is sampled)"
+    )
+    shard_key = IPShardKeyField(
+        help_text="Hash bucket of ip_address, for sharded detection"
+    )
+
+    # Strings live in RequestPath/UserAgent; these read and write them
+    # through the per-process interner cache
+    path = _interned_property('path')
+    user_agent = _interned_property('user_agent')
+
+    objects = RequestLogQuerySet.as_manager()
 
     class Meta:
         ordering = ['-timestamp']  # Most recent first
@@ -58,7 +197,14 @@ class RequestLog(models.Model):
         verbose_name_plural = "Request Logs"
         indexes = [
             models.Index(fields=['ip_address', '-timestamp']),
-            models.Index(fields=['path', '-timestamp']),
+            models.Index(fields=['path_ref', '-timestamp']),
+            # Only pending rows are indexed, so the enrichment queue
+            # stays small no matter how large the table grows
+            models.Index(
+                fields=['ip_address', 'timestamp'],
+                condition=models.Q(geo_pending=True),
+                name='requestlog_geo_pending_idx',
+            ),
         ]
 
     def __str__(self):
@@ -67,8 +213,124 @@ class RequestLog(models.Model):
     def __repr__(self):
         return f"<RequestLog: {self.ip_address} [{self.method}] {self.path}>"
 
+class RequestLogHourly(models.Model):
+    """
+    Hourly RequestLog counts by (ip, path, method, country).
+
+    Maintained incrementally by the rollup task; analytics and the
+    anomaly detector read from here instead of scanning RequestLog.
+    A missing country is stored as '' so the unique key stays usable.
+    """
+    hour = models.DateTimeField(
+        help_text="Start of the hour (UTC)"
+    )
+    ip_address = PackedIPAddressField(
+        help_text="IP address of the client"
+    )
+    path = models.CharField(
+        max_length=500,
+        help_text="URL path that was requested"
+    )
+    method = models.CharField(
+        max_length=10,
+        help_text="HTTP method used"
+    )
+    country = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        help_text="Client country ('' if unknown)"
+    )
+    request_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Requests in this hour for this combination"
+    )
+
+    class Meta:
+        ordering = ['-hour']
+        verbose_name = "Hourly Request Rollup"
+        verbose_name_plural = "Hourly Request Rollups"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['hour', 'ip_address', 'path', 'method', 'country'],
+                name='unique_request_log_hourly',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['path', 'hour']),
+            models.Index(fields=['ip_address', 'hour']),
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.hour:%Y-%m-%d %H:00} {self.ip_address} "
+            f"[{self.method}] {self.path}: {self.request_count}"
+        )
+
+
+class IPRequestBucket(models.Model):
+    """
+    Per-IP request count for one time bucket (one minute by default).
+
+    Maintained by the anomaly detector for the minutes that received
+    RequestLog rows since its last run. Buckets older than the detection
+    window are evicted, so the table only ever holds the active window.
+    """
+    ip_address = PackedIPAddressField(
+        help_text="IP address the requests came from"
+    )
+    bucket_start = models.DateTimeField(
+        help_text="Start of the time bucket"
+    )
+    request_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Requests from this IP within the bucket"
+    )
+    shard_key = IPShardKeyField(
+        help_text="Hash bucket of ip_address, for sharded detection"
+    )
+
+    class Meta:
+        verbose_name = "IP Request Bucket"
+        verbose_name_plural = "IP Request Buckets"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['ip_address', 'bucket_start'],
+                name='unique_ip_request_bucket',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['bucket_start']),
+        ]
+
+    def __str__(self):
+        return f"{self.ip_address} @ {self.bucket_start}: {self.request_count}"
+
+
+class ProcessingWatermark(models.Model):
+    """
+    Highest RequestLog id a background job has already processed.
+
+    Lets incremental jobs pick up only rows that arrived since their last
+    run instead of rescanning the table.
+    """
+    name = models.CharField(
+        max_length=100,
+        unique=True,
+        help_text="Name of the job that owns this watermark"
+    )
+    last_id = models.BigIntegerField(
+        default=0,
+        help_text="Last RequestLog id processed"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
+
+
 class SuspiciousIP(models.Model):
-    ip_address = models.GenericIPAddressField(unique=True)
+    ip_address = PackedIPAddressField(unique=True)
     reason = models.TextField()
     flagged_at = models.DateTimeField(auto_now_add=True)
 
@@ -76,13 +338,102 @@ class SuspiciousIP(models.Model):
         return f"{self.ip_address} - {self.reason}"
 
 
+class DetectionRule(models.Model):
+    """
+    Flags IPs whose requests to matching paths reach a threshold.
+
+    Compiled with every other active rule into one matcher (see
+    rules.py). Saving or deleting a rule makes every process recompile.
+    """
+    MATCH_TYPES = [
+        (EXACT, 'Exact path'),
+        (PREFIX, 'Path prefix'),
+        (GLOB, 'Glob (shell wildcards)'),
+        (REGEX, 'Regular expression'),
+    ]
+
+    name = models.CharField(
+        max_length=100,
+        unique=True,
+        help_text="Short name, shown in the flag reason"
+    )
+    match_type = models.CharField(
+        max_length=10,
+        choices=MATCH_TYPES,
+        default=PREFIX,
+        help_text="How the pattern is matched against the path"
+    )
+    pattern = models.CharField(
+        max_length=500,
+        help_text="Path, prefix, glob or regular expression"
+    )
+    method = models.CharField(
+        max_length=10,
+        blank=True,
+        default='',
+        help_text="HTTP method the rule applies to (empty = any)"
+    )
+    threshold = models.PositiveIntegerField(
+        default=1,
+        help_text="Matching requests within the window that flag the IP"
+    )
+    window_seconds = models.PositiveIntegerField(
+        default=60 * 60,
+        help_text="Length of the window in seconds, in whole hours"
+    )
+    is_active = models.BooleanField(
+        default=True,
+        help_text="Whether the detector applies this rule"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['name']
+        verbose_name = "Detection Rule"
+        verbose_name_plural = "Detection Rules"
+
+    def __str__(self):
+        method = self.method or 'any'
+        return f"{self.name}: {self.match_type} {self.pattern} ({method})"
+
+    def __repr__(self):
+        return f"<DetectionRule: {self.name}>"
+
+    def clean(self):
+        """Check the pattern and the window and normalize the method."""
+        self.method = self.method.upper()
+        if not self.window_seconds or self.window_seconds % 3600:
+            # Rules are counted over hourly rollups, which cannot tell
+            # the minutes of an hour apart
+            raise ValidationError({
+                'window_seconds': "Must be a whole number of hours "
+                                  "(3600, 7200, ...)"
+            })
+        if self.match_type in (GLOB, REGEX):
+            try:
+                re.compile(pattern_regex(self.match_type, self.pattern))
+            except re.error as exc:
+                raise ValidationError({'pattern': f"Invalid pattern: {exc}"})
+
+    def save(self, *args, **kwargs):
+        """Save the rule and tell every process to recompile the rules."""
+        self.method = self.method.upper()
+        super().save(*args, **kwargs)
+        transaction.on_commit(bump_rules_version)
+
+    def delete(self, *args, **kwargs):
+        """Delete the rule and tell every process to recompile the rules."""
+        result = super().delete(*args, **kwargs)
+        transaction.on_commit(bump_rules_version)
+        return result
+
+
 class BlockedIP(models.Model):
     """
     Model to store blacklisted IP addresses.
     IPs in this table will be blocked from accessing the application.
     """
-    ip_address = models.GenericIPAddressField(
-        protocol='both',  # Supports both IPv4 and IPv6
+    ip_address = PackedIPAddressField(
         unique=True,  # Each IP can only be blocked once
         help_text="IP address to block from accessing the site"
     )
@@ -105,6 +456,11 @@ class BlockedIP(models.Model):
         default=True,
         help_text="Whether this block is currently active"
     )
+    expires_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="When a temporary block lapses (empty = permanent)"
+    )
 
     class Meta:
         ordering = ['-blocked_at']
@@ -133,11 +489,137 @@ class BlockedIP(models.Model):
             bool: True if IP is blocked, False otherwise
         """
         return cls.objects.filter(
+            models.Q(expires_at__isnull=True)
+            | models.Q(expires_at__gt=timezone.now()),
             ip_address=ip_address,
             is_active=True
         ).exists()
 
+    @classmethod
+    def block_temporarily(cls, ip_address, seconds, reason='',
+                          blocked_by='system'):
+        """
+        Block an IP for a limited time.
+
+        A permanent active block is left alone; anything else is
+        (re)activated with the new expiry.
+
+        Args:
+            ip_address (str): IP address to block
+            seconds (int): How long the block lasts
+            reason (str): Why the IP is being blocked
+            blocked_by (str): Who is blocking the IP
+
+        Returns:
+            BlockedIP: The block row
+        """
+        block = cls.objects.filter(ip_address=ip_address).first()
+        if block is None:
+            block = cls(ip_address=ip_address)
+        elif block.is_active and block.expires_at is None:
+            return block
+
+        block.is_active = True
+        block.expires_at = timezone.now() + timedelta(seconds=seconds)
+        block.reason = reason
+        block.blocked_by = blocked_by
+        block.save()
+        return block
+
+    def save(self, *args, **kwargs):
+        """Save the block and tell every worker to reload its blocklist."""
+        super().save(*args, **kwargs)
+        # Workers that reload before the commit would miss the change
+        transaction.on_commit(bump_blocklist_version)
+
+    def delete(self, *args, **kwargs):
+        """Delete the block and tell every worker to reload its blocklist."""
+        result = super().delete(*args, **kwargs)
+        transaction.on_commit(bump_blocklist_version)
+        return result
+
     def unblock(self):
         """Mark this IP as unblocked."""
         self.is_active = False
-        self.save()
\ No newline at end of file
+        self.save()
+
+class BlockedNetwork(models.Model):
+    """
+    Model to store blacklisted network ranges (IPv4 or IPv6 CIDR).
+    Every address inside an active range is blocked.
+    """
+    network = models.CharField(
+        max_length=49,  # Longest IPv6 address plus "/128"
+        unique=True,  # Each range can only be blocked once
+        help_text="Network in CIDR notation (e.g., 203.0.113.0/24)"
+    )
+    reason = models.TextField(
+        blank=True,
+        null=True,
+        help_text="Reason why this range was blocked"
+    )
+    blocked_at = models.DateTimeField(
+        auto_now_add=True,
+        help_text="When this range was added to the blacklist"
+    )
+    blocked_by = models.CharField(
+        max_length=100,
+        blank=True,
+        null=True,
+        help_text="Who blocked this range (admin username or system)"
+    )
+    is_active = models.BooleanField(
+        default=True,
+        help_text="Whether this block is currently active"
+    )
+
+    class Meta:
+        ordering = ['-blocked_at']
+        verbose_name = "Blocked Network"
+        verbose_name_plural = "Blocked Networks"
+        indexes = [
+            models.Index(fields=['network', 'is_active']),
+        ]
+
+    def __str__(self):
+        status = "Active" if self.is_active else "Inactive"
+        return f"{self.network} ({status})"
+
+    def __repr__(self):
+        return f"<BlockedNetwork: {self.network}>"
+
+    @staticmethod
+    def normalize(network):
+        """
+        Convert a CIDR string to its canonical form.
+
+        Host bits are cleared, so "10.1.2.3/8" becomes "10.0.0.0/8".
+
+        Args:
+            network (str): Network in CIDR notation
+
+        Returns:
+            str: Canonical network string
+
+        Raises:
+            ValueError: If the string is not a valid network
+        """
+        return str(ipaddress.ip_network(network.strip(), strict=False))
+
+    def save(self, *args, **kwargs):
+        """Normalize the range, save it and reload every worker's blocklist."""
+        self.network = self.normalize(self.network)
+        super().save(*args, **kwargs)
+        # Workers that reload before the commit would miss the change
+        transaction.on_commit(bump_blocklist_version)
+
+    def delete(self, *args, **kwargs):
+        """Delete the range and tell every worker to reload its blocklist."""
+        result = super().delete(*args, **kwargs)
+        transaction.on_commit(bump_blocklist_version)
+        return result
+
+    def unblock(self):
+        """Mark this range as unblocked."""
+        self.is_active = False
+        self.save()
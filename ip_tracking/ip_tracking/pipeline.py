@@ -0,0 +1,480 @@
+"""
+Single-pass request tracking pipeline.
+
+Each request runs once through an ordered list of stages configured in
+``settings.IP_TRACKING_PIPELINE`` (dotted paths, like ``MIDDLEWARE``):
+
+1. ResolveIPStage    - work out the client IP (once per request)
+2. ThreatFeedStage   - return 403 for IPs in the mapped threat feed
+3. BlockCheckStage   - return 403 for blacklisted IPs/ranges
+4. RateCountStage    - count requests per IP, flag/block on the spot
+5. GeoEnrichStage    - add country/city from the local database/cache
+6. LogEmitStage      - queue at most one RequestLog record (sampled)
+                        in the write buffer or the shared spool
+
+Stages share a TrackingContext. Any stage may return a response to stop
+the request; later stages are skipped. Leaving a stage out of the setting
+disables it for that deployment. The pipeline measures how long every
+stage takes (see ``TrackingPipeline.stats()``) and records it, along with
+counters, in the process metrics registry (see metrics.py).
+
+Stages implement ``process(context)`` and, when they need to await I/O
+under ASGI, ``aprocess(context)``. The default ``aprocess`` just calls
+``process``, which is only correct for stages that never block.
+"""
+
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponseForbidden
+from django.utils.module_loading import import_string
+
+from .blocklist import blocklist
+from .counters import SlidingWindowCounter
+from .detection import flag_ips, get_threshold, get_window
+from .fields import canonical_ip
+from .geolocation import geolocator
+from .log_buffer import log_buffer
+from .metrics import registry
+from .models import BlockedIP
+from .sampling import LogSampler
+from .spool import log_spool
+from .threatfeed import threat_feed
+
+DEFAULT_PIPELINE = [
+    'ip_tracking.pipeline.ResolveIPStage',
+    'ip_tracking.pipeline.ThreatFeedStage',
+    'ip_tracking.pipeline.BlockCheckStage',
+    'ip_tracking.pipeline.RateCountStage',
+    'ip_tracking.pipeline.GeoEnrichStage',
+    'ip_tracking.pipeline.LogEmitStage',
+]
+
+logger = logging.getLogger(__name__)
+
+# Page returned to blacklisted clients (403 Forbidden)
+BLOCKED_PAGE_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>403 Forbidden</title>
+    <style>
+        body {
+            font-family: Arial, sans-serif;
+            text-align: center;
+            padding: 50px;
+            background-color: #f5f5f5;
+        }
+        .error-box {
+            background: white;
+            padding: 30px;
+            border-radius: 10px;
+            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
+            max-width: 500px;
+            margin: 0 auto;
+        }
+        h1 { color: #d32f2f; }
+        p { color: #666; }
+    </style>
+</head>
+<body>
+    <div class="error-box">
+        <h1>🚫 403 Forbidden</h1>
+        <p>Your IP address has been blocked from accessing this site.</p>
+        <p>If you believe this is an error, please contact the site administrator.</p>
+    </div>
+</body>
+</html>
+"""
+
+
+def get_client_ip(request):
+    """
+    Get the real IP address of the client.
+    Handles cases where app is behind a proxy/load balancer.
+
+    Returns:
+        str: Client IP address in canonical form, or None if the
+            request carries no valid address
+    """
+    # Check X-Forwarded-For header first (for proxies)
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+
+    if x_forwarded_for:
+        # X-Forwarded-For can have multiple IPs, take the first
+        ip = x_forwarded_for.split(',')[0].strip()
+        try:
+            # Canonical form, as stored by PackedIPAddressField
+            return canonical_ip(ip)
+        except ValueError:
+            # Not an address (e.g. "unknown"); ignore the header
+            pass
+
+    # Direct connection - use REMOTE_ADDR
+    ip = request.META.get('REMOTE_ADDR')
+    try:
+        return canonical_ip(ip) if ip else None
+    except ValueError:
+        return None
+
+
+class TrackingContext:
+    """
+    Per-request state passed from stage to stage.
+
+    Attributes:
+        request: The Django request
+        ip_address (str): Client IP, set by ResolveIPStage
+        request_count (int): Requests from this IP in the sliding window
+        log (dict): RequestLog field values, emitted by LogEmitStage
+    """
+
+    __slots__ = ('request', 'ip_address', 'request_count', 'log')
+
+    def __init__(self, request):
+        self.request = request
+        self.ip_address = None
+        self.request_count = None
+        self.log = {}
+
+
+class Stage:
+    """Base class for pipeline stages."""
+
+    #: Short name used in timing stats
+    name = 'stage'
+
+    def process(self, context):
+        """
+        Run the stage.
+
+        Args:
+            context (TrackingContext): Shared request state
+
+        Returns:
+            HttpResponse: To stop the request here
+            None: To continue with the next stage
+        """
+        return None
+
+    async def aprocess(self, context):
+        """Async version of ``process()``; override if the stage does I/O."""
+        return self.process(context)
+
+
+class ResolveIPStage(Stage):
+    """Resolve the client IP and the basic request fields once."""
+
+    name = 'resolve_ip'
+
+    def process(self, context):
+        request = context.request
+        context.ip_address = get_client_ip(request)
+        context.log.update(
+            ip_address=context.ip_address,
+            path=request.path,
+            method=request.method,
+            user_agent=request.META.get('HTTP_USER_AGENT', ''),
+        )
+        return None
+
+
+class ThreatFeedStage(Stage):
+    """
+    Return 403 Forbidden for IPs listed in the external threat feed.
+
+    Runs before every other check: the feed is a memory-mapped file
+    (see threatfeed.py), so a miss costs a few Bloom filter bit tests.
+    """
+
+    name = 'threat_feed'
+
+    def process(self, context):
+        if context.ip_address and threat_feed.is_listed(context.ip_address):
+            registry.inc('ip_tracking_blocked_requests_total')
+            return HttpResponseForbidden(BLOCKED_PAGE_HTML)
+        return None
+
+
+class BlockCheckStage(Stage):
+    """Return 403 Forbidden for blacklisted IPs and ranges."""
+
+    name = 'block_check'
+
+    def process(self, context):
+        # Served from the in-process snapshot, no DB query per request
+        if context.ip_address and blocklist.is_blocked(context.ip_address):
+            registry.inc('ip_tracking_blocked_requests_total')
+            return HttpResponseForbidden(BLOCKED_PAGE_HTML)
+        return None
+
+    async def aprocess(self, context):
+        if blocklist.needs_refresh():
+            # Reload off the event loop; the lookup itself is in-memory
+            await blocklist.arefresh()
+        return self.process(context)
+
+
+class RateCountStage(Stage):
+    """
+    Count requests per IP over a sliding window and act on abuse at once.
+
+    Counts live in the shared cache (one atomic increment per request),
+    falling back to process memory if the cache fails; set
+    ``IP_TRACKING_RATE_COUNTER = 'local'`` to count per process only.
+    When an IP first exceeds ``IP_TRACKING_ANOMALY_THRESHOLD`` within
+    the window it is flagged as a SuspiciousIP, and with
+    ``IP_TRACKING_RATE_ACTION = 'block'`` also blocked for
+    ``IP_TRACKING_RATE_BLOCK_SECONDS``. Below the threshold the stage
+    never touches the database.
+
+    Under ASGI the shared counter is one native async Redis call (see
+    counters.py); without a django-redis cache, and with the 'local'
+    counter, it counts in process with no I/O at all.
+
+    The estimate is exposed on the context as ``request_count``.
+    """
+
+    name = 'rate_count'
+
+    def __init__(self):
+        self.threshold = get_threshold()
+        self.window_seconds = int(get_window().total_seconds())
+        self.action = getattr(settings, 'IP_TRACKING_RATE_ACTION', 'flag')
+        self.block_seconds = getattr(
+            settings, 'IP_TRACKING_RATE_BLOCK_SECONDS', self.window_seconds
+        )
+        self.counter = SlidingWindowCounter(
+            self.window_seconds,
+            use_cache=getattr(
+                settings, 'IP_TRACKING_RATE_COUNTER', 'cache'
+            ) == 'cache'
+        )
+        # IPs already acted on, so each offender is written once per
+        # window per process rather than on every further request
+        self._acted = set()
+        self._acted_window = None
+
+    def process(self, context):
+        if context.ip_address is None:
+            # Requests without an address would share one counter
+            return None
+        estimate = self.counter.hit(context.ip_address)
+        context.request_count = round(estimate)
+        if self._crossed(context.ip_address, estimate):
+            self.act(context.ip_address, estimate)
+        return None
+
+    async def aprocess(self, context):
+        if context.ip_address is None:
+            return None
+        estimate = await self.counter.ahit(context.ip_address)
+        context.request_count = round(estimate)
+        if self._crossed(context.ip_address, estimate):
+            # Rare (once per offender), so a thread hop is fine here
+            await sync_to_async(self.act)(context.ip_address, estimate)
+        return None
+
+    def act(self, ip_address, estimate):
+        """
+        Flag (and optionally block) an IP that exceeded the threshold.
+
+        Args:
+            ip_address (str): Offending IP
+            estimate (float): Requests counted in the window
+        """
+        window_minutes = self.window_seconds // 60
+        reason = (
+            f"Exceeded {self.threshold} requests/{window_minutes} min: "
+            f"{round(estimate)} requests (real-time)"
+        )
+        flag_ips({ip_address: reason})
+        registry.inc('ip_tracking_rate_actions_total', action=self.action)
+        if self.action == 'block':
+            BlockedIP.block_temporarily(
+                ip_address,
+                self.block_seconds,
+                reason=reason,
+                blocked_by='rate-limit'
+            )
+
+    def _crossed(self, ip_address, estimate):
+        if estimate <= self.threshold:
+            return False
+        window = int(time.time()) // self.window_seconds
+        if window != self._acted_window:
+            self._acted = set()
+            self._acted_window = window
+        if ip_address in self._acted:
+            return False
+        self._acted.add(ip_address)
+        return True
+
+
+class GeoEnrichStage(Stage):
+    """
+    Add country/city from the local database, the process LRU or the
+    shared cache.
+
+    Unknown IPs are logged with ``geo_pending=True`` and resolved later
+    by the ``enrich_request_logs`` task.
+    """
+
+    name = 'geo_enrich'
+
+    def process(self, context):
+        if context.ip_address is None:
+            return None
+        self._apply(context, geolocator.locate_cached(context.ip_address))
+        return None
+
+    async def aprocess(self, context):
+        if context.ip_address is None:
+            return None
+        if geolocator.needs_reload():
+            # Stat (and reload) the database file off the event loop
+            await geolocator.areload()
+        # Process memory only: a cache round-trip would block the loop
+        self._apply(context, geolocator.locate_memory(context.ip_address))
+        return None
+
+    def _apply(self, context, geo_data):
+        context.log.update(
+            country=geo_data['country'] if geo_data else None,
+            city=geo_data['city'] if geo_data else None,
+            geo_pending=geo_data is None,
+        )
+
+
+class LogEmitStage(Stage):
+    """
+    Queue the request's single RequestLog record.
+
+    Paths matching ``IP_TRACKING_LOG_SAMPLING`` are only logged for a
+    fraction of requests, with the weight of the rows skipped (see
+    sampling.py).
+
+    Records go to the shared spool file when ``IP_TRACKING_LOG_SPOOL`` is
+    set (see spool.py), otherwise to the per-process write buffer.
+    """
+
+    name = 'log_emit'
+
+    def __init__(self):
+        # Rules are compiled once, when the pipeline is built
+        self.sampler = LogSampler.from_settings()
+        self.sink = log_spool if log_spool.enabled else log_buffer
+
+    def process(self, context):
+        if context.ip_address is None:
+            # No valid client address: nothing RequestLog could store
+            return None
+        if self.sampler:
+            weight = self.sampler.weight(
+                context.log['method'], context.log['path']
+            )
+            if not weight:
+                registry.inc('ip_tracking_log_records_sampled_out_total')
+                return None
+            context.log['sample_weight'] = weight
+        # Queue for a batched write instead of an INSERT per request
+        self.sink.add(**context.log)
+        return None
+
+
+class TrackingPipeline:
+    """
+    Ordered list of stages with per-stage timing.
+
+    A failing stage is logged, counted in
+    ``ip_tracking_stage_errors_total`` and skipped, so tracking problems
+    never break the request (fail open, as the middlewares always did).
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self._lock = threading.Lock()
+        self._timings = {
+            stage.name: {'calls': 0, 'errors': 0, 'seconds': 0.0}
+            for stage in self.stages
+        }
+
+    @classmethod
+    def from_settings(cls):
+        """Build the pipeline from ``settings.IP_TRACKING_PIPELINE``."""
+        paths = getattr(settings, 'IP_TRACKING_PIPELINE', DEFAULT_PIPELINE)
+        return cls(import_string(path)() for path in paths)
+
+    def run(self, request):
+        """
+        Run every stage for a request.
+
+        Returns:
+            HttpResponse: If a stage stopped the request
+            None: If the request should continue normally
+        """
+        context = TrackingContext(request)
+        registry.inc('ip_tracking_requests_total')
+        for stage in self.stages:
+            started = time.perf_counter()
+            try:
+                response = stage.process(context)
+            except Exception:
+                self._record(stage, started, error=True)
+                logger.exception('Error in tracking stage %s', stage.name)
+                continue
+            self._record(stage, started)
+            if response is not None:
+                return response
+        return None
+
+    async def arun(self, request):
+        """Async version of ``run()``."""
+        context = TrackingContext(request)
+        registry.inc('ip_tracking_requests_total')
+        for stage in self.stages:
+            started = time.perf_counter()
+            try:
+                response = await stage.aprocess(context)
+            except Exception:
+                self._record(stage, started, error=True)
+                logger.exception('Error in tracking stage %s', stage.name)
+                continue
+            self._record(stage, started)
+            if response is not None:
+                return response
+        return None
+
+    def stats(self):
+        """
+        Return per-stage call counts, errors and time spent.
+
+        Returns:
+            dict: {stage name: {'calls', 'errors', 'seconds',
+                'avg_microseconds'}}
+        """
+        with self._lock:
+            stats = {name: dict(t) for name, t in self._timings.items()}
+        for timing in stats.values():
+            timing['avg_microseconds'] = (
+                timing['seconds'] / timing['calls'] * 1e6
+                if timing['calls'] else 0.0
+            )
+        return stats
+
+    def _record(self, stage, started, error=False):
+        elapsed = time.perf_counter() - started
+        registry.observe(
+            'ip_tracking_stage_duration_seconds', elapsed, stage=stage.name
+        )
+        if error:
+            registry.inc('ip_tracking_stage_errors_total', stage=stage.name)
+        with self._lock:
+            timing = self._timings[stage.name]
+            timing['calls'] += 1
+            timing['seconds'] += elapsed
+            if error:
+                timing['errors'] += 1
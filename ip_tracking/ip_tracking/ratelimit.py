@@ -0,0 +1,403 @@
+"""
+View rate limits checked in a single round trip.
+
+``@ratelimit`` takes the same ``key``/``rate``/``group``/``method``/
+``block`` arguments as django-ratelimit. Stacked decorators on one view
+do not nest. They merge into one list of limits, and every request
+checks that list with a single backend call. Against Redis this is one
+Lua script (EVALSHA), so all keys are counted atomically in one round
+trip instead of several GET/INCR calls per decorator.
+
+Limits use sliding-window counters, like the pipeline's rate counter
+(counters.py). Each (limit, key value) has one counter per fixed window,
+and the previous window is weighted by how much of it still overlaps:
+
+    estimate = previous * (1 - elapsed / period) + current
+
+Backends (``IP_TRACKING_RATELIMIT_BACKEND``):
+
+- ``'redis'``: shared across workers through the django-redis
+  connection of ``RATELIMIT_USE_CACHE``. If Redis fails, the request is
+  counted in process instead, and the fallback is counted in metrics.
+- ``'local'``: in-process counters, for tests and single-node setups.
+
+Like django-ratelimit, every request is counted, including rejected
+ones. ``request.limited`` is set, and a blocking limit that is exceeded
+raises ``Ratelimited`` (a ``PermissionDenied``).
+"""
+
+import hashlib
+import ipaddress
+import re
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from django_ratelimit.exceptions import Ratelimited
+
+from .metrics import registry
+
+KEY_PREFIX = 'ip_tracking:rl'
+
+ALL = None
+UNSAFE = ('DELETE', 'PATCH', 'POST', 'PUT')
+
+UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+RATE_RE = re.compile(r'^(\d+)/(\d*)([smhd])$')
+
+# Seconds between sweeps of expired counters in the local backend
+LOCAL_SWEEP_SECONDS = 60
+
+# KEYS: (current window, previous window) per limit
+# ARGV: TTL of the current window per limit
+# Returns: current and previous count per limit, flattened
+SLIDING_WINDOW_SCRIPT = """
+local counts = {}
+for i = 1, #KEYS, 2 do
+    local current = redis.call('INCR', KEYS[i])
+    if current == 1 then
+        redis.call('EXPIRE', KEYS[i], ARGV[(i + 1) / 2])
+    end
+    counts[#counts + 1] = current
+    counts[#counts + 1] = tonumber(redis.call('GET', KEYS[i + 1]) or '0')
+end
+return counts
+"""
+
+
+def parse_rate(rate):
+    """
+    Parse a django-ratelimit rate string.
+
+    Args:
+        rate (str): "<count>/<unit>", e.g. "5/m", "100/h" or "10/5m"
+
+    Returns:
+        tuple: (limit, period in seconds)
+
+    Raises:
+        ValueError: If the rate is malformed
+    """
+    match = RATE_RE.match(rate.strip())
+    if match is None:
+        raise ValueError(f'Invalid rate: {rate}')
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * UNITS[unit]
+
+
+def get_ip_key(request):
+    """
+    Return the client address to rate-limit by, like django-ratelimit.
+
+    Uses ``REMOTE_ADDR`` unless ``RATELIMIT_IP_META_KEY`` names another
+    META key or a callable (set it behind a trusted proxy). Never reads
+    X-Forwarded-For on its own: clients can put anything in it. The
+    address is masked with ``RATELIMIT_IPV4_MASK``/``RATELIMIT_IPV6_MASK``.
+
+    Args:
+        request: The HttpRequest
+
+    Returns:
+        str: Network address to count under
+    """
+    ip_meta = getattr(settings, 'RATELIMIT_IP_META_KEY', None)
+    if not ip_meta:
+        ip = request.META.get('REMOTE_ADDR')
+        if not ip:
+            raise ImproperlyConfigured(
+                'REMOTE_ADDR is empty; set RATELIMIT_IP_META_KEY when the '
+                'app server sits behind a proxy on a Unix socket'
+            )
+    elif callable(ip_meta):
+        ip = ip_meta(request)
+    elif '.' in ip_meta:
+        ip = import_string(ip_meta)(request)
+    elif ip_meta in request.META:
+        ip = request.META[ip_meta]
+    else:
+        raise ImproperlyConfigured(
+            f'Could not get the IP address from "{ip_meta}"'
+        )
+
+    if ':' in ip:
+        mask = getattr(settings, 'RATELIMIT_IPV6_MASK', 64)
+    else:
+        mask = getattr(settings, 'RATELIMIT_IPV4_MASK', 32)
+    network = ipaddress.ip_network(f'{ip.strip()}/{mask}', strict=False)
+    return str(network.network_address)
+
+
+def _user_key(request):
+    return str(request.user.pk)
+
+
+def _user_or_ip_key(request):
+    if request.user.is_authenticated:
+        return str(request.user.pk)
+    return get_ip_key(request)
+
+
+KEY_FUNCTIONS = {
+    'ip': get_ip_key,
+    'user': _user_key,
+    'user_or_ip': _user_or_ip_key,
+}
+
+
+def get_key_value(key, request, group=None):
+    """
+    Resolve a django-ratelimit key for a request.
+
+    Args:
+        key: 'ip', 'user', 'user_or_ip', 'header:<name>', 'get:<name>',
+            'post:<name>' or a callable taking (group, request)
+        request: The HttpRequest
+        group (str): The limit's group, passed to callable keys
+
+    Returns:
+        str: Value to count under, or None to skip the limit
+    """
+    if callable(key):
+        return key(group, request)
+    if key in KEY_FUNCTIONS:
+        return KEY_FUNCTIONS[key](request)
+    source, _, name = key.partition(':')
+    if source == 'header':
+        return request.META.get('HTTP_' + name.upper().replace('-', '_'))
+    if source == 'get':
+        return request.GET.get(name)
+    if source == 'post':
+        return request.POST.get(name)
+    raise ValueError(f'Unknown rate limit key: {key}')
+
+
+class Limit:
+    """
+    One ``@ratelimit`` declaration.
+
+    Args:
+        key: Key to count by (see ``get_key_value()``)
+        rate (str): Rate string, e.g. "5/m"
+        group (str): Counter namespace (defaults to the view's path)
+        method: HTTP method(s) the limit applies to (None = all)
+        block (bool): Reject requests over this limit
+    """
+
+    def __init__(self, key, rate, group=None, method=ALL, block=True):
+        self.key = key
+        self.rate = rate
+        self.limit, self.period = parse_rate(rate)
+        self.group = group
+        if isinstance(method, str):
+            method = (method,)
+        self.methods = None if method is ALL else {m.upper() for m in method}
+        self.block = block
+
+    def applies_to(self, request):
+        return self.methods is None or request.method in self.methods
+
+    def counter_key(self, value, window):
+        """Return the backend key of this limit's counter for a window."""
+        value_hash = hashlib.sha1(
+            f'{self.key}:{value}'.encode('utf-8')
+        ).hexdigest()
+        return f'{KEY_PREFIX}:{self.group}:{self.period}:{window}:{value_hash}'
+
+
+class LocalBackend:
+    """In-process counters: {key: [count, expires at]}."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._next_sweep = 0.0
+
+    def hit(self, windows, now=None):
+        """
+        Count one request against several limits atomically.
+
+        Args:
+            windows (list): (current key, previous key, TTL) per limit
+            now (float): Current UNIX time (for tests)
+
+        Returns:
+            list: (current count, previous count) per limit
+        """
+        now = time.time() if now is None else now
+        counts = []
+        with self._lock:
+            if now >= self._next_sweep:
+                self._counters = {
+                    key: counter for key, counter in self._counters.items()
+                    if counter[1] > now
+                }
+                self._next_sweep = now + LOCAL_SWEEP_SECONDS
+            for current_key, previous_key, ttl in windows:
+                counter = self._counters.get(current_key)
+                if counter is None or counter[1] <= now:
+                    counter = self._counters[current_key] = [0, now + ttl]
+                counter[0] += 1
+                previous = self._counters.get(previous_key)
+                counts.append((
+                    counter[0],
+                    previous[0] if previous and previous[1] > now else 0,
+                ))
+        return counts
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+
+
+class RedisBackend:
+    """
+    Counters in Redis, updated by one Lua script per request.
+
+    Args:
+        alias (str): Cache alias of a django-redis cache
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self.local = LocalBackend()
+        self._script = None
+
+    def hit(self, windows, now=None):
+        """See ``LocalBackend.hit()``."""
+        try:
+            script = self._get_script()
+            keys, ttls = [], []
+            for current_key, previous_key, ttl in windows:
+                keys.extend((current_key, previous_key))
+                ttls.append(ttl)
+            counts = [int(count) for count in script(keys=keys, args=ttls)]
+            return list(zip(counts[::2], counts[1::2]))
+        except Exception:
+            # Redis down: keep limiting, per process, until it is back
+            registry.inc('ip_tracking_ratelimit_fallbacks_total')
+            return self.local.hit(windows, now)
+
+    def _get_script(self):
+        if self._script is None:
+            from django_redis import get_redis_connection
+
+            # register_script() runs EVALSHA, reloading on NOSCRIPT
+            self._script = get_redis_connection(self.alias).register_script(
+                SLIDING_WINDOW_SCRIPT
+            )
+        return self._script
+
+
+BACKENDS = {
+    'redis': lambda: RedisBackend(
+        getattr(settings, 'RATELIMIT_USE_CACHE', 'default')
+    ),
+    'local': LocalBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the process-wide backend named by the settings."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = getattr(settings, 'IP_TRACKING_RATELIMIT_BACKEND',
+                               'redis')
+                _backend = BACKENDS[name]()
+    return _backend
+
+
+def check(request, limits, now=None):
+    """
+    Count a request against every applicable limit in one backend call.
+
+    Args:
+        request: The HttpRequest
+        limits (list): Limit objects
+        now (float): Current UNIX time (for tests)
+
+    Returns:
+        list: Limits the request exceeded
+    """
+    now = time.time() if now is None else now
+    active, windows, elapsed = [], [], []
+    for limit in limits:
+        if not limit.applies_to(request):
+            continue
+        value = get_key_value(limit.key, request, limit.group)
+        if value is None:
+            continue
+        window, offset = divmod(now, limit.period)
+        window = int(window)
+        active.append(limit)
+        windows.append((
+            limit.counter_key(value, window),
+            limit.counter_key(value, window - 1),
+            limit.period * 2,
+        ))
+        elapsed.append(offset)
+    if not active:
+        return []
+
+    exceeded = []
+    counts = get_backend().hit(windows, now)
+    for limit, (current, previous), offset in zip(active, counts, elapsed):
+        estimate = previous * (1 - offset / limit.period) + current
+        if estimate > limit.limit:
+            exceeded.append(limit)
+    return exceeded
+
+
+def ratelimit(key=None, rate=None, method=ALL, block=True, group=None):
+    """
+    Rate-limit a view; drop-in for django-ratelimit's decorator.
+
+    Stacking several ``@ratelimit`` decorators adds limits to the same
+    wrapper, so all of them are checked in one backend call.
+
+    Args:
+        key: What to count by ('ip', 'user', 'post:username', ...)
+        rate (str): Rate string, e.g. "5/m"
+        method: HTTP method(s) to limit (None = all)
+        block (bool): Raise Ratelimited when the limit is exceeded
+        group (str): Counter namespace; defaults to the view's dotted path
+    """
+    def decorator(view):
+        limit = Limit(key, rate, group, method, block)
+        limits = getattr(view, 'rate_limits', None)
+        if limits is not None:
+            # Already wrapped by an inner @ratelimit: join its check
+            limit.group = limit.group or view.rate_limit_group
+            limits.insert(0, limit)
+            return view
+
+        default_group = f'{view.__module__}.{view.__qualname__}'
+        limit.group = limit.group or default_group
+
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            exceeded = []
+            if getattr(settings, 'RATELIMIT_ENABLE', True):
+                exceeded = check(request, wrapped.rate_limits)
+            request.limited = getattr(request, 'limited', False) or bool(
+                exceeded
+            )
+            for limit in exceeded:
+                registry.inc('ip_tracking_ratelimited_requests_total',
+                              group=limit.group)
+            if any(limit.block for limit in exceeded):
+                raise Ratelimited()
+            return view(request, *args, **kwargs)
+
+        wrapped.rate_limits = [limit]
+        wrapped.rate_limit_group = default_group
+        return wrapped
+
+    return decorator
@@ -0,0 +1,149 @@
+"""
+Chunked retention purge for the tracking tables.
+
+Rows older than each table's retention window are deleted in bounded
+primary-key chunks with raw DELETE statements: no objects are loaded, no
+signals fire, and every statement holds its locks only briefly. An
+optional pause between chunks leaves room for the web workers' writes.
+
+Progress is checkpointed in a ProcessingWatermark per table, so an
+interrupted run picks up where it stopped. The checkpoint is cleared
+when a run completes.
+
+Retention windows (in days, None = keep forever) come from
+``settings.IP_TRACKING_RETENTION_DAYS``, keyed by model name.
+"""
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import (
+    ProcessingWatermark, RequestLog, RequestLogHourly, SuspiciousIP
+)
+
+DEFAULT_RETENTION_DAYS = {
+    'RequestLog': 90,
+    'RequestLogHourly': 365,
+    'SuspiciousIP': None,
+}
+
+# Model and the timestamp column retention is measured against
+PURGEABLE_TABLES = {
+    'RequestLog': (RequestLog, 'timestamp'),
+    'RequestLogHourly': (RequestLogHourly, 'hour'),
+    'SuspiciousIP': (SuspiciousIP, 'flagged_at'),
+}
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def get_retention_days():
+    """Return {model name: days or None}, settings merged over defaults."""
+    retention = dict(DEFAULT_RETENTION_DAYS)
+    retention.update(getattr(settings, 'IP_TRACKING_RETENTION_DAYS', {}))
+    return retention
+
+
+def purge_table(name, days, chunk_size=DEFAULT_CHUNK_SIZE, sleep=0.0,
+                dry_run=False, progress=None):
+    """
+    Delete rows older than ``days`` from one table, chunk by chunk.
+
+    Args:
+        name (str): Key in PURGEABLE_TABLES
+        days (int): Retention window in days
+        chunk_size (int): Max rows per DELETE statement
+        sleep (float): Seconds to pause between chunks
+        dry_run (bool): Count matching rows without deleting them
+        progress (callable): Called as progress(name, deleted so far)
+            after each chunk
+
+    Returns:
+        dict: table, deleted, chunks, seconds, rows_per_second
+    """
+    model, time_field = PURGEABLE_TABLES[name]
+    cutoff = timezone.now() - timedelta(days=days)
+    expired = model.objects.filter(**{f'{time_field}__lt': cutoff})
+    started = time.perf_counter()
+
+    if dry_run:
+        return _report(name, expired.count(), 0, started)
+
+    watermark, _ = ProcessingWatermark.objects.get_or_create(
+        name=f'purge:{name}'
+    )
+    last_pk = watermark.last_id
+    deleted = chunks = 0
+
+    while True:
+        pks = list(
+            expired.filter(pk__gt=last_pk)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:chunk_size]
+        )
+        if not pks:
+            break
+
+        # Range delete over the primary key: one short statement, no
+        # objects loaded, no signals (QuerySet._raw_delete)
+        chunk = expired.filter(pk__gte=pks[0], pk__lte=pks[-1])
+        deleted += chunk._raw_delete(chunk.db)
+        chunks += 1
+
+        last_pk = pks[-1]
+        watermark.last_id = last_pk
+        watermark.save(update_fields=['last_id', 'updated_at'])
+
+        if progress:
+            progress(name, deleted)
+        if len(pks) < chunk_size:
+            break
+        if sleep:
+            time.sleep(sleep)
+
+    # Completed: the next run starts from the beginning again
+    watermark.last_id = 0
+    watermark.save(update_fields=['last_id', 'updated_at'])
+    return _report(name, deleted, chunks, started)
+
+
+def purge_all(chunk_size=DEFAULT_CHUNK_SIZE, sleep=0.0, dry_run=False,
+              tables=None, progress=None):
+    """
+    Apply every configured retention window.
+
+    Args:
+        tables (iterable): Limit the purge to these model names
+        (other arguments as for ``purge_table()``)
+
+    Returns:
+        list: One ``purge_table()`` report per purged table
+    """
+    reports = []
+    for name, days in get_retention_days().items():
+        if days is None or name not in PURGEABLE_TABLES:
+            continue
+        if tables and name not in tables:
+            continue
+        reports.append(purge_table(
+            name, days,
+            chunk_size=chunk_size,
+            sleep=sleep,
+            dry_run=dry_run,
+            progress=progress,
+        ))
+    return reports
+
+
+def _report(name, deleted, chunks, started):
+    seconds = time.perf_counter() - started
+    return {
+        'table': name,
+        'deleted': deleted,
+        'chunks': chunks,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(deleted / seconds) if seconds else 0,
+    }
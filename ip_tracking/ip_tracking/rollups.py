@@ -0,0 +1,238 @@
+"""
+Incremental hourly rollups of RequestLog.
+
+``rollup_request_logs()`` folds RequestLog rows added since its last run
+(tracked by a ProcessingWatermark on the primary key) into
+RequestLogHourly counts. The GROUP BY runs in the database over a bounded
+id range, so each run only touches new rows. The range stops at ids that
+have settled (see ``watermarks.settled_max_id()``), so a row committed
+late under a lower id is not skipped.
+
+Rows still waiting for geolocation enrichment are rolled up at once with
+an empty country, so detection never waits on the geolocation provider.
+When enrichment resolves them, ``reassign_countries()`` moves their
+counts to the resolved country.
+
+Both write RequestLogHourly with a read-modify-write, so they run under
+``rollup_lock()``, a lock in the shared Django cache. Two overlapping
+runs (a detection run and the standalone rollup task, say) would
+otherwise both add the same rows on databases without row locks
+(SQLite ignores ``select_for_update()``).
+"""
+
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncHour
+
+from .interning import paths
+from .models import ProcessingWatermark, RequestLog, RequestLogHourly
+from .watermarks import settled_max_id
+
+WATERMARK_NAME = 'hourly_rollup'
+
+DEFAULT_BATCH_SIZE = 50000
+
+# Cache key of the lock held while RequestLogHourly is written
+LOCK_KEY = 'ip_tracking:rollup_lock'
+
+# Seconds before the lock of a crashed run expires (renewed every batch)
+LOCK_TIMEOUT = 5 * 60
+
+ROLLUP_KEY = ('hour', 'ip_address', 'path', 'method', 'country')
+
+
+class RollupBusy(Exception):
+    """Raised when another process holds the rollup lock."""
+
+
+@contextmanager
+def rollup_lock(wait=0.0):
+    """
+    Hold the cross-process lock for writing RequestLogHourly.
+
+    Args:
+        wait (float): Seconds to wait for a lock held by another process
+
+    Raises:
+        RollupBusy: The lock is still held after ``wait`` seconds
+    """
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    while not cache.add(LOCK_KEY, token, timeout=LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            raise RollupBusy('Hourly rollups are being written by another '
+                             'process')
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        if cache.get(LOCK_KEY) == token:
+            cache.delete(LOCK_KEY)
+
+
+def rollup_request_logs(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Fold new RequestLog rows into the hourly rollup table.
+
+    Returns at once if another process is already rolling up; that run
+    picks up the new rows.
+
+    Args:
+        batch_size (int): Width of each id range aggregated in one query
+
+    Returns:
+        dict: rows_processed, rollups_created, rollups_updated, last_id
+            and skipped (True if another run held the lock)
+    """
+    result = {'rows_processed': 0, 'rollups_created': 0, 'rollups_updated': 0}
+    try:
+        with rollup_lock():
+            _rollup(batch_size, result)
+        result['skipped'] = False
+    except RollupBusy:
+        result['skipped'] = True
+
+    result['last_id'] = ProcessingWatermark.objects.filter(
+        name=WATERMARK_NAME
+    ).values_list('last_id', flat=True).first() or 0
+    return result
+
+
+def _rollup(batch_size, result):
+    """Roll up settled rows batch by batch; the caller holds the lock."""
+    upper = settled_max_id(WATERMARK_NAME)
+
+    while True:
+        # Renew the lock so a long backlog does not outlive it
+        cache.touch(LOCK_KEY, LOCK_TIMEOUT)
+        with transaction.atomic():
+            watermark, _ = (
+                ProcessingWatermark.objects.select_for_update()
+                .get_or_create(name=WATERMARK_NAME)
+            )
+            start = watermark.last_id
+            if start >= upper:
+                break
+            end = min(start + batch_size, upper)
+
+            groups = (
+                RequestLog.objects.filter(id__gt=start, id__lte=end)
+                .annotate(hour=TruncHour('timestamp'))
+                .order_by()
+                .values('hour', 'ip_address', 'path_ref', 'method', 'country')
+                # Sampled rows stand for sample_weight requests each
+                .annotate(n=Count('id'), requests=Sum('sample_weight'))
+            )
+            # Grouped by path id; the strings come from the interner
+            groups = list(groups)
+            path_values = paths.values_for(row['path_ref'] for row in groups)
+            counts = {}
+            for row in groups:
+                row['path'] = path_values[row['path_ref']]
+                row['country'] = row['country'] or ''
+                key = tuple(row[field] for field in ROLLUP_KEY)
+                counts[key] = counts.get(key, 0) + row['requests']
+                result['rows_processed'] += row['n']
+
+            created, updated = _merge(counts)
+            result['rollups_created'] += created
+            result['rollups_updated'] += updated
+
+            watermark.last_id = end
+            watermark.save(update_fields=['last_id', 'updated_at'])
+
+
+def reassign_countries(queryset, countries):
+    """
+    Move the rolled-up counts of pending rows to their resolved country.
+
+    Rows rolled up while their geolocation was pending are counted under
+    country ''. Call this under ``rollup_lock()``, in the same transaction
+    as the UPDATE that fills in their country, before it runs.
+
+    Args:
+        queryset: Pending RequestLog rows about to be updated
+        countries (dict): {ip: country code, '' if unknown}
+
+    Returns:
+        int: Requests moved to another country
+    """
+    watermark = (
+        ProcessingWatermark.objects.select_for_update()
+        .filter(name=WATERMARK_NAME).first()
+    )
+    if watermark is None:
+        return 0
+
+    groups = list(
+        queryset.filter(id__lte=watermark.last_id)
+        .annotate(hour=TruncHour('timestamp'))
+        .order_by()
+        .values('hour', 'ip_address', 'path_ref', 'method')
+        .annotate(requests=Sum('sample_weight'))
+    )
+    path_values = paths.values_for(row['path_ref'] for row in groups)
+    counts = {}
+    moved = 0
+    for row in groups:
+        country = countries.get(row['ip_address']) or ''
+        if not country:
+            continue
+        key = (row['hour'], row['ip_address'], path_values[row['path_ref']],
+               row['method'])
+        counts[key + ('',)] = counts.get(key + ('',), 0) - row['requests']
+        counts[key + (country,)] = (
+            counts.get(key + (country,), 0) + row['requests']
+        )
+        moved += row['requests']
+
+    _merge(counts)
+    RequestLogHourly.objects.filter(
+        country='',
+        request_count__lte=0,
+        hour__in={key[0] for key in counts},
+        ip_address__in={key[1] for key in counts},
+    ).delete()
+    return moved
+
+
+def _merge(counts):
+    """
+    Add {(hour, ip, path, method, country): n} to the rollup table.
+
+    Returns:
+        tuple: (rows created, rows updated)
+    """
+    if not counts:
+        return 0, 0
+
+    existing = {
+        tuple(getattr(rollup, field) for field in ROLLUP_KEY): rollup
+        for rollup in RequestLogHourly.objects.filter(
+            hour__in={key[0] for key in counts},
+            ip_address__in={key[1] for key in counts},
+        )
+    }
+
+    to_update, to_create = [], []
+    for key, count in counts.items():
+        rollup = existing.get(key)
+        if rollup is not None:
+            rollup.request_count += count
+            to_update.append(rollup)
+        else:
+            to_create.append(RequestLogHourly(
+                request_count=count, **dict(zip(ROLLUP_KEY, key))
+            ))
+
+    RequestLogHourly.objects.bulk_update(
+        to_update, ['request_count'], batch_size=1000
+    )
+    RequestLogHourly.objects.bulk_create(to_create, batch_size=1000)
+    return len(to_create), len(to_update)
@@ -0,0 +1,254 @@
+"""
+Declarative detection rules compiled into one matcher.
+
+Each active ``DetectionRule`` row matches request paths in one of four
+ways:
+
+- ``exact``: the whole path, e.g. ``/login``
+- ``prefix``: the start of the path, e.g. ``/admin`` also matches
+  ``/admin/login/`` (and ``/administrator``; use ``/admin/`` to avoid it)
+- ``glob``: shell-style wildcards over the whole path, e.g. ``/api/*/export``
+- ``regex``: a regular expression matched from the start of the path
+
+A rule can be limited to one HTTP method. It flags an IP once the IP
+makes ``threshold`` matching requests within ``window_seconds``.
+
+All rules are compiled together into a ``RuleMatcher``:
+
+- exact and prefix rules go into a character trie, so a single walk
+  along the path finds every one that matches;
+- glob and regex rules become one regular expression, with one optional
+  lookahead group per rule, so a single ``match()`` reports every rule
+  that matches instead of only the first. Expressions that cannot share
+  it (global inline flags such as ``(?i)`` apply to the whole pattern,
+  and group numbers shift once wrapped) are matched one by one.
+
+Workers keep the compiled matcher in memory. Saving or deleting a rule
+bumps a shared version number in the Django cache, and each process
+checks it at most once every ``IP_TRACKING_RULES_REFRESH_SECONDS``
+seconds and recompiles when it changed, without a restart.
+"""
+
+import fnmatch
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Cache key holding the shared rule set version
+RULES_VERSION_KEY = 'ip_tracking:rules_version'
+
+# Default upper bound (seconds) before a process notices a rule change
+DEFAULT_REFRESH_SECONDS = 5
+
+EXACT = 'exact'
+PREFIX = 'prefix'
+GLOB = 'glob'
+REGEX = 'regex'
+
+logger = logging.getLogger(__name__)
+
+
+def get_rules_version():
+    """
+    Read the shared rule set version from the cache.
+
+    Returns:
+        int: Current version (0 if it has never been bumped)
+    """
+    return cache.get(RULES_VERSION_KEY, 0)
+
+
+def bump_rules_version():
+    """
+    Signal every process that the detection rules have changed.
+
+    Returns:
+        int: The new version number
+    """
+    cache.add(RULES_VERSION_KEY, 0, timeout=None)
+    try:
+        return cache.incr(RULES_VERSION_KEY)
+    except ValueError:
+        # Key was evicted between add() and incr()
+        cache.set(RULES_VERSION_KEY, 1, timeout=None)
+        return 1
+
+
+def pattern_regex(match_type, pattern):
+    """
+    Return the regular expression source for a glob or regex rule.
+
+    Args:
+        match_type (str): GLOB or REGEX
+        pattern (str): The rule's pattern
+
+    Returns:
+        str: Expression to use with ``re.match()``
+    """
+    if match_type == GLOB:
+        return fnmatch.translate(pattern)
+    return pattern
+
+
+def is_combinable(compiled):
+    """
+    Check whether an expression can join the combined rule pattern.
+
+    Args:
+        compiled (re.Pattern): The rule's compiled expression
+
+    Returns:
+        bool: False for expressions with global inline flags, which
+            would apply to every rule, or with groups, whose numbers
+            (and names) would change in the combined pattern
+    """
+    return not compiled.groups and compiled.flags == re.UNICODE
+
+
+class _TrieNode:
+    __slots__ = ('children', 'prefix_rules', 'exact_rules')
+
+    def __init__(self):
+        self.children = {}
+        self.prefix_rules = []
+        self.exact_rules = []
+
+
+class RuleMatcher:
+    """
+    Every rule of a rule set compiled into one matcher.
+
+    Args:
+        rules (iterable): Objects with ``match_type``, ``pattern`` and
+            ``method`` attributes (DetectionRule rows)
+    """
+
+    def __init__(self, rules=()):
+        self.rules = []
+        self._root = _TrieNode()
+        self._groups = {}
+        self._separate = []
+        parts = []
+        for rule in rules:
+            index = len(self.rules)
+            if rule.match_type in (EXACT, PREFIX):
+                node = self._root
+                for char in rule.pattern:
+                    node = node.children.setdefault(char, _TrieNode())
+                if rule.match_type == EXACT:
+                    node.exact_rules.append(index)
+                else:
+                    node.prefix_rules.append(index)
+            else:
+                source = pattern_regex(rule.match_type, rule.pattern)
+                try:
+                    compiled = re.compile(source)
+                except re.error:
+                    # Saved around model validation; skip, don't fail
+                    logger.warning('Skipping detection rule %r: invalid '
+                                   'pattern %r', rule, rule.pattern)
+                    continue
+                if is_combinable(compiled):
+                    self._groups[f'r{index}'] = index
+                    parts.append(f'(?:(?=(?P<r{index}>{source})))?')
+                else:
+                    self._separate.append((index, compiled))
+            self.rules.append(rule)
+        self._regex = re.compile(''.join(parts)) if parts else None
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match(self, method, path):
+        """
+        Find every rule a request matches.
+
+        Args:
+            method (str): HTTP method
+            path (str): Request path
+
+        Returns:
+            list: Matching rules, in rule set order
+        """
+        indexes = []
+        node = self._root
+        indexes.extend(node.prefix_rules)
+        for char in path:
+            node = node.children.get(char)
+            if node is None:
+                break
+            indexes.extend(node.prefix_rules)
+        else:
+            indexes.extend(node.exact_rules)
+
+        if self._regex is not None:
+            found = self._regex.match(path)
+            for name, value in found.groupdict().items():
+                if value is not None and name in self._groups:
+                    indexes.append(self._groups[name])
+        for index, regex in self._separate:
+            if regex.match(path):
+                indexes.append(index)
+
+        return [
+            self.rules[index] for index in sorted(indexes)
+            if self.rules[index].method in ('', method)
+        ]
+
+
+def get_refresh_interval():
+    """Return the configured version check interval in seconds."""
+    return getattr(
+        settings, 'IP_TRACKING_RULES_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS
+    )
+
+
+class DetectionRules:
+    """
+    The process's compiled rule set, rebuilt when the version changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._matcher = RuleMatcher()
+        self._version = None
+        self._next_check = 0.0
+
+    @property
+    def matcher(self):
+        """The current RuleMatcher."""
+        if time.monotonic() >= self._next_check:
+            self.refresh()
+        return self._matcher
+
+    def refresh(self, force=False):
+        """
+        Recompile the rules if the shared version has changed.
+
+        Args:
+            force (bool): Recompile even if the version is unchanged
+        """
+        from .models import DetectionRule
+
+        with self._lock:
+            now = time.monotonic()
+            if not force and now < self._next_check:
+                # Another thread refreshed while we waited for the lock
+                return
+            self._next_check = now + get_refresh_interval()
+
+            version = get_rules_version()
+            if not force and version == self._version:
+                return
+            self._matcher = RuleMatcher(
+                DetectionRule.objects.filter(is_active=True).order_by('id')
+            )
+            self._version = version
+
+
+# Shared per-process rule set used by the anomaly detector
+detection_rules = DetectionRules()
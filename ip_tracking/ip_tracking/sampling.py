@@ -0,0 +1,143 @@
+"""
+Per-path sampling of RequestLog writes.
+
+Static assets, health checks and busy pages produce most log rows but
+matter little for security. ``IP_TRACKING_LOG_SAMPLING`` lists rules that
+keep only a fraction of them:
+
+    IP_TRACKING_LOG_SAMPLING = [
+        {'prefix': '/static/', 'method': 'GET', 'rate': 0.01},
+        {'prefix': '/health', 'rate': 0.001},   # any method
+    ]
+
+The longest matching prefix wins, and a rule for the request's method
+beats an any-method rule with the same prefix. Paths without a rule are
+always logged.
+
+A kept row stores its ``sample_weight``, the number of requests it
+stands for. Rates are therefore rounded to 1/N: 0.01 keeps one request
+in 100 with weight 100. Rollups and anomaly detection sum the weights
+instead of counting rows, so their counts and thresholds stay unbiased.
+
+Requests matched by an active detection rule (see rules.py) are never
+sampled, because the rules count individual hits. The sampler asks the
+process's shared ``detection_rules`` matcher, so a rule added at runtime
+is exempt as soon as it is compiled.
+
+The rules are compiled once per process into one regular expression per
+method: escaped prefixes in an alternation, longest first. Matching a
+request is a single ``match()``.
+"""
+
+import random
+import re
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .rules import detection_rules
+
+ANY_METHOD = '*'
+
+
+def weight_for_rate(rate):
+    """
+    Turn a sampling rate into the weight of each kept row.
+
+    Args:
+        rate (float): Fraction of requests to keep, 0 < rate <= 1
+
+    Returns:
+        int: Requests each kept row stands for (1 = no sampling)
+    """
+    if not 0 < rate <= 1:
+        raise ImproperlyConfigured(
+            f'IP_TRACKING_LOG_SAMPLING rate must be in (0, 1], got {rate}'
+        )
+    return max(1, round(1 / rate))
+
+
+class LogSampler:
+    """
+    Compiled sampling rules.
+
+    Args:
+        rules (list): Dicts with 'prefix', 'rate' and optional 'method'
+        exempt (DetectionRules): Rule set whose matches are always logged
+            (None exempts nothing)
+        rng (random.Random): Source of randomness (for tests)
+    """
+
+    def __init__(self, rules=(), exempt=None, rng=None):
+        self.rules = []
+        for rule in rules:
+            method = rule.get('method') or ANY_METHOD
+            self.rules.append((
+                method.upper(), rule['prefix'], weight_for_rate(rule['rate'])
+            ))
+        self.exempt = exempt
+        self.random = (rng or random.Random()).random
+        self._any = self._compile(ANY_METHOD)
+        self._by_method = {
+            method: self._compile(method)
+            for method in {method for method, _, _ in self.rules}
+            if method != ANY_METHOD
+        }
+
+    @classmethod
+    def from_settings(cls):
+        """Build the sampler from ``IP_TRACKING_LOG_SAMPLING``."""
+        return cls(
+            getattr(settings, 'IP_TRACKING_LOG_SAMPLING', []),
+            detection_rules,
+        )
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def _compile(self, method):
+        """Return (regex, weights by group name) for one method."""
+        rules = [
+            (prefix, weight, rule_method != ANY_METHOD)
+            for rule_method, prefix, weight in self.rules
+            if rule_method in (method, ANY_METHOD)
+        ]
+        if not rules:
+            return None
+        # Longest prefix first, method-specific before any-method:
+        # the first alternative that matches is the winning rule
+        rules.sort(key=lambda rule: (-len(rule[0]), not rule[2]))
+        weights = {}
+        parts = []
+        for i, (prefix, weight, _) in enumerate(rules):
+            weights[f'r{i}'] = weight
+            parts.append(f'(?P<r{i}>{re.escape(prefix)})')
+        return re.compile('|'.join(parts)), weights
+
+    def weight(self, method, path):
+        """
+        Decide whether to log a request.
+
+        Args:
+            method (str): HTTP method
+            path (str): Request path
+
+        Returns:
+            int: Weight to store with the row, or 0 to skip logging it
+        """
+        compiled = self._by_method.get(method, self._any)
+        if compiled is None:
+            return 1
+        regex, weights = compiled
+        match = regex.match(path)
+        if match is None:
+            return 1
+        weight = weights[match.lastgroup]
+        if weight == 1:
+            return 1
+        # Only requests a sampling rule would thin out pay for the check
+        if self.exempt is not None and self.exempt.matcher.match(method, path):
+            return 1
+        if self.random() * weight < 1:
+            return weight
+        return 0
@@ -0,0 +1,457 @@
+"""
+Shared-memory spool for RequestLog records.
+
+With ``IP_TRACKING_LOG_SPOOL`` set, the tracking pipeline does not write
+RequestLog rows itself, not even in batches. Every worker process on a
+host appends fixed-layout records to one memory-mapped ring buffer file.
+A separate ``drain_request_logs`` process reads the file and bulk-inserts
+the records. The request path only packs a record and copies it into
+the shared pages under a file lock.
+
+File layout (little-endian):
+    header          HEADER_SIZE bytes:
+        magic       8 bytes, b'IPSPOOL1'
+        slot size   uint32
+        slot count  uint32
+        epoch       uint64, random, new for every spool file
+        write seq   uint64, sequence number of the next record
+        read seq    uint64, first record not yet drained
+        overflow    uint64, records dropped because the spool was full
+    slots           slot count x slot size bytes
+
+Record n lives in slot ``n % slot count``. A slot starts with
+``SLOT_HEADER`` (n + 1 as a commit marker, payload length), followed by
+``RECORD`` and the UTF-8 strings. Strings that do not fit the slot are
+truncated, the user agent first.
+
+Writers hold an exclusive ``flock`` on the file (and a thread lock)
+while they append. They write the slot before they advance write seq,
+so a writer that dies halfway leaves nothing visible. When write seq is
+a full ring ahead of read seq, the record is dropped and counted in the
+overflow field, shared by all workers, and in metrics.
+
+Read offsets are crash-safe. The drain process inserts a batch and moves
+a ProcessingWatermark (named after the spool epoch, holding the read
+seq) in one database transaction. Only then does it copy the offset into
+the file header. After a crash it resumes from the larger of the two, so
+a record is inserted exactly once. Records the database rejects are
+found by splitting the batch, then dropped and counted, so one bad
+record never stalls the spool.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, transaction
+from django.utils import timezone
+
+from .fields import pack_ip, unpack_ip
+from .interning import encode_request_logs
+from .metrics import registry
+
+try:
+    import fcntl
+except ImportError:  # Windows: the spool is not available
+    fcntl = None
+
+MAGIC = b'IPSPOOL1'
+HEADER = struct.Struct('<8sIIQQQQ')
+HEADER_SIZE = 4096  # One page, so slots stay page-aligned
+WRITE_SEQ_OFFSET = 24
+READ_SEQ_OFFSET = 32
+OVERFLOW_OFFSET = 40
+U64 = struct.Struct('<Q')
+SEQS = struct.Struct('<QQ')  # write seq, read seq
+
+SLOT_HEADER = struct.Struct('<QH')
+# timestamp, packed ip, sample weight, flags, then the byte length of
+# method, path, user agent, country and city
+RECORD = struct.Struct('<d16sIBBHHHH')
+
+FLAG_GEO_PENDING = 1
+FLAG_NO_USER_AGENT = 2
+FLAG_NO_COUNTRY = 4
+FLAG_NO_CITY = 8
+
+SLOT_SIZE = 1024
+DEFAULT_SLOTS = 32768  # 32 MiB
+DEFAULT_DRAIN_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class SpoolError(Exception):
+    """Raised for unusable spool files or a second drain process."""
+
+
+def encode_record(fields, slot_size=SLOT_SIZE):
+    """
+    Pack one RequestLog record for the spool.
+
+    Args:
+        fields (dict): RequestLog field values, as queued by the pipeline
+        slot_size (int): Slot size of the spool
+
+    Returns:
+        bytes: Payload of at most slot_size - SLOT_HEADER.size bytes
+    """
+    user_agent_value = fields.get('user_agent')
+    country_value = fields.get('country')
+    city_value = fields.get('city')
+
+    method = fields['method'].encode()[:10]
+    path = fields['path'].encode()
+    user_agent = user_agent_value.encode() if user_agent_value else b''
+    country = country_value.encode()[:400] if country_value else b''
+    city = city_value.encode()[:400] if city_value else b''
+    room = (slot_size - SLOT_HEADER.size - RECORD.size
+            - len(method) - len(country) - len(city))
+    if len(path) + len(user_agent) > room:
+        path = path[:room]
+        user_agent = user_agent[:room - len(path)]
+
+    flags = (
+        (FLAG_GEO_PENDING if fields.get('geo_pending') else 0)
+        | (FLAG_NO_USER_AGENT if user_agent_value is None else 0)
+        | (FLAG_NO_COUNTRY if country_value is None else 0)
+        | (FLAG_NO_CITY if city_value is None else 0)
+    )
+    timestamp = fields.get('timestamp')
+    return RECORD.pack(
+        timestamp.timestamp() if timestamp else time.time(),
+        pack_ip(fields['ip_address']),
+        fields.get('sample_weight', 1),
+        flags,
+        len(method), len(path), len(user_agent), len(country), len(city),
+    ) + method + path + user_agent + country + city
+
+
+def decode_record(payload):
+    """
+    Unpack a spool payload into RequestLog field values.
+
+    Args:
+        payload (bytes): Output of ``encode_record()``
+
+    Returns:
+        dict: Field values for ``RequestLog(**fields)``
+    """
+    timestamp, packed, weight, flags, *lengths = RECORD.unpack_from(payload)
+    strings, offset = [], RECORD.size
+    for length in lengths:
+        # A cut may split a multi-byte character; drop the fragment
+        strings.append(
+            payload[offset:offset + length].decode('utf-8', 'ignore')
+        )
+        offset += length
+    method, path, user_agent, country, city = strings
+
+    when = datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+    if not settings.USE_TZ:
+        when = timezone.make_naive(when)
+    return {
+        'ip_address': unpack_ip(packed),
+        'timestamp': when,
+        'method': method,
+        'path': path,
+        'user_agent': None if flags & FLAG_NO_USER_AGENT else user_agent,
+        'country': None if flags & FLAG_NO_COUNTRY else country,
+        'city': None if flags & FLAG_NO_CITY else city,
+        'geo_pending': bool(flags & FLAG_GEO_PENDING),
+        'sample_weight': weight,
+    }
+
+
+class LogSpool:
+    """
+    One process's handle on the shared spool file.
+
+    The file is created on first use, and mapped again after a fork,
+    because a ``flock`` inherited through fork would not exclude the
+    parent.
+
+    Args:
+        path (str or Path): Spool file (default: IP_TRACKING_LOG_SPOOL)
+        slots (int): Slot count when creating the file
+            (default: IP_TRACKING_LOG_SPOOL_SLOTS)
+    """
+
+    def __init__(self, path=None, slots=None):
+        self.path = path or getattr(settings, 'IP_TRACKING_LOG_SPOOL', None)
+        self.slots = slots or getattr(
+            settings, 'IP_TRACKING_LOG_SPOOL_SLOTS', DEFAULT_SLOTS
+        )
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._fd = None
+        self._map = None
+        self._drain_lock = None
+
+    @property
+    def enabled(self):
+        """True if a spool file is configured."""
+        return bool(self.path)
+
+    def add(self, **fields):
+        """
+        Append one RequestLog record.
+
+        Args:
+            **fields: RequestLog field values (ip_address, path, ...)
+
+        Returns:
+            bool: True if spooled, False if the spool was full
+        """
+        self._open()
+        payload = encode_record(fields, self.slot_size)
+        data = self._map
+        # The hot path: the lock is taken inline, without _locked()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                write_seq, read_seq = SEQS.unpack_from(data, WRITE_SEQ_OFFSET)
+                if write_seq - read_seq >= self.slot_count:
+                    overflow = U64.unpack_from(data, OVERFLOW_OFFSET)[0]
+                    U64.pack_into(data, OVERFLOW_OFFSET, overflow + 1)
+                    registry.inc('ip_tracking_log_spool_overflow_total')
+                    return False
+                offset = (HEADER_SIZE
+                          + (write_seq % self.slot_count) * self.slot_size)
+                start = offset + SLOT_HEADER.size
+                data[start:start + len(payload)] = payload
+                SLOT_HEADER.pack_into(data, offset, write_seq + 1,
+                                      len(payload))
+                # Publish last: readers never look past write seq
+                U64.pack_into(data, WRITE_SEQ_OFFSET, write_seq + 1)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return True
+
+    def read(self, start, limit):
+        """
+        Read spooled records without consuming them.
+
+        Args:
+            start (int): Sequence number to start from; raised to the
+                file's read seq if it is behind
+            limit (int): Max records to return
+
+        Returns:
+            tuple: (list of field dicts, sequence number after the last)
+        """
+        self._open()
+        with self._locked():
+            write_seq, read_seq = SEQS.unpack_from(self._map, WRITE_SEQ_OFFSET)
+        # Writers leave slots from read seq up to write seq alone, so
+        # they can be read without the lock
+        start = max(start, read_seq)
+        end = min(write_seq, start + limit)
+        records = []
+        for seq in range(start, end):
+            offset = HEADER_SIZE + (seq % self.slot_count) * self.slot_size
+            marker, length = SLOT_HEADER.unpack_from(self._map, offset)
+            if marker != seq + 1:
+                logger.warning('Skipping unreadable spool slot %d in %s',
+                               seq, self.path)
+                continue
+            start_at = offset + SLOT_HEADER.size
+            records.append(decode_record(self._map[start_at:start_at + length]))
+        return records, end
+
+    def commit(self, seq):
+        """Free every slot before ``seq`` for writers."""
+        self._open()
+        with self._locked():
+            if seq > U64.unpack_from(self._map, READ_SEQ_OFFSET)[0]:
+                U64.pack_into(self._map, READ_SEQ_OFFSET, seq)
+
+    def stats(self):
+        """
+        Return the shared spool counters.
+
+        Returns:
+            dict: slots, slot_size, written, drained, pending, overflow
+        """
+        self._open()
+        with self._locked():
+            _, _, _, _, write_seq, read_seq, overflow = HEADER.unpack_from(
+                self._map
+            )
+        return {
+            'slots': self.slot_count,
+            'slot_size': self.slot_size,
+            'written': write_seq,
+            'drained': read_seq,
+            'pending': write_seq - read_seq,
+            'overflow': overflow,
+        }
+
+    @property
+    def watermark_name(self):
+        """ProcessingWatermark holding the drained read seq of this file."""
+        self._open()
+        return f'log_spool:{self.epoch:016x}'
+
+    def acquire_drain_lock(self):
+        """
+        Make this process the spool's only consumer.
+
+        Raises:
+            SpoolError: If another process is draining the spool
+        """
+        lock = open(f'{self.path}.drain.lock', 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            raise SpoolError(f'Another process is draining {self.path}')
+        # Held until the process exits
+        self._drain_lock = lock
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _open(self):
+        """Map the spool file in this process, creating it if needed."""
+        if self._pid == os.getpid():
+            return
+        if fcntl is None:
+            raise SpoolError('The log spool needs fcntl (POSIX only)')
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if not os.path.exists(self.path):
+                self._create()
+            spool_file = open(self.path, 'r+b')
+            if os.fstat(spool_file.fileno()).st_size < HEADER_SIZE:
+                spool_file.close()
+                raise SpoolError(f'Not a log spool file: {self.path}')
+            data = mmap.mmap(spool_file.fileno(), 0)
+            magic, slot_size, slot_count, epoch = HEADER.unpack_from(data)[:4]
+            if magic != MAGIC or len(data) != (
+                HEADER_SIZE + slot_size * slot_count
+            ):
+                data.close()
+                spool_file.close()
+                raise SpoolError(f'Not a log spool file: {self.path}')
+            self.slot_size, self.slot_count, self.epoch = (
+                slot_size, slot_count, epoch
+            )
+            self._file, self._map = spool_file, data
+            self._fd = spool_file.fileno()
+            self._pid = os.getpid()
+
+    def _create(self):
+        """Write a new, empty spool file, replacing nothing."""
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(
+                MAGIC, SLOT_SIZE, self.slots,
+                int.from_bytes(os.urandom(8), 'little'), 0, 0, 0
+            ))
+            # Sparse: pages are allocated as slots are first written
+            f.truncate(HEADER_SIZE + SLOT_SIZE * self.slots)
+        try:
+            # Fails if another worker created the file first
+            os.link(tmp_path, self.path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+
+
+def drain_spool(spool, batch_size=DEFAULT_DRAIN_BATCH_SIZE):
+    """
+    Move one batch of records from the spool into RequestLog.
+
+    Args:
+        spool (LogSpool): Spool to drain (the caller holds its drain lock)
+        batch_size (int): Max records to insert
+
+    Returns:
+        dict: Records read, rows inserted and records rejected
+    """
+    from .models import ProcessingWatermark
+
+    watermark, _ = ProcessingWatermark.objects.get_or_create(
+        name=spool.watermark_name
+    )
+    records, end = spool.read(watermark.last_id, batch_size)
+    # Interned outside the transaction, so a rollback never leaves ids
+    # of rolled-back lookup rows in the interner's cache
+    batch = list(encode_request_logs(records))
+
+    written = rejected = 0
+    if end > watermark.last_id:
+        with transaction.atomic():
+            moved = ProcessingWatermark.objects.filter(
+                pk=watermark.pk, last_id=watermark.last_id
+            ).update(last_id=end, updated_at=timezone.now())
+            if not moved:
+                raise SpoolError(f'Spool offset moved under us: {spool.path}')
+            written, rejected = _insert_isolating(batch, batch_size)
+    # After the commit: a crash before this line is repaired by the
+    # watermark on the next read
+    spool.commit(end)
+
+    registry.inc('ip_tracking_log_spool_drained_total', written)
+    if rejected:
+        registry.inc('ip_tracking_log_records_rejected_total', rejected)
+    return {'read': len(batch), 'inserted': written, 'rejected': rejected}
+
+
+def _insert_isolating(batch, batch_size):
+    """
+    Insert encoded records, splitting the parts the database rejects.
+
+    Each part is inserted in its own savepoint. A part that fails is
+    split in halves until the rejected records are found; those are
+    dropped. Connection errors are raised, so the whole batch is retried
+    on the next drain.
+
+    Returns:
+        tuple: (rows inserted, records rejected)
+    """
+    from .models import RequestLog
+
+    written = rejected = 0
+    parts = [batch]  # stack: the next part to insert is on top
+    while parts:
+        part = parts.pop()
+        try:
+            with transaction.atomic():
+                RequestLog.objects.bulk_create(
+                    [RequestLog(**fields) for fields in part],
+                    batch_size=batch_size
+                )
+            written += len(part)
+        except (InterfaceError, OperationalError):
+            raise
+        except Exception as exc:
+            if len(part) > 1:
+                middle = len(part) // 2
+                parts.append(part[middle:])
+                parts.append(part[:middle])
+                continue
+            rejected += 1
+            logger.warning('Dropped a spooled RequestLog record the '
+                           'database rejected: %s', exc)
+    return written, rejected
+
+
+# Shared per-process spool used by the pipeline (if configured)
+log_spool = LogSpool()
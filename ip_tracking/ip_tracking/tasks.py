@@ -1,43 +1,82 @@
-from celery import shared_task
-from django.utils import timezone
-from datetime import timedelta
-from .models import RequestLog, SuspiciousIP
+from celery import chord, shared_task
+from .detection import (
+    detect_shard, get_shard_count, merge_detection, plan_detection,
+    run_detection
+)
+from .enrichment import enrich_pending_logs, enrichment_status
+from .retention import purge_all
+from .rollups import rollup_request_logs as run_rollups
 
 
 @shared_task
-def detect_anomalies():
-    # Define sensitive paths
-    sensitive_paths = ['/admin', '/login']
-
-    # Get time window (last 1 hour)
-    one_hour_ago = timezone.now() - timedelta(hours=1)
-
-    # Get all IPs with requests in the last hour
-    recent_logs = RequestLog.objects.filter(timestamp__gte=one_hour_ago)
-
-    # Group by IP and count requests
-    ip_request_counts = recent_logs.values('ip_address').annotate(
-        request_count=models.Count('id')
-    )
-
-    # Check for IPs exceeding 100 requests/hour
-    for ip_data in ip_request_counts:
-        ip = ip_data['ip_address']
-        count = ip_data['request_count']
-        if count > 100:
-            # Check if IP is already flagged
-            if not SuspiciousIP.objects.filter(ip_address=ip).exists():
-                SuspiciousIP.objects.create(
-                    ip_address=ip,
-                    reason=f"Exceeded 100 requests/hour: {count} requests"
-                )
-
-    # Check for IPs accessing sensitive paths
-    sensitive_logs = recent_logs.filter(path__in=sensitive_paths)
-    for log in sensitive_logs:
-        ip = log.ip_address
-        if not SuspiciousIP.objects.filter(ip_address=ip).exists():
-            SuspiciousIP.objects.create(
-                ip_address=ip,
-                reason=f"Accessed sensitive path: {log.path}"
-            )
\ No newline at end of file
+def detect_anomalies(shards=None):
+    """
+    Flag IPs over the request threshold or matching a detection rule.
+
+    Incremental: only RequestLog rows added since the previous run are
+    read, and per-IP counts live in one-minute buckets (see
+    detection.py), so it is cheap to run every minute.
+
+    With more than one shard (IP_TRACKING_DETECTION_SHARDS) the work is
+    fanned out as a chord: one detect_anomalies_shard task per IP-hash
+    shard, then merge_anomaly_shards once all of them are done.
+    """
+    shards = shards or get_shard_count()
+    if shards == 1:
+        return run_detection()
+
+    plan = plan_detection()
+    chord(
+        detect_anomalies_shard.s(plan, shard, shards)
+        for shard in range(shards)
+    )(merge_anomaly_shards.s(plan))
+    return {'planned': plan, 'shards': shards}
+
+
+@shared_task
+def detect_anomalies_shard(plan, shard, shards):
+    """Update the buckets of one IP-hash shard and return its offenders."""
+    return detect_shard(plan, shard, shards)
+
+
+@shared_task
+def merge_anomaly_shards(shard_results, plan):
+    """Advance the watermark and flag the offenders of every shard."""
+    return merge_detection(plan, shard_results)
+
+
+@shared_task
+def enrich_request_logs(batch_size=200):
+    """
+    Backfill country/city on RequestLog rows queued by the middleware.
+
+    Returns the work done plus the remaining backlog size and lag, so
+    the result backend and worker logs show how far behind it is.
+    """
+    result = enrich_pending_logs(batch_size=batch_size)
+    status = enrichment_status()
+    result['pending_rows'] = status['pending_rows']
+    result['lag_seconds'] = status['lag_seconds']
+    return result
+
+
+@shared_task
+def rollup_request_logs():
+    """
+    Fold new RequestLog rows into the hourly RequestLogHourly rollups.
+
+    detect_anomalies already does this on every run; this task is for
+    deployments that want rollups (and reports) without detection.
+    """
+    return run_rollups()
+
+
+@shared_task
+def purge_request_logs(chunk_size=5000, sleep=0.1):
+    """
+    Delete rows past their retention window (IP_TRACKING_RETENTION_DAYS).
+
+    Returns one report per table with rows deleted, time taken and
+    rows per second.
+    """
+    return purge_all(chunk_size=chunk_size, sleep=sleep)
@@ -0,0 +1,63 @@
+"""
+Tests for the ip_tracking app.
+
+Test cases derive from ``TrackingTestCase``, which runs against a
+local-memory cache, so the suite needs no Redis server. The few tests
+that exercise the Redis Lua scripts connect to ``REDIS_TEST_URL`` and
+are skipped when no server answers there.
+"""
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from ip_tracking.blocklist import blocklist
+from ip_tracking.interning import paths, user_agents
+from ip_tracking.rules import detection_rules
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ip-tracking-tests',
+    }
+}
+
+# Database 15, so a local development Redis keeps its data
+REDIS_TEST_URL = 'redis://127.0.0.1:6379/15'
+
+REDIS_CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': REDIS_TEST_URL,
+    }
+}
+
+
+def redis_available():
+    """Check that a Redis server answers at REDIS_TEST_URL."""
+    try:
+        import redis
+
+        return redis.Redis.from_url(
+            REDIS_TEST_URL, socket_connect_timeout=0.5
+        ).ping()
+    except Exception:
+        return False
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TrackingTestCase(TestCase):
+    """
+    TestCase that starts every test with empty per-process state.
+
+    The blocklist snapshot, the compiled detection rules and the path
+    and user agent interners outlive a test's rolled-back transaction,
+    so they are reset along with the cache.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        paths.clear()
+        user_agents.clear()
+        blocklist.invalidate()
+        detection_rules.refresh(force=True)
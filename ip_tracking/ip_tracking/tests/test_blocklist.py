@@ -0,0 +1,150 @@
+"""
+Tests for the in-process blocklist snapshot and the CIDR range index.
+"""
+
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+
+from ip_tracking.blocklist import (
+    NetworkIndex, blocklist, bump_blocklist_version, get_blocklist_version,
+    parse_block_target
+)
+from ip_tracking.models import BlockedIP, BlockedNetwork
+
+from . import TrackingTestCase
+
+
+@override_settings(IP_TRACKING_BLOCKLIST_REFRESH_SECONDS=60)
+class BlocklistSnapshotTests(TrackingTestCase):
+    """The in-process snapshot and its cross-worker version key."""
+
+    def test_blocks_active_ips_and_ranges(self):
+        BlockedIP.objects.create(ip_address='192.0.2.10')
+        BlockedIP.objects.create(ip_address='192.0.2.11', is_active=False)
+        BlockedNetwork.objects.create(network='203.0.113.0/24')
+
+        self.assertTrue(blocklist.is_blocked('192.0.2.10'))
+        self.assertFalse(blocklist.is_blocked('192.0.2.11'))
+        self.assertTrue(blocklist.is_blocked('203.0.113.200'))
+        self.assertFalse(blocklist.is_blocked('203.0.114.1'))
+
+    def test_serves_lookups_from_memory(self):
+        BlockedIP.objects.create(ip_address='192.0.2.10')
+        blocklist.is_blocked('192.0.2.10')
+
+        with self.assertNumQueries(0):
+            for _ in range(100):
+                self.assertTrue(blocklist.is_blocked('192.0.2.10'))
+
+    def test_saving_a_block_bumps_the_version_on_commit(self):
+        before = get_blocklist_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            block = BlockedIP.objects.create(ip_address='192.0.2.10')
+            block.unblock()
+            BlockedNetwork.objects.create(network='198.51.100.0/24')
+            # Not before the commit, or workers could reload without it
+            self.assertEqual(get_blocklist_version(), before)
+        self.assertEqual(len(callbacks), 3)
+        self.assertEqual(get_blocklist_version(), before + 3)
+
+    def test_reloads_only_when_the_version_changes(self):
+        blocklist.is_blocked('192.0.2.10')
+        BlockedIP.objects.create(ip_address='192.0.2.10')
+
+        # Within the refresh interval the old snapshot is still served
+        self.assertFalse(blocklist.is_blocked('192.0.2.10'))
+
+        blocklist.refresh(force=True)
+        self.assertTrue(blocklist.is_blocked('192.0.2.10'))
+
+        # The interval elapsed but nothing changed: no reload
+        blocklist._next_check = 0.0
+        with self.assertNumQueries(0):
+            blocklist.is_blocked('192.0.2.10')
+
+    def test_another_worker_sees_a_change_after_the_interval(self):
+        blocklist.is_blocked('192.0.2.10')
+        # Written by another process: only the shared version moves
+        BlockedIP.objects.bulk_create([BlockedIP(ip_address='192.0.2.10')])
+        bump_blocklist_version()
+
+        blocklist._next_check = 0.0
+        self.assertTrue(blocklist.is_blocked('192.0.2.10'))
+
+    def test_temporary_blocks_lapse_without_a_reload(self):
+        block = BlockedIP.block_temporarily('192.0.2.20', 60)
+        self.assertTrue(blocklist.is_blocked('192.0.2.20'))
+
+        later = block.expires_at.timestamp() + 1
+        with mock.patch('time.time', return_value=later), \
+                self.assertNumQueries(0):
+            self.assertFalse(blocklist.is_blocked('192.0.2.20'))
+
+    def test_block_ip_makes_an_expired_temporary_block_permanent(self):
+        BlockedIP.objects.create(
+            ip_address='192.0.2.30',
+            expires_at=timezone.now() - timedelta(minutes=5),
+        )
+
+        call_command('block_ip', '192.0.2.30', stdout=StringIO())
+
+        block = BlockedIP.objects.get(ip_address='192.0.2.30')
+        self.assertTrue(block.is_active)
+        self.assertIsNone(block.expires_at)
+        self.assertTrue(blocklist.is_blocked('192.0.2.30'))
+
+
+class NetworkIndexTests(SimpleTestCase):
+    """Longest-prefix-match lookups over merged intervals."""
+
+    def test_matches_addresses_inside_ranges_only(self):
+        index = NetworkIndex(['10.0.0.0/8', '192.0.2.128/25', '2001:db8::/32'])
+
+        self.assertIn('10.255.255.255', index)
+        self.assertIn('192.0.2.200', index)
+        self.assertIn('2001:db8::1', index)
+        self.assertNotIn('11.0.0.0', index)
+        self.assertNotIn('192.0.2.127', index)
+        self.assertNotIn('2001:db9::1', index)
+        self.assertNotIn('not-an-ip', index)
+
+    def test_merges_overlapping_and_adjacent_ranges(self):
+        index = NetworkIndex([
+            '10.0.0.0/24', '10.0.1.0/24', '10.0.0.128/25', '10.0.3.0/24',
+        ])
+
+        self.assertEqual(len(index), 2)
+        self.assertIn('10.0.1.255', index)
+        self.assertNotIn('10.0.2.0', index)
+        self.assertIn('10.0.3.0', index)
+
+    def test_ipv4_mapped_addresses_match_ipv4_ranges(self):
+        index = NetworkIndex(['198.51.100.0/24'])
+        self.assertIn('::ffff:198.51.100.7', index)
+
+    def test_empty_index(self):
+        index = NetworkIndex()
+        self.assertEqual(len(index), 0)
+        self.assertNotIn('10.0.0.1', index)
+
+
+class ParseBlockTargetTests(SimpleTestCase):
+    """Routing block_ip arguments to BlockedIP or BlockedNetwork."""
+
+    def test_ranges_and_addresses(self):
+        model, lookup, value = parse_block_target('10.1.2.3/8')
+        self.assertIs(model, BlockedNetwork)
+        self.assertEqual(value, '10.0.0.0/8')
+
+        model, lookup, value = parse_block_target(' 10.1.2.3 ')
+        self.assertIs(model, BlockedIP)
+        self.assertEqual(lookup, {'ip_address': '10.1.2.3'})
+
+    def test_invalid_targets(self):
+        with self.assertRaises(ValueError):
+            parse_block_target('not-an-ip')
@@ -0,0 +1,86 @@
+"""
+Tests for bulk blocking and unblocking from IP lists.
+"""
+
+from unittest import mock
+
+from django.db import IntegrityError
+
+from ip_tracking import bulk
+from ip_tracking.blocklist import get_blocklist_version
+from ip_tracking.bulk import bulk_block, bulk_unblock, read_targets
+from ip_tracking.models import BlockedIP, BlockedNetwork
+
+from . import TrackingTestCase
+
+
+class BulkBlockTests(TrackingTestCase):
+    """Diffed batch writes and the reports they return."""
+
+    def test_reports_each_kind_of_change(self):
+        BlockedIP.objects.create(ip_address='192.0.2.1')
+        BlockedIP.objects.create(ip_address='192.0.2.2', is_active=False)
+
+        report = bulk_block(
+            read_targets(['192.0.2.1', '192.0.2.2  # again', '192.0.2.3',
+                          '198.51.100.0/24', 'nope', '']),
+            batch_size=2,
+        )
+
+        self.assertEqual(
+            {key: report[key] for key in
+             ('processed', 'created', 'reactivated', 'unchanged')},
+            {'processed': 5, 'created': 2, 'reactivated': 1, 'unchanged': 1}
+        )
+        self.assertEqual(report['invalid'], ['nope'])
+        self.assertTrue(BlockedNetwork.objects.filter(
+            network='198.51.100.0/24').exists())
+
+    def test_rows_inserted_meanwhile_are_not_counted_as_created(self):
+        # Another process blocked 192.0.2.2 after the diff
+        BlockedIP.objects.create(ip_address='192.0.2.2')
+        created = bulk._create_missing(
+            BlockedIP, {'192.0.2.1', '192.0.2.2'}, 100
+        )
+        self.assertEqual(created, 1)
+        self.assertEqual(BlockedIP.objects.count(), 2)
+
+    def test_other_integrity_errors_are_raised(self):
+        with mock.patch.object(BlockedIP.objects, 'bulk_create',
+                               side_effect=IntegrityError('bad row')):
+            with self.assertRaises(IntegrityError):
+                bulk._create_missing(BlockedIP, {'192.0.2.1'}, 100)
+
+    def test_version_is_bumped_once_on_commit(self):
+        before = get_blocklist_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            bulk_block(['192.0.2.1', '192.0.2.2'], batch_size=1)
+            self.assertEqual(get_blocklist_version(), before)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(get_blocklist_version(), before + 1)
+
+    def test_unchanged_run_does_not_bump_the_version(self):
+        BlockedIP.objects.create(ip_address='192.0.2.1')
+        with self.captureOnCommitCallbacks() as callbacks:
+            bulk_block(['192.0.2.1'])
+            bulk_unblock(['192.0.2.9'])
+        self.assertEqual(callbacks, [])
+
+    def test_failed_run_still_bumps_for_the_batches_it_wrote(self):
+        def values():
+            yield '192.0.2.1'
+            raise OSError('read error')
+
+        with self.captureOnCommitCallbacks() as callbacks, \
+                self.assertRaises(OSError):
+            bulk_block(values(), batch_size=1)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_unblock_reports_and_bumps(self):
+        BlockedIP.objects.create(ip_address='192.0.2.1')
+        with self.captureOnCommitCallbacks() as callbacks:
+            report = bulk_unblock(['192.0.2.1', '192.0.2.2'])
+        self.assertEqual((report['unblocked'], report['not_blocked']),
+                         (1, 1))
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(BlockedIP.objects.get().is_active)
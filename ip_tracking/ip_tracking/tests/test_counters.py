@@ -0,0 +1,90 @@
+"""
+Tests for the real-time per-IP sliding-window counter.
+"""
+
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.test import override_settings
+
+from ip_tracking import counters
+from ip_tracking.counters import SlidingWindowCounter
+
+from . import (
+    REDIS_CACHES, REDIS_TEST_URL, TrackingTestCase, redis_available
+)
+
+
+class SlidingWindowCounterTests(TrackingTestCase):
+    """The two-window estimate, shared through the cache or per process."""
+
+    def test_estimate_weights_the_previous_window(self):
+        counter = SlidingWindowCounter(60)
+        for expected in (1, 2, 3):
+            self.assertEqual(counter.hit('192.0.2.1', now=120), expected)
+
+        # Halfway through the next window: 3 * 0.5 + 1
+        self.assertEqual(counter.hit('192.0.2.1', now=210), 2.5)
+        # Two windows later the old count no longer weighs in
+        self.assertEqual(counter.hit('192.0.2.1', now=300), 1)
+
+    def test_counts_are_shared_through_the_cache(self):
+        first, second = SlidingWindowCounter(60), SlidingWindowCounter(60)
+        first.hit('192.0.2.1', now=120)
+        self.assertEqual(second.hit('192.0.2.1', now=120), 2)
+
+    def test_local_counts_match_the_shared_ones(self):
+        counter = SlidingWindowCounter(60, use_cache=False)
+        for _ in range(3):
+            counter.hit('192.0.2.1', now=120)
+        self.assertEqual(counter.hit('192.0.2.1', now=210), 2.5)
+        self.assertIsNone(cache.get(counter._key('192.0.2.1', 2)))
+
+    def test_previous_counts_are_read_once_and_bounded(self):
+        counter = SlidingWindowCounter(60)
+        with mock.patch.object(counters, 'MAX_PREVIOUS_MEMO', 2):
+            for ip in ('192.0.2.1', '192.0.2.2', '192.0.2.3'):
+                counter.hit(ip, now=120)
+
+        self.assertEqual(list(counter._previous), ['192.0.2.2', '192.0.2.3'])
+
+    def test_cache_errors_fall_back_to_local_counts(self):
+        counter = SlidingWindowCounter(60)
+        with mock.patch.object(counter, '_cache_incr',
+                               side_effect=ConnectionError):
+            self.assertEqual(counter.hit('192.0.2.1', now=120), 1)
+            self.assertEqual(counter.hit('192.0.2.1', now=120), 2)
+        self.assertEqual(counter.fallbacks, 2)
+
+    async def test_async_hit_counts_locally_without_redis(self):
+        counter = SlidingWindowCounter(60)
+        self.assertFalse(counter.async_store.available)
+
+        self.assertEqual(await counter.ahit('192.0.2.1', now=120), 1)
+        self.assertEqual(await counter.ahit('192.0.2.1', now=120), 2)
+        self.assertEqual(counter.local.get('192.0.2.1', 2), 2)
+
+
+@skipUnless(redis_available(), f'No Redis server at {REDIS_TEST_URL}')
+@override_settings(CACHES=REDIS_CACHES)
+class RedisCounterTests(TrackingTestCase):
+    """The increment script, against a real Redis server."""
+
+    def setUp(self):
+        from django_redis import get_redis_connection
+
+        super().setUp()
+        self.redis = get_redis_connection()
+        self.redis.flushdb()
+        self.addCleanup(self.redis.flushdb)
+
+    async def test_async_counter_shares_counts_with_sync_workers(self):
+        counter = SlidingWindowCounter(60)
+        self.assertTrue(counter.async_store.available)
+        for _ in range(3):
+            counter.hit('192.0.2.1', now=120)
+
+        self.assertEqual(await counter.ahit('192.0.2.1', now=150), 4)
+        # Halfway through the next window: 4 * 0.5 + 1
+        self.assertEqual(await counter.ahit('192.0.2.1', now=210), 3)
+        self.assertEqual(counter.fallbacks, 0)
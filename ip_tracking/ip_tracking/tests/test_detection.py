@@ -0,0 +1,159 @@
+"""
+Tests for incremental anomaly detection.
+"""
+
+from datetime import timedelta
+
+from django.test import override_settings
+from django.utils import timezone
+
+from ip_tracking.detection import (
+    detect_shard, find_rule_hits, merge_detection, plan_detection,
+    run_detection
+)
+from ip_tracking.models import (
+    DetectionRule, IPRequestBucket, ProcessingWatermark, RequestLog, RequestLogHourly,
+    SuspiciousIP
+)
+from ip_tracking.rules import detection_rules
+from ip_tracking.watermarks import settled_max_id
+
+from . import TrackingTestCase
+
+
+@override_settings(IP_TRACKING_WATERMARK_LAG_SECONDS=0,
+                   IP_TRACKING_ANOMALY_THRESHOLD=4)
+class DetectionTests(TrackingTestCase):
+    """Sharded detection runs over per-minute buckets."""
+
+    def setUp(self):
+        super().setUp()
+        for i in range(12):
+            ip = f'192.0.2.{i}'
+            RequestLog.objects.bulk_create([
+                RequestLog(ip_address=ip, path='/products/')
+                for _ in range(i)
+            ])
+
+    def flagged(self):
+        return dict(SuspiciousIP.objects.values_list('ip_address', 'reason'))
+
+    def reset(self):
+        for model in (SuspiciousIP, IPRequestBucket, ProcessingWatermark,
+                      RequestLogHourly):
+            model.objects.all().delete()
+
+    def test_flags_ips_over_the_threshold(self):
+        result = run_detection()
+        self.assertEqual(result['rows_processed'], 66)
+
+        flagged = self.flagged()
+        self.assertEqual(sorted(flagged),
+                         sorted(f'192.0.2.{i}' for i in range(5, 12)))
+        self.assertEqual(flagged['192.0.2.5'],
+                         'Exceeded 4 requests/60 min: 5 requests')
+
+    def test_runs_only_read_new_rows(self):
+        run_detection()
+        self.assertEqual(run_detection()['rows_processed'], 0)
+
+        RequestLog.objects.bulk_create([
+            RequestLog(ip_address='192.0.2.4', path='/products/')
+        ])
+        self.assertEqual(run_detection()['rows_processed'], 1)
+        self.assertIn('192.0.2.4', self.flagged())
+
+    def test_buckets_outside_the_window_are_evicted(self):
+        run_detection()
+        buckets = IPRequestBucket.objects.count()
+        IPRequestBucket.objects.update(
+            bucket_start=timezone.now() - timedelta(hours=2)
+        )
+
+        self.assertEqual(run_detection()['buckets_evicted'], buckets)
+        self.assertFalse(IPRequestBucket.objects.exists())
+
+    def test_shard_count_does_not_change_the_outcome(self):
+        run_detection(shards=1)
+        single = self.flagged()
+        self.reset()
+
+        result = run_detection(shards=4)
+        self.assertEqual(result['shards'], 4)
+        self.assertEqual(result['rows_processed'], 66)
+        self.assertEqual(self.flagged(), single)
+
+    def test_shards_never_share_an_ip(self):
+        plan = plan_detection()
+        results = [detect_shard(plan, shard, 3) for shard in range(3)]
+
+        offenders = [set(result['offenders']) for result in results]
+        self.assertEqual(sum(map(len, offenders)),
+                         len(set().union(*offenders)))
+        self.assertEqual(sum(r['rows_processed'] for r in results), 66)
+
+        # A retried shard writes the same absolute counts
+        self.assertEqual(detect_shard(plan, 1, 3)['offenders'],
+                         results[1]['offenders'])
+
+        merge_detection(plan, results)
+        self.assertEqual(
+            ProcessingWatermark.objects.get(name='anomaly_detection').last_id,
+            plan['end']
+        )
+
+    def test_flags_ips_matching_a_rule(self):
+        # Matches the /login rule seeded by migration 0010
+        RequestLog.objects.create(ip_address='198.51.100.1', path='/login')
+        self.assertEqual(run_detection()['rows_processed'], 67)
+        self.assertEqual(self.flagged()['198.51.100.1'],
+                         'Matched rule Sensitive path /login: 1 request')
+
+    def test_rule_thresholds_count_rolled_up_requests(self):
+        DetectionRule.objects.create(name='exports', match_type='glob',
+                                     pattern='/api/*/export', threshold=3)
+        detection_rules.refresh(force=True)
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        for ip, count in (('203.0.113.1', 3), ('203.0.113.2', 2)):
+            RequestLogHourly.objects.create(
+                hour=hour, ip_address=ip, path='/api/v1/export',
+                method='GET', country='', request_count=count
+            )
+
+        self.assertEqual(find_rule_hits(), {
+            '203.0.113.1': 'Matched rule exports: 3 requests',
+        })
+
+
+@override_settings(IP_TRACKING_WATERMARK_LAG_SECONDS=10)
+class SettledMaxIdTests(TrackingTestCase):
+    """The lagging upper bound of incremental job watermarks."""
+
+    def age_observation(self, name, seconds=20):
+        ProcessingWatermark.objects.filter(name=f'{name}:seen').update(
+            updated_at=timezone.now() - timedelta(seconds=seconds)
+        )
+
+    def test_ids_settle_after_the_lag(self):
+        first = RequestLog.objects.create(ip_address='192.0.2.1', path='/')
+
+        # The first observation, then one too recent to use
+        self.assertEqual(settled_max_id('job'), 0)
+        RequestLog.objects.create(ip_address='192.0.2.1', path='/')
+        self.assertEqual(settled_max_id('job'), 0)
+
+        self.age_observation('job')
+        self.assertEqual(settled_max_id('job'), first.pk)
+
+    def test_jobs_keep_separate_observations(self):
+        RequestLog.objects.create(ip_address='192.0.2.1', path='/')
+        settled_max_id('job')
+        self.age_observation('job')
+
+        self.assertEqual(settled_max_id('other'), 0)
+        self.assertNotEqual(settled_max_id('job'), 0)
+
+    @override_settings(IP_TRACKING_WATERMARK_LAG_SECONDS=0)
+    def test_no_lag_returns_the_current_maximum(self):
+        log = RequestLog.objects.create(ip_address='192.0.2.1', path='/')
+        self.assertEqual(settled_max_id('job'), log.pk)
@@ -0,0 +1,45 @@
+"""
+Tests for packed 16-byte IP address storage.
+"""
+
+from ip_tracking.fields import canonical_ip, ip_shard_key, pack_ip, unpack_ip
+from ip_tracking.models import RequestLog
+
+from . import TrackingTestCase
+
+
+class AddressCanonicalisationTests(TrackingTestCase):
+    """Packed 16-byte storage and the canonical string form."""
+
+    def test_ipv4_mapped_addresses_are_stored_as_ipv4(self):
+        self.assertEqual(canonical_ip('::ffff:192.0.2.1'), '192.0.2.1')
+        self.assertEqual(pack_ip('::ffff:192.0.2.1'), pack_ip('192.0.2.1'))
+        self.assertEqual(ip_shard_key('::ffff:192.0.2.1'),
+                         ip_shard_key('192.0.2.1'))
+
+    def test_ipv6_is_compressed(self):
+        self.assertEqual(canonical_ip('2001:0DB8:0000::0001'), '2001:db8::1')
+        self.assertEqual(unpack_ip(pack_ip('2001:db8::1')), '2001:db8::1')
+
+    def test_invalid_addresses_are_rejected(self):
+        for value in ('999.1.1.1', 'not-an-ip', ''):
+            with self.assertRaises(ValueError):
+                pack_ip(value)
+
+    def test_lookups_match_every_spelling(self):
+        RequestLog.objects.create(ip_address='::ffff:192.0.2.1', path='/')
+
+        log = RequestLog.objects.get(ip_address='192.0.2.1')
+        self.assertEqual(log.ip_address, '192.0.2.1')
+        self.assertTrue(
+            RequestLog.objects.filter(ip_address='::ffff:192.0.2.1').exists()
+        )
+
+    def test_in_network_lookup(self):
+        for ip in ('192.0.2.1', '192.0.2.255', '192.0.3.0', '2001:db8::1'):
+            RequestLog.objects.create(ip_address=ip, path='/')
+
+        found = RequestLog.objects.filter(
+            ip_address__in_network='192.0.2.0/24'
+        ).values_list('ip_address', flat=True)
+        self.assertEqual(sorted(found), ['192.0.2.1', '192.0.2.255'])
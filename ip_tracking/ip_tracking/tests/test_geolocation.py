@@ -0,0 +1,54 @@
+"""
+Tests for local geolocation and the reload of its database file.
+"""
+
+import os
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ip_tracking import geolocation
+from ip_tracking.geolocation import GeoDatabase, GeoLocator, parse_range
+
+
+class GeoLocatorReloadTests(SimpleTestCase):
+    """The async path never touches the database file itself."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'geo.bin')
+        GeoDatabase.build([
+            parse_range('192.0.2.0', '192.0.2.255') + ('KE', 'Nairobi'),
+        ]).save(self.path)
+        self.locator = GeoLocator(self.path, http_fallback=False)
+
+    def test_sync_lookups_load_the_file(self):
+        self.assertEqual(self.locator.locate_local('192.0.2.1'),
+                         {'country': 'KE', 'city': 'Nairobi'})
+
+    async def test_memory_lookups_leave_the_file_to_areload(self):
+        loop_thread = threading.get_ident()
+        stat_threads = []
+        real_stat = os.stat
+
+        def stat(path, *args, **kwargs):
+            stat_threads.append(threading.get_ident())
+            return real_stat(path, *args, **kwargs)
+
+        with mock.patch.object(geolocation.os, 'stat', stat):
+            # Not loaded yet: answered from memory, the file is untouched
+            self.assertEqual(self.locator.locate_memory('192.0.2.1'),
+                             {'country': None, 'city': None})
+            self.assertEqual(stat_threads, [])
+
+            self.assertTrue(self.locator.needs_reload())
+            await self.locator.areload()
+
+        self.assertEqual(len(stat_threads), 1)
+        self.assertNotEqual(stat_threads[0], loop_thread)
+        self.assertFalse(self.locator.needs_reload())
+        self.assertEqual(self.locator.locate_memory('192.0.2.1'),
+                         {'country': 'KE', 'city': 'Nairobi'})
@@ -0,0 +1,74 @@
+"""
+Tests for the batched RequestLog write buffer.
+"""
+
+from unittest import mock
+
+from django.db import OperationalError
+
+from ip_tracking.log_buffer import RequestLogBuffer
+from ip_tracking.models import RequestLog
+
+from . import TrackingTestCase
+
+
+class RequestLogBufferTests(TrackingTestCase):
+    """Batched writes, requeues and rejected rows."""
+
+    def setUp(self):
+        super().setUp()
+        self.buffer = RequestLogBuffer(batch_size=100, max_size=10,
+                                       flush_seconds=3600)
+
+    def add(self, count, ip='192.0.2.1'):
+        for _ in range(count):
+            self.buffer.add(ip_address=ip, path='/', method='GET')
+
+    def test_flush_writes_the_batch_in_one_insert(self):
+        self.add(1)
+        self.buffer.flush()  # the path is looked up once
+
+        self.add(5)
+        # One INSERT, inside its savepoint
+        with self.assertNumQueries(3):
+            self.assertEqual(self.buffer.flush(), 5)
+
+        self.assertEqual(RequestLog.objects.count(), 6)
+        stats = self.buffer.stats()
+        self.assertEqual((stats['written'], stats['pending']), (6, 0))
+
+    def test_records_over_the_size_limit_are_dropped(self):
+        self.add(12)
+        self.assertEqual(len(self.buffer), 10)
+        self.assertEqual(self.buffer.stats()['dropped'], 2)
+
+    def test_batch_is_requeued_while_the_database_is_down(self):
+        self.add(3)
+        with mock.patch.object(self.buffer, '_insert',
+                               side_effect=OperationalError('down')):
+            self.assertEqual(self.buffer.flush(), 0)
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.buffer), 3)
+
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(self.buffer.stats()['errors'], 2)
+
+    def test_rejected_records_are_dropped_after_a_failed_retry(self):
+        self.add(3)
+        self.add(1, ip='not-an-ip')
+        self.add(3)
+
+        # First failure: the whole batch waits for the next flush
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.buffer), 7)
+
+        with self.assertLogs('ip_tracking.log_buffer', 'WARNING'):
+            self.assertEqual(self.buffer.flush(), 6)
+        self.assertEqual(RequestLog.objects.count(), 6)
+        self.assertEqual(self.buffer.stats()['rejected'], 1)
+        self.assertEqual(len(self.buffer), 0)
+
+        # Back to normal: a new failure is retried again first
+        self.add(1, ip='not-an-ip')
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.buffer), 1)
@@ -0,0 +1,66 @@
+"""
+Tests for the metrics registry and the per-worker export.
+"""
+
+from unittest import mock
+
+from django.core.cache import cache
+
+from ip_tracking import metrics
+from ip_tracking.metrics import MetricsRegistry, collect, merge, render
+
+from . import TrackingTestCase
+
+
+class MetricsTests(TrackingTestCase):
+    """Snapshots published by each worker and merged for scraping."""
+
+    def worker(self, worker_id, requests):
+        registry = MetricsRegistry()
+        registry.worker_id = worker_id
+        # No publisher thread: the test publishes explicitly
+        registry._publisher = object()
+        registry.inc('ip_tracking_requests_total', requests)
+        registry.observe('ip_tracking_stage_duration_seconds', 0.001,
+                         stage='resolve_ip')
+        registry.publish()
+        return registry
+
+    def test_each_worker_keeps_its_own_series(self):
+        snapshot = merge({
+            'a:1': {'counters': [['ip_tracking_requests_total', [], 3]],
+                    'histograms': []},
+            'b:2': {'counters': [['ip_tracking_requests_total', [], 4]],
+                    'histograms': []},
+        })
+        text = render(snapshot)
+
+        self.assertIn('ip_tracking_requests_total{worker="a:1"} 3', text)
+        self.assertIn('ip_tracking_requests_total{worker="b:2"} 4', text)
+
+    def test_a_departed_worker_never_lowers_another_workers_count(self):
+        first = self.worker('host:1', 5)
+        self.worker('host:2', 7)
+        local = self.worker('host:3', 1)
+
+        with mock.patch.object(metrics, 'registry', local):
+            before = render(collect())
+            cache.delete(metrics.SNAPSHOT_KEY_PREFIX + first.worker_id)
+            after = render(collect())
+
+        self.assertIn('ip_tracking_requests_total{worker="host:1"} 5',
+                      before)
+        self.assertNotIn('worker="host:1"', after)
+        self.assertIn('ip_tracking_requests_total{worker="host:2"} 7',
+                      after)
+        self.assertIn(
+            'ip_tracking_stage_duration_seconds_count'
+            '{stage="resolve_ip",worker="host:2"} 1',
+            after
+        )
+
+    def test_local_scope_has_no_worker_label(self):
+        local = self.worker('host:1', 2)
+        with mock.patch.object(metrics, 'registry', local):
+            text = render(collect('local'))
+        self.assertIn('ip_tracking_requests_total 2', text)
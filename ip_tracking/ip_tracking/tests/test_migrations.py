@@ -0,0 +1,135 @@
+"""
+Tests for the data migrations that convert existing rows.
+"""
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+
+class MigrationTestCase(TransactionTestCase):
+    """
+    Migrates back to ``migrate_from`` before each test, and forward to
+    the latest migration afterwards.
+    """
+
+    migrate_from = None
+    migrate_to = None
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        self.addCleanup(self.migrate_to_latest)
+        executor.migrate(self.migrate_from)
+        self.old_apps = executor.loader.project_state(self.migrate_from).apps
+
+    def migrate_to_latest(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def migrate(self):
+        """Run the migrations under test and return the new app registry."""
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.migrate_to)
+        return executor.loader.project_state(self.migrate_to).apps
+
+
+class PackedIPAddressMigrationTests(MigrationTestCase):
+    """0006 packs IP addresses into 16 bytes."""
+
+    migrate_from = [('ip_tracking', '0005_requestloghourly')]
+    migrate_to = [('ip_tracking', '0006_packed_ip_addresses')]
+
+    def test_addresses_are_canonicalised(self):
+        RequestLog = self.old_apps.get_model('ip_tracking', 'RequestLog')
+        for ip in ('::ffff:192.0.2.1', '2001:0db8::1', '192.0.2.1'):
+            RequestLog.objects.create(ip_address=ip, path='/')
+
+        apps = self.migrate()
+        RequestLog = apps.get_model('ip_tracking', 'RequestLog')
+
+        self.assertEqual(
+            list(RequestLog.objects.order_by('pk').values_list(
+                'ip_address', flat=True
+            )),
+            ['192.0.2.1', '2001:db8::1', '192.0.2.1']
+        )
+
+    def test_duplicate_spellings_are_merged(self):
+        Hourly = self.old_apps.get_model('ip_tracking', 'RequestLogHourly')
+        BlockedIP = self.old_apps.get_model('ip_tracking', 'BlockedIP')
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        for ip, count in (('192.0.2.1', 3), ('::ffff:192.0.2.1', 4)):
+            Hourly.objects.create(hour=hour, ip_address=ip, path='/',
+                                  method='GET', country='',
+                                  request_count=count)
+        BlockedIP.objects.create(ip_address='192.0.2.9')
+        BlockedIP.objects.create(ip_address='::ffff:192.0.2.9')
+
+        apps = self.migrate()
+        Hourly = apps.get_model('ip_tracking', 'RequestLogHourly')
+        BlockedIP = apps.get_model('ip_tracking', 'BlockedIP')
+
+        self.assertEqual(
+            list(Hourly.objects.values_list('ip_address', 'request_count')),
+            [('192.0.2.1', 7)]
+        )
+        self.assertEqual(
+            list(BlockedIP.objects.values_list('ip_address', flat=True)),
+            ['192.0.2.9']
+        )
+
+
+class InternedStringsMigrationTests(MigrationTestCase):
+    """0007 moves paths and user agents into lookup tables."""
+
+    migrate_from = [('ip_tracking', '0006_packed_ip_addresses')]
+    migrate_to = [('ip_tracking', '0007_interned_strings')]
+
+    def test_strings_are_stored_once(self):
+        RequestLog = self.old_apps.get_model('ip_tracking', 'RequestLog')
+        for path, agent in [('/login', 'agent-a'), ('/login', None),
+                            ('/admin/', 'agent-a')]:
+            RequestLog.objects.create(ip_address='192.0.2.1', path=path,
+                                      user_agent=agent)
+
+        apps = self.migrate()
+        RequestLog = apps.get_model('ip_tracking', 'RequestLog')
+        RequestPath = apps.get_model('ip_tracking', 'RequestPath')
+        UserAgent = apps.get_model('ip_tracking', 'UserAgent')
+
+        rows = RequestLog.objects.order_by('pk').values_list(
+            'path_ref__value', 'user_agent_ref__value'
+        )
+        self.assertEqual(list(rows), [
+            ('/login', 'agent-a'), ('/login', None), ('/admin/', 'agent-a'),
+        ])
+        self.assertEqual(RequestPath.objects.count(), 2)
+        self.assertEqual(UserAgent.objects.count(), 1)
+
+
+class WholeHourWindowsMigrationTests(MigrationTestCase):
+    """0011 rounds detection rule windows up to whole hours."""
+
+    migrate_from = [('ip_tracking', '0010_detection_rules')]
+    migrate_to = [('ip_tracking', '0011_detection_rule_whole_hours')]
+
+    def test_windows_are_rounded_up(self):
+        DetectionRule = self.old_apps.get_model('ip_tracking',
+                                                'DetectionRule')
+        DetectionRule.objects.all().delete()
+        for name, window in (('short', 600), ('odd', 5400), ('day', 86400),
+                             ('none', 0)):
+            DetectionRule.objects.create(name=name, pattern='/',
+                                         window_seconds=window)
+
+        apps = self.migrate()
+        DetectionRule = apps.get_model('ip_tracking', 'DetectionRule')
+
+        self.assertEqual(
+            dict(DetectionRule.objects.values_list('name',
+                                                   'window_seconds')),
+            {'short': 3600, 'odd': 7200, 'day': 86400, 'none': 3600}
+        )
@@ -0,0 +1,155 @@
+"""
+Tests for the tracking pipeline and its stages.
+"""
+
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from ip_tracking import pipeline as pipeline_module
+from ip_tracking.log_buffer import RequestLogBuffer
+from ip_tracking.models import (
+    BlockedIP, BlockedNetwork, RequestLog, SuspiciousIP
+)
+from ip_tracking.pipeline import (
+    BlockCheckStage, GeoEnrichStage, LogEmitStage, RateCountStage,
+    ResolveIPStage, Stage, TrackingPipeline, get_client_ip
+)
+
+from . import TrackingTestCase
+
+
+class FailingStage(Stage):
+    name = 'failing'
+
+    def process(self, context):
+        raise RuntimeError('broken stage')
+
+
+@override_settings(IP_TRACKING_LOG_SAMPLING=[])
+class TrackingPipelineTests(TrackingTestCase):
+    """Sync and async runs of one pipeline over the same stages."""
+
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+        self.emit = LogEmitStage()
+        # Flushed by the tests, never by the background thread
+        self.emit.sink = RequestLogBuffer(batch_size=1000,
+                                          flush_seconds=3600)
+        self.pipeline = TrackingPipeline([
+            ResolveIPStage(), BlockCheckStage(), self.emit,
+        ])
+
+    def request(self, ip='192.0.2.1', path='/products/', **extra):
+        return self.factory.get(path, REMOTE_ADDR=ip,
+                                HTTP_USER_AGENT='test-agent', **extra)
+
+    def test_logs_one_record_per_request(self):
+        self.assertIsNone(self.pipeline.run(self.request()))
+        self.assertEqual(self.emit.sink.flush(), 1)
+
+        log = RequestLog.objects.get()
+        self.assertEqual(log.ip_address, '192.0.2.1')
+        self.assertEqual(log.path, '/products/')
+        self.assertEqual(log.method, 'GET')
+        self.assertEqual(log.user_agent, 'test-agent')
+        self.assertEqual(log.sample_weight, 1)
+
+    def test_blocked_ips_and_ranges_get_403_and_are_not_logged(self):
+        BlockedIP.objects.create(ip_address='192.0.2.66')
+        BlockedNetwork.objects.create(network='198.51.100.0/24')
+
+        for ip in ('192.0.2.66', '198.51.100.9', '::ffff:198.51.100.9'):
+            response = self.pipeline.run(self.request(ip))
+            self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.emit.sink.flush(), 0)
+
+        stats = self.pipeline.stats()
+        self.assertEqual(stats['block_check']['calls'], 3)
+        self.assertEqual(stats['log_emit']['calls'], 0)
+
+    async def test_async_run_matches_sync_run(self):
+        await BlockedIP.objects.acreate(ip_address='192.0.2.66')
+
+        response = await self.pipeline.arun(self.request('192.0.2.66'))
+        self.assertEqual(response.status_code, 403)
+        self.assertIsNone(await self.pipeline.arun(self.request()))
+        self.assertEqual(len(self.emit.sink), 1)
+
+    def test_failing_stage_is_skipped(self):
+        pipeline = TrackingPipeline([ResolveIPStage(), FailingStage(),
+                                     self.emit])
+
+        with self.assertLogs('ip_tracking.pipeline', 'ERROR'):
+            self.assertIsNone(pipeline.run(self.request()))
+        self.assertEqual(pipeline.stats()['failing']['errors'], 1)
+        self.assertEqual(len(self.emit.sink), 1)
+
+    def test_requests_without_a_valid_address_are_not_logged(self):
+        self.pipeline.run(self.request(ip='unknown'))
+        self.assertEqual(len(self.emit.sink), 0)
+
+
+@override_settings(IP_TRACKING_RATE_COUNTER='local',
+                   IP_TRACKING_ANOMALY_THRESHOLD=3)
+class RateCountStageTests(TrackingTestCase):
+    """Inline flagging by the real-time counter."""
+
+    def setUp(self):
+        super().setUp()
+        self.pipeline = TrackingPipeline([ResolveIPStage(), RateCountStage()])
+
+    def request(self, ip='192.0.2.7'):
+        return RequestFactory().get('/', REMOTE_ADDR=ip)
+
+    def test_flags_an_ip_once_over_the_threshold(self):
+        for _ in range(3):
+            self.pipeline.run(self.request())
+        self.assertFalse(SuspiciousIP.objects.exists())
+
+        for _ in range(3):
+            self.pipeline.run(self.request())
+        self.assertEqual(
+            list(SuspiciousIP.objects.values_list('ip_address', flat=True)),
+            ['192.0.2.7']
+        )
+
+    async def test_requests_without_an_address_skip_counting_and_geo(self):
+        rate = RateCountStage()
+        pipeline = TrackingPipeline([ResolveIPStage(), rate,
+                                     GeoEnrichStage()])
+        with mock.patch.object(rate.counter, 'hit') as hit, \
+                mock.patch.object(rate.counter, 'ahit') as ahit, \
+                mock.patch.object(pipeline_module, 'geolocator') as geo:
+            for _ in range(5):
+                await sync_to_async(pipeline.run)(self.request(ip='unknown'))
+                await pipeline.arun(self.request(ip='unknown'))
+
+        hit.assert_not_called()
+        ahit.assert_not_called()
+        self.assertEqual(geo.mock_calls, [])
+
+
+class ClientIPTests(SimpleTestCase):
+    """Address resolution for the tracking pipeline."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_first_forwarded_address_wins(self):
+        request = self.factory.get(
+            '/', REMOTE_ADDR='10.0.0.1',
+            HTTP_X_FORWARDED_FOR='::ffff:203.0.113.5, 10.0.0.2'
+        )
+        self.assertEqual(get_client_ip(request), '203.0.113.5')
+
+    def test_invalid_forwarded_header_falls_back_to_remote_addr(self):
+        request = self.factory.get('/', REMOTE_ADDR='10.0.0.1',
+                                   HTTP_X_FORWARDED_FOR='unknown')
+        self.assertEqual(get_client_ip(request), '10.0.0.1')
+
+    def test_missing_address(self):
+        request = self.factory.get('/', REMOTE_ADDR='')
+        self.assertIsNone(get_client_ip(request))
@@ -0,0 +1,207 @@
+"""
+Tests for the sliding-window rate limiter and its Redis Lua script.
+"""
+
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ImproperlyConfigured
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django_ratelimit.exceptions import Ratelimited
+
+from ip_tracking import ratelimit as ratelimit_module
+from ip_tracking.ratelimit import (
+    Limit, LocalBackend, RedisBackend, check, get_ip_key, parse_rate
+)
+from ip_tracking.views import login_view
+
+from . import (
+    REDIS_CACHES, REDIS_TEST_URL, TrackingTestCase, redis_available
+)
+
+# Nothing listens on port 1
+UNREACHABLE_REDIS_CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:1/0',
+    }
+}
+
+
+class ParseRateTests(SimpleTestCase):
+
+    def test_rates(self):
+        self.assertEqual(parse_rate('5/m'), (5, 60))
+        self.assertEqual(parse_rate('100/h'), (100, 3600))
+        self.assertEqual(parse_rate('10/5m'), (10, 300))
+        self.assertEqual(parse_rate(' 1/d '), (1, 86400))
+
+    def test_invalid_rates(self):
+        for rate in ('five/m', '5/w', '5', '/m'):
+            with self.assertRaises(ValueError):
+                parse_rate(rate)
+
+
+class LocalBackendTests(SimpleTestCase):
+    """In-process counters used by tests and as the Redis fallback."""
+
+    def test_counts_current_and_previous_windows(self):
+        backend = LocalBackend()
+        backend.hit([('w0', 'w-1', 10)], now=0)
+        self.assertEqual(backend.hit([('w1', 'w0', 10), ('v1', 'v0', 10)],
+                                     now=5),
+                         [(1, 1), (1, 0)])
+
+    def test_counters_expire(self):
+        backend = LocalBackend()
+        backend.hit([('w0', 'w-1', 10)], now=0)
+        self.assertEqual(backend.hit([('w0', 'w-1', 10)], now=11), [(1, 0)])
+
+
+@mock.patch.object(ratelimit_module, '_backend', new_callable=LocalBackend)
+class CheckTests(SimpleTestCase):
+    """Limits checked against a fresh in-process backend."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def request(self, ip='192.0.2.1', method='get', **extra):
+        return getattr(self.factory, method)('/', REMOTE_ADDR=ip, **extra)
+
+    def test_sliding_window_estimate(self, backend):
+        limit = Limit('ip', '2/m', group='test')
+        for _ in range(2):
+            self.assertEqual(check(self.request(), [limit], now=120), [])
+        self.assertEqual(check(self.request(), [limit], now=120), [limit])
+
+        # Halfway through the next minute: 3 * 0.5 + 1
+        self.assertEqual(check(self.request(), [limit], now=210), [limit])
+        self.assertEqual(check(self.request(), [limit], now=290), [])
+
+    def test_ip_key_ignores_forwarded_headers(self, backend):
+        limit = Limit('ip', '1/m', group='test')
+        check(self.request(HTTP_X_FORWARDED_FOR='203.0.113.1'), [limit])
+        exceeded = check(
+            self.request(HTTP_X_FORWARDED_FOR='203.0.113.2'), [limit]
+        )
+        self.assertEqual(exceeded, [limit])
+
+    def test_ipv6_addresses_are_masked(self, backend):
+        limit = Limit('ip', '1/m', group='test')
+        check(self.request('2001:db8::1'), [limit])
+        self.assertEqual(check(self.request('2001:db8::2'), [limit]), [limit])
+        self.assertEqual(get_ip_key(self.request('2001:db8::2')),
+                         '2001:db8::')
+
+    def test_empty_remote_addr_is_a_configuration_error(self, backend):
+        with self.assertRaises(ImproperlyConfigured):
+            get_ip_key(self.request(ip=''))
+
+    def test_callable_keys_get_the_group(self, backend):
+        groups = []
+
+        def key(group, request):
+            groups.append(group)
+            return 'everyone'
+
+        check(self.request(), [Limit(key, '5/m', group='api')])
+        self.assertEqual(groups, ['api'])
+
+    def test_limits_skip_other_methods_and_missing_keys(self, backend):
+        limits = [Limit('ip', '1/m', group='post', method='POST'),
+                  Limit('get:token', '1/m', group='token')]
+        for _ in range(3):
+            self.assertEqual(check(self.request(), limits), [])
+        self.assertEqual(backend._counters, {})
+
+    def test_groups_count_separately(self, backend):
+        first = Limit('ip', '1/m', group='first')
+        second = Limit('ip', '1/m', group='second')
+        check(self.request(), [first])
+        self.assertEqual(check(self.request(), [first, second]), [first])
+
+
+@mock.patch.object(ratelimit_module, '_backend', new_callable=LocalBackend)
+class LoginRateLimitTests(SimpleTestCase):
+    """The stacked limits of the login view."""
+
+    def post(self):
+        request = RequestFactory().post(
+            '/login/', {'username': 'nobody', 'password': 'wrong'},
+            REMOTE_ADDR='192.0.2.1'
+        )
+        request.user = AnonymousUser()
+        return request
+
+    def test_sixth_attempt_in_a_minute_is_rejected(self, backend):
+        with mock.patch('ip_tracking.views.authenticate', return_value=None):
+            for _ in range(5):
+                request = self.post()
+                self.assertEqual(login_view(request).status_code, 401)
+                self.assertFalse(request.limited)
+
+            request = self.post()
+            with self.assertRaises(Ratelimited):
+                login_view(request)
+        self.assertTrue(request.limited)
+
+    def test_both_limits_share_one_backend_call(self, backend):
+        with mock.patch.object(backend, 'hit',
+                               wraps=backend.hit) as hit, \
+                mock.patch('ip_tracking.views.authenticate',
+                           return_value=None):
+            login_view(self.post())
+        hit.assert_called_once()
+        self.assertEqual(len(hit.call_args.args[0]), 2)
+
+    @override_settings(RATELIMIT_ENABLE=False)
+    def test_can_be_disabled(self, backend):
+        with mock.patch('ip_tracking.views.authenticate', return_value=None):
+            for _ in range(10):
+                self.assertEqual(login_view(self.post()).status_code, 401)
+
+
+class RedisFallbackTests(SimpleTestCase):
+    """Requests are still limited, per process, while Redis is down."""
+
+    @override_settings(CACHES=UNREACHABLE_REDIS_CACHES)
+    def test_unreachable_redis_counts_in_process(self):
+        backend = RedisBackend()
+        windows = [('w1', 'w0', 120)]
+        self.assertEqual(backend.hit(windows), [(1, 0)])
+        self.assertEqual(backend.hit(windows), [(2, 0)])
+
+
+@skipUnless(redis_available(), f'No Redis server at {REDIS_TEST_URL}')
+@override_settings(CACHES=REDIS_CACHES)
+class RedisScriptTests(TrackingTestCase):
+    """The Lua script, against a real Redis server."""
+
+    def setUp(self):
+        from django_redis import get_redis_connection
+
+        super().setUp()
+        self.redis = get_redis_connection()
+        self.redis.flushdb()
+        self.addCleanup(self.redis.flushdb)
+
+    def test_rate_limit_script_counts_every_limit_in_one_call(self):
+        backend = RedisBackend()
+        self.redis.set('a0', 4)
+        windows = [('a1', 'a0', 120), ('b1', 'b0', 600)]
+
+        self.assertEqual(backend.hit(windows), [(1, 4), (1, 0)])
+        self.assertEqual(backend.hit(windows), [(2, 4), (2, 0)])
+        self.assertEqual(self.redis.ttl('a1'), 120)
+        self.assertEqual(self.redis.ttl('b1'), 600)
+        self.assertEqual(backend.local._counters, {})
+
+    def test_rate_limiter_shares_counts_between_processes(self):
+        limit = Limit('ip', '2/m', group='test')
+        request = RequestFactory().get('/', REMOTE_ADDR='192.0.2.1')
+        for _ in range(2):
+            with mock.patch.object(ratelimit_module, '_backend',
+                                   RedisBackend()):
+                self.assertEqual(check(request, [limit], now=120), [])
+        with mock.patch.object(ratelimit_module, '_backend', RedisBackend()):
+            self.assertEqual(check(request, [limit], now=120), [limit])
@@ -0,0 +1,93 @@
+"""
+Tests for the incremental hourly rollups.
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+from django.test import override_settings
+
+from ip_tracking.models import RequestLog, RequestLogHourly
+from ip_tracking.rollups import (
+    LOCK_KEY, reassign_countries, rollup_request_logs
+)
+
+from . import TrackingTestCase
+
+
+@override_settings(IP_TRACKING_WATERMARK_LAG_SECONDS=0)
+class RollupTests(TrackingTestCase):
+    """Incremental rollups into RequestLogHourly."""
+
+    def log(self, ip='192.0.2.1', path='/products/', **fields):
+        return RequestLog.objects.create(ip_address=ip, path=path, **fields)
+
+    def hourly(self):
+        return sorted(RequestLogHourly.objects.values_list(
+            'ip_address', 'path', 'country', 'request_count'
+        ))
+
+    def test_rolls_up_new_rows_once(self):
+        self.log()
+        self.log(sample_weight=10)
+        last = self.log(ip='192.0.2.2', country='KE')
+
+        result = rollup_request_logs()
+        self.assertEqual(result['rows_processed'], 3)
+        self.assertEqual(result['rollups_created'], 2)
+        self.assertEqual(result['last_id'], last.pk)
+        self.assertFalse(result['skipped'])
+        self.assertEqual(self.hourly(), [
+            ('192.0.2.1', '/products/', '', 11),
+            ('192.0.2.2', '/products/', 'KE', 1),
+        ])
+
+        self.assertEqual(rollup_request_logs()['rows_processed'], 0)
+
+        self.log()
+        result = rollup_request_logs()
+        self.assertEqual(result['rollups_updated'], 1)
+        self.assertEqual(self.hourly()[0][3], 12)
+
+    def test_small_batches_give_the_same_rollups(self):
+        for i in range(5):
+            self.log(ip=f'192.0.2.{i % 2}')
+
+        self.assertEqual(rollup_request_logs(batch_size=2)['rows_processed'],
+                         5)
+        self.assertEqual([row[3] for row in self.hourly()], [3, 2])
+
+    def test_skips_while_another_run_holds_the_lock(self):
+        self.log()
+        cache.add(LOCK_KEY, 'another-process')
+
+        result = rollup_request_logs()
+        self.assertTrue(result['skipped'])
+        self.assertEqual(result['rows_processed'], 0)
+        self.assertFalse(RequestLogHourly.objects.exists())
+
+    def test_resolved_countries_move_rolled_up_counts(self):
+        self.log(geo_pending=True)
+        self.log(geo_pending=True, sample_weight=4)
+        self.log(ip='192.0.2.2', geo_pending=True)
+        rollup_request_logs()
+
+        pending = RequestLog.objects.filter(geo_pending=True)
+        with transaction.atomic():
+            moved = reassign_countries(pending, {
+                '192.0.2.1': 'KE', '192.0.2.2': '',
+            })
+        self.assertEqual(moved, 5)
+        self.assertEqual(self.hourly(), [
+            ('192.0.2.1', '/products/', 'KE', 5),
+            ('192.0.2.2', '/products/', '', 1),
+        ])
+
+    def test_rows_not_rolled_up_yet_keep_their_counts(self):
+        self.log(geo_pending=True)
+        with transaction.atomic():
+            self.assertEqual(
+                reassign_countries(RequestLog.objects.all(),
+                                   {'192.0.2.1': 'KE'}),
+                0
+            )
+        self.assertFalse(RequestLogHourly.objects.exists())
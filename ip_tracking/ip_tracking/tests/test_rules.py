@@ -0,0 +1,141 @@
+"""
+Tests for detection rules and their compiled matcher.
+"""
+
+from types import SimpleNamespace
+
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase
+
+from ip_tracking.models import DetectionRule
+from ip_tracking.rules import (
+    RuleMatcher, detection_rules, get_rules_version
+)
+
+from . import TrackingTestCase
+
+
+def rule(match_type, pattern, method=''):
+    return SimpleNamespace(match_type=match_type, pattern=pattern,
+                           method=method)
+
+
+class RuleMatcherTests(SimpleTestCase):
+    """One pass over a path finds every matching rule."""
+
+    def setUp(self):
+        self.login = rule('exact', '/login', 'POST')
+        self.admin = rule('prefix', '/admin')
+        self.export = rule('glob', '/api/*/export')
+        self.user = rule('regex', r'/users/\d+/$')
+        self.matcher = RuleMatcher([self.login, self.admin, self.export,
+                                    self.user])
+
+    def test_each_match_type(self):
+        self.assertEqual(self.matcher.match('POST', '/login'), [self.login])
+        self.assertEqual(self.matcher.match('POST', '/login/'), [])
+        self.assertEqual(self.matcher.match('GET', '/admin/users/'),
+                         [self.admin])
+        self.assertEqual(self.matcher.match('GET', '/api/v2/export'),
+                         [self.export])
+        self.assertEqual(self.matcher.match('GET', '/api/v2/export.csv'), [])
+        self.assertEqual(self.matcher.match('GET', '/users/42/'), [self.user])
+        self.assertEqual(self.matcher.match('GET', '/products/'), [])
+
+    def test_method_restricted_rules(self):
+        self.assertEqual(self.matcher.match('GET', '/login'), [])
+
+    def test_every_match_is_returned_in_rule_order(self):
+        everything = rule('regex', '/')
+        api = rule('prefix', '/api/')
+        matcher = RuleMatcher([everything, self.export, api])
+        self.assertEqual(matcher.match('GET', '/api/v1/export'),
+                         [everything, self.export, api])
+
+    def test_invalid_patterns_are_skipped(self):
+        with self.assertLogs('ip_tracking.rules', 'WARNING'):
+            matcher = RuleMatcher([rule('regex', '('), self.admin])
+        self.assertEqual(len(matcher), 1)
+        self.assertEqual(matcher.match('GET', '/admin/'), [self.admin])
+
+    def test_flags_and_groups_do_not_leak_into_other_rules(self):
+        anycase = rule('regex', '(?i)/private')
+        doubled = rule('regex', r'/(a+)\1$')
+        named = rule('regex', r'/(?P<id>\d+)/(?P=id)$')
+        matcher = RuleMatcher([self.export, anycase, doubled, named,
+                               self.user])
+
+        self.assertEqual(matcher.match('GET', '/PRIVATE'), [anycase])
+        self.assertEqual(matcher.match('GET', '/aaaa'), [doubled])
+        self.assertEqual(matcher.match('GET', '/aaa'), [])
+        self.assertEqual(matcher.match('GET', '/7/7'), [named])
+        # The case-insensitive flag stays with its own rule
+        self.assertEqual(matcher.match('GET', '/API/v1/EXPORT'), [])
+        self.assertEqual(matcher.match('GET', '/users/42/'), [self.user])
+
+    def test_empty_rule_set(self):
+        self.assertFalse(RuleMatcher())
+        self.assertEqual(RuleMatcher().match('GET', '/'), [])
+
+
+class DetectionRuleTests(TrackingTestCase):
+    """Validation and live reloads of DetectionRule rows."""
+
+    def test_clean_rejects_bad_patterns(self):
+        for pattern in ('(', '/a)', '*'):
+            with self.assertRaises(ValidationError):
+                DetectionRule(name='bad', match_type='regex',
+                              pattern=pattern).clean()
+
+    def test_clean_accepts_inline_flags_and_backreferences(self):
+        for pattern in ('(?i)/admin', r'/(a)\1'):
+            DetectionRule(name='flags', match_type='regex',
+                          pattern=pattern).clean()
+
+    def test_clean_accepts_only_whole_hour_windows(self):
+        for window in (0, 600, 5400):
+            with self.assertRaises(ValidationError):
+                DetectionRule(name='short', pattern='/',
+                              window_seconds=window).clean()
+        DetectionRule(name='day', pattern='/', window_seconds=86400).clean()
+
+    def test_clean_normalizes_the_method(self):
+        rule = DetectionRule(name='posts', pattern='/', method='post')
+        rule.clean()
+        self.assertEqual(rule.method, 'POST')
+
+    def test_saving_a_rule_reaches_the_matcher(self):
+        DetectionRule.objects.create(name='exports', match_type='glob',
+                                     pattern='/api/*/export')
+        detection_rules.refresh(force=True)
+        self.assertEqual(
+            [r.name for r in detection_rules.matcher.match('GET',
+                                                           '/api/v1/export')],
+            ['exports']
+        )
+
+    def test_saving_a_rule_bumps_the_version_on_commit(self):
+        before = get_rules_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            rule = DetectionRule.objects.create(name='exports',
+                                                pattern='/export')
+            rule.delete()
+            self.assertEqual(get_rules_version(), before)
+        self.assertEqual(get_rules_version(), before + 2)
+
+    def test_rules_with_flags_still_compile_with_the_others(self):
+        DetectionRule.objects.create(name='private', match_type='regex',
+                                     pattern='(?i)/private')
+        DetectionRule.objects.create(name='repeats', match_type='regex',
+                                     pattern=r'/(a)\1')
+        detection_rules.refresh(force=True)
+        matcher = detection_rules.matcher
+
+        self.assertEqual([r.name for r in matcher.match('GET', '/Private')],
+                         ['private'])
+        self.assertEqual([r.name for r in matcher.match('GET', '/aa')],
+                         ['repeats'])
+        self.assertEqual(
+            [r.name for r in matcher.match('GET', '/admin/')],
+            ['Sensitive path /admin']
+        )
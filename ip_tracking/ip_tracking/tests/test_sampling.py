@@ -0,0 +1,67 @@
+"""
+Tests for per-path log sampling.
+"""
+
+import random
+
+from django.core.exceptions import ImproperlyConfigured
+
+from ip_tracking.models import DetectionRule
+from ip_tracking.rules import detection_rules
+from ip_tracking.sampling import LogSampler, weight_for_rate
+
+from . import TrackingTestCase
+
+
+class LogSamplerTests(TrackingTestCase):
+    """Per-path sampling rates and the weights of kept rows."""
+
+    RULES = [
+        {'prefix': '/static/', 'method': 'GET', 'rate': 0.01},
+        {'prefix': '/static/', 'rate': 0.5},
+        {'prefix': '/static/img/', 'rate': 0.1},
+    ]
+
+    def sampler(self, rules=RULES, exempt=None, seed=1):
+        return LogSampler(rules, exempt, random.Random(seed))
+
+    def test_rates_become_integer_weights(self):
+        self.assertEqual(weight_for_rate(1), 1)
+        self.assertEqual(weight_for_rate(0.01), 100)
+        self.assertEqual(weight_for_rate(0.3), 3)
+        with self.assertRaises(ImproperlyConfigured):
+            weight_for_rate(0)
+
+    def test_longest_prefix_then_method_specific_rule_wins(self):
+        sampler = self.sampler()
+        weights = {sampler.weight('GET', '/static/app.js') for _ in range(500)}
+        self.assertEqual(weights, {0, 100})
+
+        weights = {sampler.weight('POST', '/static/app.js')
+                   for _ in range(100)}
+        self.assertEqual(weights, {0, 2})
+
+        weights = {sampler.weight('GET', '/static/img/a.png')
+                   for _ in range(200)}
+        self.assertEqual(weights, {0, 10})
+
+    def test_unmatched_paths_are_always_logged(self):
+        sampler = self.sampler()
+        self.assertEqual(sampler.weight('GET', '/products/'), 1)
+        self.assertFalse(LogSampler())
+
+    def test_kept_weights_add_up_to_the_request_count(self):
+        sampler = self.sampler([{'prefix': '/health', 'rate': 0.1}], seed=7)
+        total = sum(sampler.weight('GET', '/health') for _ in range(20000))
+        self.assertAlmostEqual(total / 20000, 1, delta=0.1)
+
+    def test_paths_matched_by_a_detection_rule_are_never_sampled(self):
+        DetectionRule.objects.create(name='exports', match_type='glob',
+                                     pattern='/static/*/export')
+        detection_rules.refresh(force=True)
+        sampler = self.sampler(exempt=detection_rules)
+
+        for _ in range(50):
+            self.assertEqual(sampler.weight('GET', '/static/v1/export'), 1)
+        self.assertIn(0, {sampler.weight('GET', '/static/v1/list')
+                          for _ in range(50)})
@@ -0,0 +1,129 @@
+"""
+Tests for the shared-memory log spool and its drain.
+"""
+
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock, skipIf
+
+from django.utils import timezone
+
+from ip_tracking import spool as spool_module
+from ip_tracking.interning import encode_request_logs
+from ip_tracking.models import ProcessingWatermark, RequestLog
+from ip_tracking.spool import (
+    LogSpool, SpoolError, decode_record, drain_spool, encode_record
+)
+
+from . import TrackingTestCase
+
+
+@skipIf(spool_module.fcntl is None, 'The log spool needs fcntl')
+class LogSpoolTests(TrackingTestCase):
+    """The shared ring buffer file and its drain."""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'requests.spool')
+        self.spool = LogSpool(self.path, slots=4)
+
+    def record(self, **fields):
+        return dict({
+            'ip_address': '192.0.2.1', 'path': '/login', 'method': 'POST',
+            'user_agent': 'test-agent', 'country': None, 'city': None,
+            'geo_pending': True, 'sample_weight': 1,
+            'timestamp': timezone.now(),
+        }, **fields)
+
+    def test_records_round_trip(self):
+        fields = self.record(ip_address='2001:db8::1', user_agent=None,
+                             country='KE', city='Nairobi', geo_pending=False,
+                             sample_weight=10)
+        decoded = decode_record(encode_record(fields))
+
+        self.assertEqual(decoded, dict(fields, timestamp=decoded['timestamp']))
+        self.assertLess(
+            abs(decoded['timestamp'] - fields['timestamp']),
+            timedelta(milliseconds=1)
+        )
+
+    def test_long_strings_are_cut_to_the_slot(self):
+        fields = self.record(path='/' + 'p' * 2000, user_agent='u' * 2000)
+        decoded = decode_record(encode_record(fields, slot_size=256))
+        self.assertTrue(decoded['path'].startswith('/ppp'))
+        self.assertLess(len(decoded['path']) + len(decoded['user_agent']), 256)
+
+    def test_full_spool_drops_and_counts_records(self):
+        for _ in range(4):
+            self.assertTrue(self.spool.add(**self.record()))
+        self.assertFalse(self.spool.add(**self.record()))
+
+        stats = self.spool.stats()
+        self.assertEqual((stats['pending'], stats['overflow']), (4, 1))
+
+    def test_drain_inserts_each_record_once(self):
+        for i in range(3):
+            self.spool.add(**self.record(ip_address=f'192.0.2.{i}'))
+
+        inserted = [drain_spool(self.spool, batch_size=2)['inserted']
+                    for _ in range(3)]
+        self.assertEqual(inserted, [2, 1, 0])
+
+        self.assertEqual(
+            sorted(RequestLog.objects.values_list('ip_address', flat=True)),
+            ['192.0.2.0', '192.0.2.1', '192.0.2.2']
+        )
+        self.assertEqual(self.spool.stats()['pending'], 0)
+        self.assertEqual(
+            ProcessingWatermark.objects.get(
+                name=self.spool.watermark_name
+            ).last_id,
+            3
+        )
+
+    def test_drain_resumes_from_the_watermark_after_a_crash(self):
+        for _ in range(2):
+            self.spool.add(**self.record())
+        # Crash after the commit, before the offset reached the file
+        with mock.patch.object(self.spool, 'commit'):
+            self.assertEqual(drain_spool(self.spool)['inserted'], 2)
+        self.assertEqual(self.spool.stats()['pending'], 2)
+
+        self.assertEqual(drain_spool(self.spool)['read'], 0)
+        self.assertEqual(RequestLog.objects.count(), 2)
+
+    def test_rejected_records_are_dropped_and_the_rest_inserted(self):
+        for i in range(4):
+            self.spool.add(**self.record(ip_address=f'192.0.2.{i}'))
+
+        def encode(records):
+            rows = list(encode_request_logs(records))
+            # The database rejects this one: a negative weight
+            rows[2]['sample_weight'] = -1
+            return rows
+
+        with mock.patch.object(spool_module, 'encode_request_logs', encode), \
+                self.assertLogs('ip_tracking.spool', 'WARNING'):
+            result = drain_spool(self.spool)
+
+        self.assertEqual(result, {'read': 4, 'inserted': 3, 'rejected': 1})
+        self.assertEqual(
+            sorted(RequestLog.objects.values_list('ip_address', flat=True)),
+            ['192.0.2.0', '192.0.2.1', '192.0.2.3']
+        )
+        self.assertEqual(self.spool.stats()['pending'], 0)
+        self.assertEqual(drain_spool(self.spool)['read'], 0)
+
+    def test_only_one_drain_process(self):
+        self.spool.acquire_drain_lock()
+        with self.assertRaises(SpoolError):
+            LogSpool(self.path).acquire_drain_lock()
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a spool')
+        with self.assertRaises(SpoolError):
+            LogSpool(self.path).stats()
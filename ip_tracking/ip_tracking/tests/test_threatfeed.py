@@ -0,0 +1,143 @@
+"""
+Tests for the memory-mapped threat feed: Bloom filter plus exact entries.
+"""
+
+import gzip
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+
+from ip_tracking.fields import pack_ip
+from ip_tracking.threatfeed import (
+    ThreatFeed, ThreatFeedError, ThreatFeedFilter, build_threat_feed,
+    filter_size
+)
+
+
+class ThreatFeedTests(SimpleTestCase):
+    """Building a feed file and looking addresses up in it."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(self.directory, 'feed.bin')
+
+    def build(self, values, **kwargs):
+        report = build_threat_feed(values, self.path, **kwargs)
+        feed = ThreatFeed(self.path)
+        self.addCleanup(feed.close)
+        return report, feed
+
+    def test_listed_addresses_and_nothing_else(self):
+        report, feed = self.build([
+            '192.0.2.1', '2001:db8::1', '192.0.2.1', 'not-an-ip',
+        ])
+
+        self.assertEqual(
+            (report['entries'], report['duplicates'], report['invalid']),
+            (2, 1, 1)
+        )
+        self.assertEqual(len(feed), 2)
+        self.assertIn('192.0.2.1', feed)
+        self.assertIn('2001:0db8::0001', feed)
+        self.assertNotIn('192.0.2.2', feed)
+        self.assertNotIn('not-an-ip', feed)
+
+    def test_ipv4_mapped_addresses_match(self):
+        _, feed = self.build(['::ffff:198.51.100.7'])
+        self.assertIn('198.51.100.7', feed)
+        self.assertIn('::ffff:198.51.100.7', feed)
+
+    def test_false_positives_stay_near_the_target_rate(self):
+        listed = [f'10.0.{i // 256}.{i % 256}' for i in range(5000)]
+        _, feed = self.build(listed, false_positive_rate=0.01)
+
+        self.assertTrue(all(feed.might_contain(pack_ip(ip))
+                            for ip in listed[::50]))
+        misses = [pack_ip(f'172.16.{i // 256}.{i % 256}')
+                  for i in range(20000)]
+        rate = sum(map(feed.might_contain, misses)) / len(misses)
+        self.assertLess(rate, 0.02)
+        # Bloom filter false positives are never reported as listed
+        self.assertFalse(any(feed.contains_exact(packed)
+                             for packed in misses))
+
+    def test_filter_size(self):
+        bits, hashes = filter_size(1000, 0.001)
+        self.assertAlmostEqual(bits / 1000, 14.4, delta=0.1)
+        self.assertEqual(hashes, 10)
+
+    def test_empty_feed(self):
+        _, feed = self.build([])
+        self.assertEqual(len(feed), 0)
+        self.assertNotIn('192.0.2.1', feed)
+
+    def test_other_files_are_rejected(self):
+        for content in (b'', b'IPFEED0', b'not a feed at all, just text'):
+            with open(self.path, 'wb') as f:
+                f.write(content)
+            with self.assertRaises(ThreatFeedError):
+                ThreatFeed(self.path)
+
+    def test_truncated_files_are_rejected(self):
+        build_threat_feed(['192.0.2.1', '192.0.2.2'], self.path)
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        with self.assertRaises(ThreatFeedError):
+            ThreatFeed(self.path)
+
+    def test_filter_reloads_a_rebuilt_file(self):
+        build_threat_feed(['192.0.2.1'], self.path)
+        feed_filter = ThreatFeedFilter(self.path)
+        self.assertTrue(feed_filter.is_listed('192.0.2.1'))
+
+        build_threat_feed(['192.0.2.2'], self.path)
+        os.utime(self.path, (0, 0))
+        # Still within the reload check interval
+        self.assertTrue(feed_filter.is_listed('192.0.2.1'))
+
+        feed_filter._next_check = 0.0
+        self.assertFalse(feed_filter.is_listed('192.0.2.1'))
+        self.assertTrue(feed_filter.is_listed('192.0.2.2'))
+
+    def test_filter_keeps_the_old_feed_when_the_new_file_is_bad(self):
+        build_threat_feed(['192.0.2.1'], self.path)
+        feed_filter = ThreatFeedFilter(self.path)
+        feed_filter.is_listed('192.0.2.1')
+
+        # Replaced like build_threat_feed() does: the old mapping stays
+        bad = os.path.join(self.directory, 'bad.bin')
+        with open(bad, 'wb') as f:
+            f.write(b'garbage')
+        os.replace(bad, self.path)
+        os.utime(self.path, (0, 0))
+        feed_filter._next_check = 0.0
+        with self.assertLogs('ip_tracking.threatfeed', 'ERROR'):
+            self.assertTrue(feed_filter.is_listed('192.0.2.1'))
+
+    @override_settings(IP_TRACKING_THREAT_FEED=None)
+    def test_filter_without_a_feed_lists_nothing(self):
+        self.assertFalse(ThreatFeedFilter().is_listed('192.0.2.1'))
+        missing = ThreatFeedFilter(os.path.join(self.directory, 'missing'))
+        self.assertFalse(missing.is_listed('192.0.2.1'))
+
+    def test_build_command_reads_text_and_gzip_sources(self):
+        text = os.path.join(self.directory, 'feed.txt')
+        with open(text, 'w') as f:
+            f.write('# scanners\n192.0.2.1 # port scans\n198.51.100.0/24\n')
+        compressed = os.path.join(self.directory, 'feed.csv.gz')
+        with gzip.open(compressed, 'wt') as f:
+            f.write('2001:db8::1,2026-01-01\n')
+
+        call_command('build_threat_feed', text, compressed,
+                     output=self.path, stdout=StringIO())
+
+        feed = ThreatFeed(self.path)
+        self.addCleanup(feed.close)
+        self.assertEqual(len(feed), 2)
+        self.assertIn('192.0.2.1', feed)
+        self.assertIn('2001:db8::1', feed)
@@ -0,0 +1,288 @@
+"""
+Memory-mapped threat feed filter for multi-million-address blocklists.
+
+External threat-intel feeds list millions of addresses. They are far too
+many for BlockedIP rows or a per-worker Python set. The
+``build_threat_feed`` command compiles a feed into one file:
+
+- a Bloom filter over the addresses, a few bits each;
+- the same addresses as a sorted array of 16-byte packed keys (see
+  fields.py).
+
+Workers ``mmap`` the file read-only, so the operating system shares its
+pages between every process on the host. A request checks the Bloom
+filter first. Nearly every legitimate address is rejected there with a
+few bit tests, without touching the array. A Bloom hit is confirmed by
+a binary search of the sorted array, so a false positive never blocks
+anyone.
+
+File layout (little-endian header):
+    magic           8 bytes, b'IPFEED01'
+    hash count      uint32 (k)
+    reserved        uint32
+    bit count       uint64 (m)
+    entry count     uint64 (n)
+    bloom bits      m bits, padded to a multiple of 16 bytes
+    entries         n sorted, distinct 16-byte packed addresses
+
+Bit positions use double hashing over one BLAKE2b digest of the packed
+address: ``(h1 + i * h2) mod m`` for i in 0..k-1.
+"""
+
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+
+from .fields import pack_ip
+from .metrics import registry
+
+MAGIC = b'IPFEED01'
+HEADER = struct.Struct('<8sIIQQ')
+ENTRY_SIZE = 16
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FALSE_POSITIVE_RATE = 0.001
+
+# Seconds between checks for a rebuilt feed file
+RELOAD_CHECK_SECONDS = 60
+
+
+class ThreatFeedError(Exception):
+    """Raised for unreadable or invalid feed files."""
+
+
+def _bit_positions(packed, hash_count, bit_count):
+    digest = hashlib.blake2b(packed, digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return [(h1 + i * h2) % bit_count for i in range(hash_count)]
+
+
+def filter_size(entries, false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE):
+    """
+    Size a Bloom filter for a target false positive rate.
+
+    Args:
+        entries (int): Number of distinct addresses
+        false_positive_rate (float): Target rate, e.g. 0.001
+
+    Returns:
+        tuple: (bit count, hash count)
+    """
+    entries = max(entries, 1)
+    bits = math.ceil(
+        -entries * math.log(false_positive_rate) / (math.log(2) ** 2)
+    )
+    hashes = max(1, round(bits / entries * math.log(2)))
+    return bits, hashes
+
+
+def build_threat_feed(values, path,
+                      false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE):
+    """
+    Compile addresses into a feed file, replacing ``path`` atomically.
+
+    The builder keeps every packed address in memory to sort it (about
+    60 bytes per entry); workers only map the finished file.
+
+    Args:
+        values (iterable): IP address strings
+        path (str or Path): Destination file
+        false_positive_rate (float): Bloom filter target rate
+
+    Returns:
+        dict: entries, duplicates, invalid, bits, hashes, bytes, seconds
+    """
+    started = time.perf_counter()
+    packed, invalid = [], 0
+    for value in values:
+        try:
+            packed.append(pack_ip(value))
+        except ValueError:
+            invalid += 1
+    packed.sort()
+
+    entries = []
+    for key in packed:
+        if not entries or entries[-1] != key:
+            entries.append(key)
+    duplicates = len(packed) - len(entries)
+    del packed
+
+    bit_count, hash_count = filter_size(len(entries), false_positive_rate)
+    bits = bytearray(-(-bit_count // 128) * 16)
+    for key in entries:
+        for position in _bit_positions(key, hash_count, bit_count):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, hash_count, 0, bit_count, len(entries)))
+        f.write(bits)
+        f.write(b''.join(entries))
+    # Workers still holding the old file keep their mapping of it
+    os.replace(tmp_path, path)
+
+    return {
+        'entries': len(entries),
+        'duplicates': duplicates,
+        'invalid': invalid,
+        'bits': bit_count,
+        'hashes': hash_count,
+        'bytes': HEADER.size + len(bits) + len(entries) * ENTRY_SIZE,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+class ThreatFeed:
+    """
+    Read-only view of a feed file through ``mmap``.
+
+    Args:
+        path (str or Path): File written by ``build_threat_feed()``
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ThreatFeedError(f'Empty threat feed file: {path}')
+        if len(self._map) < HEADER.size:
+            raise ThreatFeedError(f'Not a threat feed file: {path}')
+        magic, self.hash_count, _, self.bit_count, self.entries = (
+            HEADER.unpack_from(self._map)
+        )
+        if magic != MAGIC:
+            raise ThreatFeedError(f'Not a threat feed file: {path}')
+        self._entries_offset = HEADER.size + -(-self.bit_count // 128) * 16
+        if len(self._map) != self._entries_offset + self.entries * ENTRY_SIZE:
+            raise ThreatFeedError(f'Truncated threat feed file: {path}')
+
+    def __len__(self):
+        return self.entries
+
+    def might_contain(self, packed):
+        """Bloom filter test: False means definitely not in the feed."""
+        bits = self._map
+        for position in _bit_positions(packed, self.hash_count,
+                                       self.bit_count):
+            if not bits[HEADER.size + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def contains_exact(self, packed):
+        """Binary search the sorted entries for a packed address."""
+        data, offset = self._map, self._entries_offset
+        low, high = 0, self.entries
+        while low < high:
+            middle = (low + high) // 2
+            start = offset + middle * ENTRY_SIZE
+            key = data[start:start + ENTRY_SIZE]
+            if key < packed:
+                low = middle + 1
+            elif key > packed:
+                high = middle
+            else:
+                return True
+        return False
+
+    def __contains__(self, ip_address):
+        """
+        Check an address: Bloom filter first, then the exact entries.
+
+        Args:
+            ip_address (str): IP address
+
+        Returns:
+            bool: True only if the address is really in the feed
+        """
+        try:
+            packed = pack_ip(ip_address)
+        except ValueError:
+            return False
+        if not self.might_contain(packed):
+            return False
+        if self.contains_exact(packed):
+            registry.inc('ip_tracking_threat_feed_checks_total', result='hit')
+            return True
+        registry.inc('ip_tracking_threat_feed_checks_total',
+                     result='false_positive')
+        return False
+
+    def close(self):
+        self._map.close()
+
+
+class ThreatFeedFilter:
+    """
+    The worker's current feed, reloaded when the file is rebuilt.
+
+    Without ``IP_TRACKING_THREAT_FEED`` (or before the file exists)
+    nothing is blocked.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, 'IP_TRACKING_THREAT_FEED', None)
+        self._feed = None
+        self._mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def feed(self):
+        """The mapped ThreatFeed, or None if no file is available."""
+        if time.monotonic() >= self._next_check:
+            self._maybe_reload()
+        return self._feed
+
+    def is_listed(self, ip_address):
+        """
+        Check if an address is in the threat feed.
+
+        Args:
+            ip_address (str): IP address
+
+        Returns:
+            bool: True if the feed lists the address
+        """
+        feed = self.feed
+        return feed is not None and ip_address in feed
+
+    def _maybe_reload(self):
+        """Map the feed file if it is new or has been rebuilt."""
+        with self._lock:
+            if time.monotonic() < self._next_check:
+                return
+            self._next_check = time.monotonic() + RELOAD_CHECK_SECONDS
+            if not self.path:
+                return
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                return
+            if mtime == self._mtime:
+                return
+            self._mtime = mtime
+            try:
+                feed = ThreatFeed(self.path)
+            except (OSError, ThreatFeedError):
+                # Keep serving the previous feed
+                logger.exception('Could not load threat feed %s', self.path)
+                return
+            # The old mapping is left to the garbage collector, as
+            # another thread may still be reading it
+            self._feed = feed
+            registry.inc('ip_tracking_threat_feed_reloads_total')
+
+
+# Shared per-process filter used by the middleware
+threat_feed = ThreatFeedFilter()
@@ -1,12 +1,15 @@
+from django.conf import settings
 from django.contrib.auth import authenticate, login
-from django.http import HttpResponse
-from django_ratelimit.decorators import ratelimit
+from django.http import HttpResponse, HttpResponseForbidden
 from django.contrib.auth.decorators import user_passes_test
 
+from . import metrics
+from .ratelimit import ratelimit
+
 def is_authenticated(user):
     return user.is_authenticated
 
-# Rate-limited login view
+# Rate-limited login view: both limits are checked in one round trip
 @ratelimit(key='ip', rate='5/m', method='POST', block=True, group='login_anon')
 @ratelimit(key='user', rate='10/m', method='POST', block=True, group='login_auth')
 def login_view(request):
@@ -19,4 +22,30 @@ def login_view(request):
             return HttpResponse("Login successful")
         else:
             return HttpResponse("Invalid credentials", status=401)
-    return HttpResponse("Method not allowed", status=405)
\ No newline at end of file
+    return HttpResponse("Method not allowed", status=405)
+
+# Default clients allowed to scrape the metrics endpoint
+DEFAULT_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+
+def metrics_view(request):
+    """
+    Serve tracking metrics in the Prometheus text format.
+
+    Shows every worker's series, labelled by worker, by default;
+    ``?scope=local`` shows only the process that answered. Only clients whose
+    REMOTE_ADDR is in ``IP_TRACKING_METRICS_ALLOWED_IPS`` may scrape
+    (set it to None to allow everyone).
+    """
+    allowed = getattr(
+        settings, 'IP_TRACKING_METRICS_ALLOWED_IPS',
+        DEFAULT_METRICS_ALLOWED_IPS
+    )
+    if allowed is not None and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden("Forbidden")
+
+    scope = 'local' if request.GET.get('scope') == 'local' else 'all'
+    return HttpResponse(
+        metrics.render(metrics.collect(scope)),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
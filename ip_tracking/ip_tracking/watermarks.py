@@ -0,0 +1,66 @@
+"""
+Upper bounds for the RequestLog id watermarks of incremental jobs.
+
+Jobs such as the hourly rollup and anomaly detection remember the last
+RequestLog id they processed and only read rows above it next time. On
+databases where ids are handed out when a row is inserted but become
+visible when its transaction commits (PostgreSQL, MySQL), a slow
+transaction can commit a lower id after a higher one is already visible.
+Advancing the watermark straight to ``MAX(id)`` would skip it for good.
+
+``settled_max_id()`` therefore only hands out ids that were already
+allocated ``IP_TRACKING_WATERMARK_LAG_SECONDS`` ago: every transaction
+holding a lower id has committed (or rolled back) by then, as long as
+log inserts finish within the lag. Each job keeps its last observation
+of ``MAX(id)`` in a second ProcessingWatermark row named ``<job>:seen``.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import ProcessingWatermark, RequestLog
+
+# Default seconds an id must have been allocated before a job reads it
+DEFAULT_LAG_SECONDS = 10
+
+
+def get_watermark_lag():
+    """Return the configured watermark lag in seconds."""
+    return getattr(
+        settings, 'IP_TRACKING_WATERMARK_LAG_SECONDS', DEFAULT_LAG_SECONDS
+    )
+
+
+def settled_max_id(name):
+    """
+    Highest RequestLog id a job may advance its watermark to.
+
+    Returns the ``MAX(id)`` observed by the job's previous call once that
+    observation is at least the lag old, and records the current maximum
+    for a later call. Until then it returns 0, so the job does not move
+    past ids it already read.
+
+    Args:
+        name (str): Name of the job's ProcessingWatermark
+
+    Returns:
+        int: Upper id bound (inclusive), 0 if nothing is settled yet
+    """
+    max_id = RequestLog.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    lag = get_watermark_lag()
+    if lag <= 0:
+        return max_id
+
+    seen, created = ProcessingWatermark.objects.get_or_create(
+        name=f'{name}:seen', defaults={'last_id': max_id}
+    )
+    if created or seen.updated_at > timezone.now() - timedelta(seconds=lag):
+        return 0
+
+    settled = seen.last_id
+    seen.last_id = max_id
+    seen.save(update_fields=['last_id', 'updated_at'])
+    return settled
@@ -48,9 +48,18 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'ip_tracking.middleware.IPTrackingMiddleware',
-    'ip_tracking.middleware.IPTrackingMiddlewareAsync',
-    'ip_tracking.middleware.RequestLoggingMiddleware'
+    # Single-pass block check + logging, async-native, also runs under WSGI
+    'ip_tracking.middleware.TrackingMiddleware',
+]
+
+# Tracking pipeline stages, in order. Remove a stage to disable it.
+IP_TRACKING_PIPELINE = [
+    'ip_tracking.pipeline.ResolveIPStage',
+    'ip_tracking.pipeline.ThreatFeedStage',
+    'ip_tracking.pipeline.BlockCheckStage',
+    'ip_tracking.pipeline.RateCountStage',
+    'ip_tracking.pipeline.GeoEnrichStage',
+    'ip_tracking.pipeline.LogEmitStage',
 ]
 
 ROOT_URLCONF = 'ip_trackingproject.urls'
@@ -129,6 +138,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 RATELIMIT_ENABLE = True
 RATELIMIT_CACHE_PREFIX = 'ratelimit_'
 RATELIMIT_USE_CACHE = 'default'  # Uses Django's default cache backend
+# @ratelimit counters: 'redis' (one Lua call per request) or 'local'
+IP_TRACKING_RATELIMIT_BACKEND = 'redis'
 
 
 # Celery configuration
@@ -138,6 +149,56 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+CELERY_BEAT_SCHEDULE = {
+    # Backfill country/city for logs the middleware could not resolve
+    'enrich-request-logs': {
+        'task': 'ip_tracking.tasks.enrich_request_logs',
+        'schedule': 60.0,
+    },
+    # Incremental, so it can run every minute instead of hourly
+    'detect-anomalies': {
+        'task': 'ip_tracking.tasks.detect_anomalies',
+        'schedule': 60.0,
+    },
+    'purge-request-logs': {
+        'task': 'ip_tracking.tasks.purge_request_logs',
+        'schedule': 24 * 60 * 60.0,
+    },
+}
+
+# Anomaly detection
+IP_TRACKING_ANOMALY_THRESHOLD = 100  # Max requests per IP per window
+IP_TRACKING_ANOMALY_WINDOW_SECONDS = 60 * 60  # Sliding window length
+# Seeded the initial DetectionRule rows (edit those instead); requests
+# matching an active rule are never sampled
+IP_TRACKING_SENSITIVE_PATHS = ['/admin', '/login']
+# Upper bound (seconds) before a DetectionRule change is recompiled
+IP_TRACKING_RULES_REFRESH_SECONDS = 5
+# IP-hash shards per run, each a Celery task (needs a result backend for
+# the chord); results do not depend on the count, 1 runs in one task
+IP_TRACKING_DETECTION_SHARDS = 4
+
+# Incremental jobs only read RequestLog ids allocated at least this many
+# seconds ago, so rows committed late under a lower id are not skipped
+# (0 reads up to the current maximum; fine on SQLite)
+IP_TRACKING_WATERMARK_LAG_SECONDS = 10
+
+# Metrics endpoint (/metrics): each worker publishes its counters to the
+# cache this often, and only these client addresses may scrape
+IP_TRACKING_METRICS_PUBLISH_SECONDS = 15
+IP_TRACKING_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Retention per table in days (None = keep forever)
+IP_TRACKING_RETENTION_DAYS = {
+    'RequestLog': 90,
+    'RequestLogHourly': 365,
+    'SuspiciousIP': None,
+}
+
+# Real-time rate counting in the tracking pipeline (same threshold/window)
+IP_TRACKING_RATE_COUNTER = 'cache'  # 'cache' (shared) or 'local' (per process)
+IP_TRACKING_RATE_ACTION = 'flag'  # 'flag' or 'block' (temporary BlockedIP)
+IP_TRACKING_RATE_BLOCK_SECONDS = 60 * 60
 
 
 CACHES = {
@@ -157,7 +218,42 @@ CACHES = {
     }
 }
 
-# Geolocation configuration
+# Blocklist snapshot: max seconds before a worker sees a block/unblock
+IP_TRACKING_BLOCKLIST_REFRESH_SECONDS = 5
+
+# RequestLog write buffer (per worker process)
+IP_TRACKING_LOG_BATCH_SIZE = 500  # Flush once this many records are queued
+IP_TRACKING_LOG_FLUSH_SECONDS = 2.0  # ...or once the oldest is this old
+IP_TRACKING_LOG_BUFFER_SIZE = 10000  # Drop (and count) records beyond this
+
+# Shared log spool: when set, workers append to this memory-mapped file
+# instead of the buffer above, and `manage.py drain_request_logs` inserts
+# the records (run one per host). Slots are 1 KiB each.
+IP_TRACKING_LOG_SPOOL = None  # e.g. '/dev/shm/ip_tracking.spool'
+IP_TRACKING_LOG_SPOOL_SLOTS = 32768  # Records beyond this are dropped (counted)
+
+# Log only a fraction of low-value requests; kept rows carry the weight
+# (longest prefix wins, 'method' is optional, sensitive paths never sampled)
+IP_TRACKING_LOG_SAMPLING = [
+    # {'prefix': '/static/', 'method': 'GET', 'rate': 0.01},
+]
+
+# Path/user agent -> lookup id LRU entries (per table, per worker)
+IP_TRACKING_INTERN_CACHE_SIZE = 10000
+
+# Threat feed filter, built with `manage.py build_threat_feed`
+IP_TRACKING_THREAT_FEED = BASE_DIR / 'feeds' / 'threat_feed.bin'
+
+# Offline geolocation database, built with `manage.py build_geo_database`
+IP_TRACKING_GEO_DATABASE = BASE_DIR / 'geo' / 'ip_ranges.bin'
+IP_TRACKING_GEO_HTTP_FALLBACK = True  # Query ipinfo for uncovered IPs
+IP_TRACKING_GEO_LOCAL_CACHE_SIZE = 10000  # Per-process LRU of lookups
+IP_TRACKING_GEO_LOCAL_CACHE_SECONDS = 5 * 60
+IP_TRACKING_GEO_NEGATIVE_CACHE_SECONDS = 60  # Failed lookups / cache misses
+IP_TRACKING_GEO_BREAKER_FAILURES = 5  # Consecutive provider errors to open
+IP_TRACKING_GEO_BREAKER_RESET_SECONDS = 30  # Then one trial call
+
+# Geolocation configuration (HTTP fallback provider)
 IPGEOLOCATION_SETTINGS = {
     'backend': 'ipinfo',  # Use ipinfo.io as the geolocation provider
     'api_key': 'your_ipinfo_api_key_here',  # Replace with your actual API key